@@ -0,0 +1,268 @@
+# Relative path: admission.py
+"""
+Admission control for the CPU and memory heavy endpoints.
+
+Every request reserves a slot and an estimate of the memory it will need (from its section
+count, ad length or script length) in a ledger shared by all workers on the host
+(ADMISSION_DIR/ledger.json, updated under an exclusive file lock). A request is admitted while
+fewer than ADMISSION_MAX_CONCURRENT requests run and their reservations fit ADMISSION_MEMORY_BUDGET_MB.
+Otherwise it waits in a FIFO queue for at most ADMISSION_QUEUE_TIMEOUT seconds. Requests that
+cannot be served soon are rejected at once, with a Retry-After header:
+  - 429 when the user already has ADMISSION_MAX_PER_USER requests running or queued,
+  - 503 when the queue holds ADMISSION_QUEUE_LIMIT requests, or the wait timed out.
+Entries of processes that died (e.g. a worker killed by the gunicorn timeout) are dropped.
+
+Routes whose identical requests are coalesced (single_flight) admit the work inside the leader
+with run_admitted, so followers wait for the leader's result without holding a slot or a
+reservation. The other routes are wrapped in admission_controlled.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import tempfile
+from functools import wraps
+from contextlib import contextmanager
+
+from flask import Response, request, jsonify
+
+from config import Config
+from metrics import register_gauge_provider
+from processes import process_is_alive
+
+config = Config()
+
+POLL_INTERVAL = 0.05  # seconds between two checks of a queued request
+
+
+class AdmissionRejected(Exception):
+    """Raised by run_admitted when the request is rejected. `rejection` is the rejection of request_admission."""
+    def __init__(self, rejection):
+        super().__init__(rejection["error"])
+        self.rejection = rejection
+
+
+def estimate_request_bytes(route, data):
+    """
+    Peak memory a request is expected to need, from the size of the audio it will hold. Malformed
+    fields count as ADMISSION_BASE_MB, the view reports them once the request is admitted.
+    """
+    try:
+        megabytes = _estimate_request_megabytes(route, data)
+    except (TypeError, ValueError, AttributeError):
+        megabytes = config.ADMISSION_BASE_MB
+    return int(megabytes * 2**20)
+
+def _estimate_request_megabytes(route, data):
+    megabytes = config.ADMISSION_BASE_MB
+    if route in ("/produce-spot", "/stitch-sections"):
+        megabytes += len(data.get('history_item_id_list') or []) * config.ADMISSION_SECTION_MB
+    elif route == "/generate-mix":
+        megabytes += float(data.get('ad_length') or 0) * config.ADMISSION_AUDIO_SECOND_MB
+    elif route == "/render-variants":
+        megabytes += len(data.get('history_item_id_list') or []) * config.ADMISSION_SECTION_MB
+        # Variants without an ad length are as long as the voiceover, assume a minute
+        megabytes += sum(float(variant.get('ad_length') or 60) for variant in data.get('variants') or []) \
+            * config.ADMISSION_AUDIO_SECOND_MB
+    elif route == "/preprocess-voiceover":
+        spoken_seconds = len(data.get('script') or "") / 15  # About 15 characters are spoken per second
+        megabytes += spoken_seconds * config.ADMISSION_AUDIO_SECOND_MB
+    return megabytes
+
+
+@contextmanager
+def _ledger():
+    """The host wide ledger {"running": {id: ticket}, "waiting": [ticket], "rejected": {reason: count}}, locked."""
+    os.makedirs(config.ADMISSION_DIR, exist_ok=True)
+    ledger_path = os.path.join(config.ADMISSION_DIR, "ledger.json")
+    with open(os.path.join(config.ADMISSION_DIR, "ledger.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(ledger_path) as ledger_file:
+                    ledger = json.load(ledger_file)
+            except (FileNotFoundError, ValueError):
+                ledger = {"running": {}, "waiting": [], "rejected": {}}
+
+            # Forget the requests of dead workers, and queued requests nobody polls anymore
+            abandoned_before = time.time() - 2 * config.ADMISSION_QUEUE_TIMEOUT
+            ledger["running"] = {ticket_id: ticket for ticket_id, ticket in ledger["running"].items()
+                                 if process_is_alive(ticket["pid"])}
+            ledger["waiting"] = [ticket for ticket in ledger["waiting"]
+                                 if process_is_alive(ticket["pid"]) and ticket["queued_at"] > abandoned_before]
+            yield ledger
+
+            file_descriptor, temp_path = tempfile.mkstemp(dir=config.ADMISSION_DIR, suffix=".tmp")
+            with os.fdopen(file_descriptor, "w") as temp_file:
+                json.dump(ledger, temp_file)
+            os.replace(temp_path, ledger_path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _fits(ledger, ticket):
+    if not ledger["running"]:
+        return True  # A request larger than the whole budget still runs, alone
+    reserved_bytes = sum(running["bytes"] for running in ledger["running"].values())
+    return (len(ledger["running"]) < config.ADMISSION_MAX_CONCURRENT
+            and reserved_bytes + ticket["bytes"] <= config.ADMISSION_MEMORY_BUDGET_MB * 2**20)
+
+def _reject(ledger, reason, status, message):
+    ledger["rejected"][reason] = ledger["rejected"].get(reason, 0) + 1
+    return {"status": status, "error": message, "retry_after": config.ADMISSION_RETRY_AFTER}
+
+
+def request_admission(route, data):
+    """
+    Admit a request, queue it, or reject it.
+
+    Returns:
+    tuple: (ticket, None) for an admitted or queued request, where ticket["admitted"] tells which,
+           or (None, {"status", "error", "retry_after"}) for a rejected one.
+    """
+    if not isinstance(data, dict):
+        data = {}  # The view rejects the body itself
+    user_id = data.get('user_id')
+    ticket = {"id": uuid.uuid4().hex, "pid": os.getpid(), "user_id": user_id, "route": route,
+              "bytes": estimate_request_bytes(route, data), "queued_at": time.time(), "admitted": False}
+    with _ledger() as ledger:
+        if user_id is not None:
+            user_requests = [queued for queued in list(ledger["running"].values()) + ledger["waiting"]
+                             if queued["user_id"] == user_id]
+            if len(user_requests) >= config.ADMISSION_MAX_PER_USER:
+                return None, _reject(ledger, "user_limit", 429,
+                                     f"Too many requests in progress for user {user_id}, retry later")
+
+        if not ledger["waiting"] and _fits(ledger, ticket):
+            ticket["admitted"] = True
+            ledger["running"][ticket["id"]] = ticket
+        elif len(ledger["waiting"]) >= config.ADMISSION_QUEUE_LIMIT:
+            return None, _reject(ledger, "queue_full", 503, "The server is busy, retry later")
+        else:
+            ledger["waiting"].append(ticket)
+    return ticket, None
+
+def poll_admission(ticket):
+    """Admit a queued request once it is first in the queue and fits. Returns whether it is admitted."""
+    with _ledger() as ledger:
+        if ticket["id"] in ledger["running"]:
+            return True
+        if ledger["waiting"] and ledger["waiting"][0]["id"] == ticket["id"] and _fits(ledger, ticket):
+            ledger["waiting"].pop(0)
+            ticket["admitted"] = True
+            ledger["running"][ticket["id"]] = ticket
+            return True
+        if not any(queued["id"] == ticket["id"] for queued in ledger["waiting"]):
+            ledger["waiting"].append(ticket)  # Dropped as abandoned while this worker was busy
+    return False
+
+def _queue_timeout_rejection(ticket):
+    with _ledger() as ledger:
+        ledger["waiting"] = [queued for queued in ledger["waiting"] if queued["id"] != ticket["id"]]
+        return _reject(ledger, "queue_timeout", 503, "The server is busy, retry later")
+
+def wait_for_admission(ticket):
+    """Block until a queued request is admitted. Returns None, or the rejection when the wait timed out."""
+    deadline = ticket["queued_at"] + config.ADMISSION_QUEUE_TIMEOUT
+    while not ticket["admitted"] and not poll_admission(ticket):
+        if time.time() >= deadline:
+            return _queue_timeout_rejection(ticket)
+        time.sleep(POLL_INTERVAL)
+    return None
+
+async def wait_for_admission_async(ticket, run_io):
+    """wait_for_admission for the event loop, `run_io` runs the ledger updates off the loop."""
+    deadline = ticket["queued_at"] + config.ADMISSION_QUEUE_TIMEOUT
+    while not ticket["admitted"] and not await run_io(poll_admission, ticket):
+        if time.time() >= deadline:
+            return await run_io(_queue_timeout_rejection, ticket)
+        await asyncio.sleep(POLL_INTERVAL)
+    return None
+
+def release_admission(ticket):
+    """Free the slot and memory reservation of a finished request."""
+    with _ledger() as ledger:
+        ledger["running"].pop(ticket["id"], None)
+        ledger["waiting"] = [queued for queued in ledger["waiting"] if queued["id"] != ticket["id"]]
+
+
+def run_admitted(route, data, function):
+    """
+    Run function() once the request is admitted, and release its slot when it returns.
+
+    Raises:
+    AdmissionRejected: When the request is rejected, or timed out in the queue.
+    """
+    if not config.ADMISSION_ENABLED:
+        return function()
+    ticket, rejection = request_admission(route, data)
+    if ticket is not None:
+        rejection = wait_for_admission(ticket)
+    if rejection is not None:
+        raise AdmissionRejected(rejection)
+    try:
+        return function()
+    finally:
+        release_admission(ticket)
+
+async def run_admitted_async(route, data, coroutine_function, run_io):
+    """run_admitted for the event loop, `run_io` runs the ledger updates off the loop."""
+    if not config.ADMISSION_ENABLED:
+        return await coroutine_function()
+    ticket, rejection = await run_io(request_admission, route, data)
+    if ticket is not None:
+        rejection = await wait_for_admission_async(ticket, run_io)
+    if rejection is not None:
+        raise AdmissionRejected(rejection)
+    try:
+        return await coroutine_function()
+    finally:
+        await run_io(release_admission, ticket)
+
+def rejection_response(rejection):
+    """Flask response of a rejected request, with its Retry-After header."""
+    response = jsonify({"error": rejection["error"]})
+    response.headers["Retry-After"] = str(rejection["retry_after"])
+    return response, rejection["status"]
+
+def admission_controlled(view_function):
+    """Route decorator admitting the request first. Streamed responses keep their slot until they are sent."""
+    @wraps(view_function)
+    def decorated_function(*args, **kwargs):
+        if not config.ADMISSION_ENABLED:
+            return view_function(*args, **kwargs)
+        ticket, rejection = request_admission(request.path, request.get_json(silent=True) or {})
+        if ticket is not None:
+            rejection = wait_for_admission(ticket)
+        if rejection is not None:
+            return rejection_response(rejection)
+
+        try:
+            response = view_function(*args, **kwargs)
+        except BaseException:
+            release_admission(ticket)
+            raise
+        if isinstance(response, Response) and response.is_streamed:
+            response.call_on_close(lambda: release_admission(ticket))
+        else:
+            release_admission(ticket)
+        return response
+    return decorated_function
+
+
+def admission_gauges():
+    """Host wide admission state for /metrics."""
+    with _ledger() as ledger:
+        return [
+            ("pyro_admission_queue_depth", "gauge", "Requests waiting for admission.", {}, len(ledger["waiting"])),
+            ("pyro_admission_running", "gauge", "Admitted requests in progress.", {}, len(ledger["running"])),
+            ("pyro_admission_reserved_bytes", "gauge", "Memory reserved by the admitted requests.", {},
+             sum(ticket["bytes"] for ticket in ledger["running"].values())),
+        ] + [
+            ("pyro_admission_rejections_total", "counter", "Requests rejected by admission control.",
+             {"reason": reason}, count)
+            for reason, count in sorted(ledger["rejected"].items())
+        ]
+
+register_gauge_provider(admission_gauges)
@@ -0,0 +1,333 @@
+# Relative path: asgi_api.py
+"""
+Async serving mode: gunicorn asgi_api:app -k uvicorn.workers.UvicornWorker
+
+/preprocess-voiceover, /stitch-sections and /produce-spot are served by coroutines, so one worker
+keeps hundreds of requests in flight while they wait on ElevenLabs and S3:
+  - ElevenLabs is called through its async (httpx) client,
+  - S3 transfers and ffmpeg runs go to a thread pool (the pooled boto3 client is thread safe),
+  - pause removal, time-stretching and other DSP go to the section process pool.
+Every other route, and the same routes under a non-POST method, are handed to the Flask app
+unchanged, which keeps serving the sync mode through gunicorn flask_api:app.
+"""
+import json
+import queue
+import asyncio
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+
+from config import Config
+from flask_api import app as flask_app, new_pyro_object, mix_and_upload_spot, parse_preprocess_voiceover_request
+from flask_api import cached_preprocessed_voiceover, remember_preprocessed_voiceover
+from utils import upload_audio_segment_to_s3, stitch_audio_segments, render_preprocessed_voiceover
+from utils import plan_voiceover_shards, shard_retry_delay, render_preprocessed_voiceover_shards
+from utils import cached_section, finish_fetched_section, finish_section_in_pool, reusable_sections, stitch_after_prefix
+from utils import decode_audio_stream_to_pcm, _download_audio_from_s3, _get_section_process_pool
+from audio_cache import get_cached_audio, put_cached_audio
+from single_flight import single_flight_async
+from metrics import start_request_trace, finish_request_trace, increment_counter, timed_iteration
+from admission import run_admitted_async, AdmissionRejected
+from music_library import UnknownLibraryFile
+
+config = Config()
+logger = logging.getLogger(__name__)
+
+# Flask requests run on their own thread pool, like the threads of a gthread worker
+flask_asgi_app = WSGIMiddleware(flask_app, workers=config.ASYNC_FLASK_THREADS)
+
+_elevenlabs_async_client = None
+
+def get_elevenlabs_async_client():
+    global _elevenlabs_async_client
+    if _elevenlabs_async_client is None:
+        from elevenlabs.client import AsyncElevenLabs
+        _elevenlabs_async_client = AsyncElevenLabs(api_key=config.ELEVENLABS_API_KEY)
+    return _elevenlabs_async_client
+
+async def run_io(function, *args):
+    """Run a blocking network or subprocess call on the I/O thread pool, in the context (request trace) of the caller."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(contextvars.copy_context().run, function, *args))
+
+async def run_cpu(function, *args):
+    """Run CPU-bound DSP on the section process pool, or a thread when SECTION_PROCESS_WORKERS is 0."""
+    if config.SECTION_PROCESS_WORKERS > 0:
+        return await asyncio.get_running_loop().run_in_executor(_get_section_process_pool(), function, *args)
+    return await run_io(function, *args)
+
+
+async def synthesize_voiceover_async(text_input, voice_id, model_id, output_format="mp3_44100_192", intonation_consistency=0.5):
+    """Async counterpart of synthesize_voiceover, decoding the audio while ElevenLabs is still synthesizing."""
+    from elevenlabs.types import VoiceSettings
+    audio_stream = await get_elevenlabs_async_client().generate(
+        text=text_input,
+        voice=voice_id,
+        model=model_id,
+        output_format=output_format,
+        voice_settings=VoiceSettings(stability=intonation_consistency, similarity_boost=0.75),
+    )
+    return await decode_async_audio_stream_to_pcm(audio_stream, format="mp3", stage_name="synthesize")
+
+async def synthesize_voiceover_shards_async(shards, voice_id, model_id, output_format="mp3_44100_192", intonation_consistency=0.5):
+    """
+    Async counterpart of utils.generate_sharded_voiceover that returns the decoded audio of every
+    shard, unstitched. At most SYNTHESIS_SHARD_CONCURRENCY shards are in flight, a failed one is retried on its own.
+    """
+    shard_slots = asyncio.Semaphore(config.SYNTHESIS_SHARD_CONCURRENCY)
+
+    async def synthesize_shard_async(shard_index, shard):
+        async with shard_slots:
+            for attempt in range(config.SYNTHESIS_SHARD_RETRIES + 1):
+                try:
+                    return await synthesize_voiceover_async(shard.text, voice_id, model_id, output_format, intonation_consistency)
+                except Exception as e:
+                    if attempt == config.SYNTHESIS_SHARD_RETRIES:
+                        raise RuntimeError(f"Shard {shard_index} failed after {attempt + 1} attempts: {e}") from e
+                    print(f"Failed to synthesize shard {shard_index}, retrying. Error: {e}")
+                    increment_counter("pyro_synthesis_shard_retries_total", "Shards synthesized again after a failed attempt.")
+                    await asyncio.sleep(shard_retry_delay(attempt))
+
+    return await asyncio.gather(*[synthesize_shard_async(shard_index, shard) for shard_index, shard in enumerate(shards)])
+
+async def decode_async_audio_stream_to_pcm(byte_chunks, format="mp3", stage_name="fetch"):
+    """
+    Async counterpart of decode_audio_stream_to_pcm: the chunks are received on the event loop and
+    decoded on the I/O thread pool as they arrive, never joined in memory first. The time spent
+    waiting for them is recorded as the `stage_name` stage.
+    """
+    received_chunks = queue.Queue()
+
+    def chunks_received():
+        while True:
+            chunk = received_chunks.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if chunk is None:
+                return
+            yield chunk
+
+    async def receive():
+        try:
+            async for chunk in byte_chunks:
+                received_chunks.put(chunk)
+        except BaseException as e:
+            received_chunks.put(e)  # Stops the decoder, which otherwise waits for the end of the stream
+            raise
+        received_chunks.put(None)
+
+    received, decoded = await asyncio.gather(
+        receive(), run_io(decode_audio_stream_to_pcm, timed_iteration(stage_name, chunks_received()), format),
+        return_exceptions=True)
+    for outcome in (received, decoded):
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return decoded
+
+async def fetch_voiceover_async(history_item_id):
+    """Async counterpart of generate_voiceover_from_history_item_id, sharing its cache."""
+    cached_voiceover = await run_io(get_cached_audio, "voiceovers", history_item_id)
+    if cached_voiceover is not None:
+        return cached_voiceover
+
+    try:
+        if history_item_id.split('_')[0] == 'pyro':
+            voiceover = await run_io(_download_audio_from_s3, 'workingdir--storage', f"primary--distribution/{history_item_id}")
+        else:
+            voiceover = await decode_async_audio_stream_to_pcm(
+                get_elevenlabs_async_client().history.get_audio(history_item_id), format="mp3")
+    except Exception as e:
+        print(f"Failed to fetch the voiceover. Error: {e}")
+        return None
+
+    if voiceover is not None:
+        ttl = None if history_item_id.startswith("pyro_") else config.ELEVENLABS_HISTORY_CACHE_TTL
+        await run_io(functools.partial(put_cached_audio, "voiceovers", history_item_id, voiceover, ttl=ttl))
+    return voiceover
+
+async def process_sections_async(history_item_id_list, end_of_section_pause_duration_list):
+    """Async counterpart of process_sections, at most SECTION_CONCURRENCY sections in flight per request."""
+    section_slots = asyncio.Semaphore(config.SECTION_CONCURRENCY)
+
+    async def process_section_async(history_item_id, end_of_section_pause_duration):
+        section = await run_io(cached_section, history_item_id, end_of_section_pause_duration)
+        if section is not None:
+            return section
+        async with section_slots:
+            section_voiceover_segment = await fetch_voiceover_async(history_item_id)
+            # The steps after the fetch are those of the sync process_section
+            return await run_io(finish_fetched_section, history_item_id, end_of_section_pause_duration,
+                                section_voiceover_segment, finish_section_in_pool)
+
+    return await asyncio.gather(*[
+        process_section_async(history_item_id, pause)
+        for history_item_id, pause in zip(history_item_id_list, end_of_section_pause_duration_list)
+    ])
+
+async def process_and_stitch_sections_async(history_item_id_list, end_of_section_pause_duration_list):
+    """Async counterpart of process_and_stitch_sections, sharing its caches."""
+    if not history_item_id_list:
+        return stitch_audio_segments([])
+    prefix_keys, prefix, remaining = await run_io(reusable_sections, history_item_id_list,
+                                                  end_of_section_pause_duration_list)
+    if not remaining:
+        return prefix
+
+    sections = [section for _, _, section in remaining]
+    missing = [index for index, section in enumerate(sections) if section is None]
+    processed_sections = await process_sections_async([remaining[index][0] for index in missing],
+                                                      [remaining[index][1] for index in missing])
+    for index, section in zip(missing, processed_sections):
+        sections[index] = section
+    return await run_io(stitch_after_prefix, prefix_keys, history_item_id_list, prefix, sections)
+
+
+async def stitch_sections_async(data):
+    """Async counterpart of flask_api.stitch_sections_pipeline."""
+    end_of_section_pause_duration_milliseconds_list = [duration * 1000 for duration in data.get('end_of_section_pause_duration_list')]
+    stitched_voiceover = await process_and_stitch_sections_async(data.get('history_item_id_list'),
+                                                                 end_of_section_pause_duration_milliseconds_list)
+
+    pyro_history_item_id, bucket_name, object_name = new_pyro_object('stitched_voiceover_', data.get('user_id'), '.wav')
+    if not await run_io(upload_audio_segment_to_s3, stitched_voiceover, bucket_name, object_name):
+        raise RuntimeError("Failed to upload the audio")
+    logger.info("Generated voiceover pyro_history_item_id and uploaded to S3: %s", pyro_history_item_id)
+    return pyro_history_item_id
+
+async def produce_spot_async(data):
+    """Async counterpart of flask_api.produce_spot_pipeline."""
+    end_of_section_pause_duration_milliseconds_list = [duration * 1000 for duration in data.get('end_of_section_pause_duration_list')]
+    stitched_voiceover = await process_and_stitch_sections_async(data.get('history_item_id_list'),
+                                                                 end_of_section_pause_duration_milliseconds_list)
+    logger.info("Stitched %s sections into %s ms of voiceover", len(data.get('history_item_id_list')), stitched_voiceover.duration_ms)
+
+    # Mixing runs block by block into the ffmpeg encoder and the S3 upload, all on one I/O thread
+    return await run_io(mix_and_upload_spot, stitched_voiceover, data.get('user_id'),
+                        data.get('music_filename', "No Music"), float(data.get('music_vol', 0.1)))
+
+async def preprocess_voiceover_async(data):
+    """Async counterpart of flask_api.preprocess_voiceover_pipeline."""
+    voiceover_request = parse_preprocess_voiceover_request(data)
+    cached_pyro_history_item_id = await run_io(cached_preprocessed_voiceover, voiceover_request)
+    if cached_pyro_history_item_id:
+        return cached_pyro_history_item_id
+
+    shards, mood_phrase_in_every_shard = plan_voiceover_shards(voiceover_request['script'])
+    if voiceover_request['sharded'] and len(shards) > 1:
+        shard_voiceovers = await synthesize_voiceover_shards_async(shards, voiceover_request['voice'],
+                                                                   voiceover_request['model_id'], "mp3_44100_192",
+                                                                   voiceover_request['intonation_consistency'])
+        script_voiceover = await run_cpu(render_preprocessed_voiceover_shards, shard_voiceovers, shards,
+                                         mood_phrase_in_every_shard, voiceover_request['emotion'],
+                                         voiceover_request['speech_rate'])
+    else:
+        voiceover = await synthesize_voiceover_async(voiceover_request['script'], voiceover_request['voice'],
+                                                     voiceover_request['model_id'], "mp3_44100_192",
+                                                     voiceover_request['intonation_consistency'])
+        script_voiceover = await run_cpu(render_preprocessed_voiceover, voiceover,
+                                         voiceover_request['emotion'], voiceover_request['speech_rate'])
+
+    pyro_history_item_id, bucket_name, object_name = new_pyro_object('processed_voiceover_', voiceover_request['user_id'], '.wav')
+    if not await run_io(upload_audio_segment_to_s3, script_voiceover, bucket_name, object_name):
+        raise RuntimeError("Failed to upload the audio")
+    logger.info("Uploaded audio segment to S3: bucket=%s, object=%s", bucket_name, object_name)
+    await run_io(remember_preprocessed_voiceover, voiceover_request, pyro_history_item_id)
+    return pyro_history_item_id
+
+
+def _coalesced(namespace, pipeline):
+    """Join identical requests already in flight, in this or any other worker of either mode."""
+    async def coalesced_pipeline(data):
+        return await single_flight_async(namespace, data, lambda: pipeline(data))
+    return coalesced_pipeline
+
+def _admitted(path, pipeline):
+    """
+    Admit the request before running the pipeline, through the ledger shared with the sync workers.
+    Inside _coalesced only the leader of identical requests is admitted, the others wait without a slot.
+    """
+    async def admitted_pipeline(data):
+        return await run_admitted_async(path, data, lambda: pipeline(data), run_io)
+    return admitted_pipeline
+
+def _preprocess_voiceover_error(e):
+    return {"error": "Failed to process or upload the audio", "details": str(e)}
+
+# path: (pipeline, error response body), matching the error shapes of the sync endpoints
+ASYNC_ROUTES = {
+    "/produce-spot": (_coalesced("produce_spot", _admitted("/produce-spot", produce_spot_async)),
+                      lambda e: {"error": str(e)}),
+    "/stitch-sections": (_coalesced("stitch_sections", _admitted("/stitch-sections", stitch_sections_async)),
+                         lambda e: {"error": str(e)}),
+    "/preprocess-voiceover": (_admitted("/preprocess-voiceover", preprocess_voiceover_async), _preprocess_voiceover_error),
+}
+
+async def _read_json_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return json.loads(body)
+
+async def _send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode()),
+        (b"access-control-allow-origin", b"*"),  # Same as CORS(app) on the Flask side
+        *headers,
+    ]})
+    await send({"type": "http.response.body", "body": payload})
+
+async def _serve_async_route(path, receive, send):
+    pipeline, error_body = ASYNC_ROUTES[path]
+    try:
+        data = await _read_json_body(receive)
+    except ValueError:
+        await _send_json(send, 400, {"error": "The request body must be JSON"})
+        return
+
+    logger.info("Received data at %s (async): %s", path, data)
+    trace_token = start_request_trace(path)
+    try:
+        pyro_history_item_id = await pipeline(data)
+    except AdmissionRejected as rejected:
+        rejection = rejected.rejection
+        finish_request_trace(trace_token, "POST", rejection["status"])
+        await _send_json(send, rejection["status"], {"error": rejection["error"]},
+                         headers=[(b"retry-after", str(rejection["retry_after"]).encode())])
+        return
+    except UnknownLibraryFile as e:
+        finish_request_trace(trace_token, "POST", 400)
+        await _send_json(send, 400, {"error": str(e)})
+        return
+    except Exception as e:
+        logger.error("An error occurred at %s: %s", path, e)
+        finish_request_trace(trace_token, "POST", 500)
+        await _send_json(send, 500, error_body(e))
+        return
+    finish_request_trace(trace_token, "POST", 200)
+    await _send_json(send, 200, {"pyro_history_item_id": pyro_history_item_id})
+
+async def _serve_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Size the pool shared by S3 transfers and ffmpeg runs
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=config.ASYNC_IO_THREADS))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _serve_lifespan(receive, send)
+    elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ASYNC_ROUTES:
+        await _serve_async_route(scope["path"], receive, send)
+    else:
+        await flask_asgi_app(scope, receive, send)
@@ -0,0 +1,375 @@
+# Relative path: audio_cache.py
+"""
+Two tier (memory + disk) cache of decoded PCMAudio, plus a disk cache of small JSON values
+(e.g. the pyro_history_item_id a set of synthesis inputs was rendered to).
+
+Entries are addressed by the SHA-256 of their key and grouped in namespaces, one sub directory each.
+Disk entries use a small self describing raw PCM format so they can be memory-mapped straight back
+into a PCMAudio, and are shared by every gunicorn worker on the host:
+  - writes go to a temporary file that is atomically renamed into place,
+  - eviction runs under an exclusive file lock. Writes add their size to a running total of the
+    disk tier (.size, updated under the same lock) and only scan the cache once the total exceeds
+    AUDIO_CACHE_DISK_BYTES. The total never undercounts: removed expired entries and overwritten
+    entries of racing writers make it overcount, which the next scan corrects.
+  - a reader that already mapped a file keeps its data even if another worker evicts it.
+Namespaces of values with max_entries keep a running count of their entries (.count) the same
+way. Once it exceeds max_entries they are evicted to a tenth below it, so a full namespace is not
+scanned again on every write.
+"""
+import os
+import json
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import Config
+from data_classes import PCMAudio
+
+config = Config()
+
+SIZE_FILENAME = ".size"
+COUNT_FILENAME = ".count"
+
+PCM_FILE_MAGIC = b"PYROPCM1"
+# magic, sample rate, channels, sample width, frame count, expires at (unix time, 0 = never)
+PCM_FILE_HEADER = struct.Struct("<8sIHHQd")
+
+_memory_cache = OrderedDict()
+_memory_cache_bytes = 0
+_memory_cache_lock = threading.Lock()
+_cache_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0,
+                "value_hits": 0, "value_misses": 0}
+
+
+def write_pcm_file(path, pcm_audio, expires_at=0):
+    """
+    Atomically write PCMAudio to `path` as a header followed by the raw interleaved samples.
+    The file only becomes visible once it is complete.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    samples = np.ascontiguousarray(pcm_audio.samples)
+    header = PCM_FILE_HEADER.pack(PCM_FILE_MAGIC, pcm_audio.sample_rate, pcm_audio.channels,
+                                  pcm_audio.sample_width, pcm_audio.frame_count, expires_at)
+
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            temp_file.write(header)
+            temp_file.write(samples.tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_pcm_file_header(path):
+    """Return (sample_rate, channels, sample_width, frame_count, expires_at) of a PCM file."""
+    with open(path, "rb") as pcm_file:
+        header = pcm_file.read(PCM_FILE_HEADER.size)
+    if len(header) != PCM_FILE_HEADER.size:
+        raise ValueError(f"{path} is not a PCM file")
+    magic, sample_rate, channels, sample_width, frame_count, expires_at = PCM_FILE_HEADER.unpack(header)
+    if magic != PCM_FILE_MAGIC:
+        raise ValueError(f"{path} is not a PCM file")
+    return sample_rate, channels, sample_width, frame_count, expires_at
+
+
+def read_pcm_file(path):
+    """Memory-map a file written by write_pcm_file as read-only PCMAudio."""
+    sample_rate, channels, sample_width, frame_count, _ = read_pcm_file_header(path)
+    if frame_count == 0:
+        return PCMAudio(samples=np.zeros((0, channels), dtype=f"<i{sample_width}"), sample_rate=sample_rate)
+    samples = np.memmap(path, dtype=f"<i{sample_width}", mode="r",
+                        offset=PCM_FILE_HEADER.size, shape=(frame_count, channels))
+    return PCMAudio(samples=samples, sample_rate=sample_rate)
+
+
+def _cache_path(namespace, key, extension="pcm"):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return os.path.join(config.AUDIO_CACHE_DIR, namespace, f"{digest}.{extension}")
+
+
+@contextmanager
+def _disk_cache_lock():
+    """Exclusive lock on the disk cache, shared by every process on the host."""
+    os.makedirs(config.AUDIO_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(config.AUDIO_CACHE_DIR, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _count(stat):
+    with _memory_cache_lock:
+        _cache_stats[stat] += 1
+
+
+def _remember(namespace, key, pcm_audio, expires_at):
+    global _memory_cache_bytes
+    size = pcm_audio.samples.nbytes
+    if size > config.AUDIO_CACHE_MEMORY_BYTES:
+        return
+    with _memory_cache_lock:
+        previous = _memory_cache.pop((namespace, key), None)
+        if previous is not None:
+            _memory_cache_bytes -= previous[0].samples.nbytes
+        _memory_cache[(namespace, key)] = (pcm_audio, expires_at)
+        _memory_cache_bytes += size
+        while _memory_cache_bytes > config.AUDIO_CACHE_MEMORY_BYTES:
+            _, (evicted_audio, _) = _memory_cache.popitem(last=False)
+            _memory_cache_bytes -= evicted_audio.samples.nbytes
+
+
+def _forget(namespace, key):
+    global _memory_cache_bytes
+    with _memory_cache_lock:
+        previous = _memory_cache.pop((namespace, key), None)
+        if previous is not None:
+            _memory_cache_bytes -= previous[0].samples.nbytes
+
+
+def get_cached_audio(namespace, key):
+    """
+    Look a key up in memory, then on disk.
+
+    Returns:
+    PCMAudio: The cached (read-only) audio, or None on a miss or an expired entry.
+    """
+    now = time.time()
+    with _memory_cache_lock:
+        entry = _memory_cache.get((namespace, key))
+        if entry is not None and (not entry[1] or entry[1] > now):
+            _memory_cache.move_to_end((namespace, key))
+            _cache_stats["memory_hits"] += 1
+            return entry[0]
+    if entry is not None:
+        _forget(namespace, key)
+
+    path = _cache_path(namespace, key)
+    try:
+        expires_at = read_pcm_file_header(path)[4]
+        if expires_at and expires_at <= now:
+            os.remove(path)
+            _count("expired")
+            _count("misses")
+            return None
+        pcm_audio = read_pcm_file(path)
+        os.utime(path)  # mtime doubles as the last access time for LRU eviction
+    except FileNotFoundError:
+        _count("misses")
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache entry {path}. Error: {e}")
+        _count("misses")
+        return None
+
+    _count("disk_hits")
+    _remember(namespace, key, pcm_audio, expires_at)
+    return pcm_audio
+
+
+def put_cached_audio(namespace, key, pcm_audio, ttl=None):
+    """
+    Store PCMAudio under `key` in memory and on disk. Cache failures are logged, never raised.
+
+    Parameters:
+    namespace (str): Cache partition, e.g. "voiceovers".
+    key (str): Identifier of the audio, hashed into the file name.
+    pcm_audio (PCMAudio): The audio to cache. Callers must not modify it afterwards.
+    ttl (float, optional): Seconds until the entry expires. None keeps it until evicted.
+    """
+    expires_at = time.time() + ttl if ttl else 0
+    _remember(namespace, key, pcm_audio, expires_at)
+    path = _cache_path(namespace, key)
+    try:
+        try:
+            previous_bytes = os.path.getsize(path)
+        except FileNotFoundError:
+            previous_bytes = 0
+        write_pcm_file(path, pcm_audio, expires_at)
+        _track_disk_write(os.path.getsize(path) - previous_bytes)
+    except OSError as e:
+        print(f"Failed to write {namespace}/{key} to the audio cache. Error: {e}")
+
+
+def _read_disk_total():
+    try:
+        with open(os.path.join(config.AUDIO_CACHE_DIR, SIZE_FILENAME)) as size_file:
+            return int(size_file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_disk_total(total_bytes):
+    with open(os.path.join(config.AUDIO_CACHE_DIR, SIZE_FILENAME), "w") as size_file:
+        size_file.write(str(total_bytes))
+
+def _track_disk_write(added_bytes):
+    """Add a write to the running total of the disk tier, and evict once the total exceeds the budget."""
+    with _disk_cache_lock():
+        total_bytes = _read_disk_total()
+        if total_bytes is None or total_bytes + added_bytes > config.AUDIO_CACHE_DISK_BYTES:
+            total_bytes = _evict_locked(config.AUDIO_CACHE_DISK_BYTES)  # Also counts the entry just written
+        else:
+            total_bytes += added_bytes
+        _write_disk_total(total_bytes)
+
+def evict_disk_cache(max_bytes=None):
+    """Delete the least recently used disk entries until the cache fits in max_bytes."""
+    max_bytes = config.AUDIO_CACHE_DISK_BYTES if max_bytes is None else max_bytes
+    with _disk_cache_lock():
+        _write_disk_total(_evict_locked(max_bytes))
+
+def _evict_locked(max_bytes):
+    """Scan every namespace and evict down to max_bytes, under the disk cache lock. Returns the bytes left."""
+    entries = []
+    for namespace_entry in os.scandir(config.AUDIO_CACHE_DIR):
+        if not namespace_entry.is_dir():
+            continue
+        entries.extend(_scan_entries(namespace_entry.path, ".pcm"))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        _remove_entry(path)
+        total_bytes -= size
+    return total_bytes
+
+
+def _scan_entries(directory, extension):
+    """(mtime, size, path) of the cache files in a namespace directory."""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(extension):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def _remove_entry(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    _count("evictions")
+
+
+def get_cached_value(namespace, key):
+    """
+    Look up a JSON value stored with put_cached_value.
+
+    Returns:
+    The value, or None on a miss or an expired entry.
+    """
+    path = _cache_path(namespace, key, extension="json")
+    try:
+        with open(path) as value_file:
+            entry = json.load(value_file)
+        if entry["expires_at"] and entry["expires_at"] <= time.time():
+            os.remove(path)
+            _count("expired")
+            _count("value_misses")
+            return None
+        os.utime(path)  # mtime doubles as the last access time for LRU eviction
+    except FileNotFoundError:
+        _count("value_misses")
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable cache entry {path}. Error: {e}")
+        _count("value_misses")
+        return None
+
+    _count("value_hits")
+    return entry["value"]
+
+
+def put_cached_value(namespace, key, value, ttl=None, max_entries=None):
+    """
+    Store a JSON serializable value under `key` on disk. Cache failures are logged, never raised.
+
+    Parameters:
+    namespace (str): Cache partition, e.g. "tts_results".
+    key (str): Identifier of the value, hashed into the file name.
+    value: The value to cache.
+    ttl (float, optional): Seconds until the entry expires. None keeps it until evicted.
+    max_entries (int, optional): Evict the least recently used entries of the namespace beyond this count.
+    """
+    path = _cache_path(namespace, key, extension="json")
+    entry = {"value": value, "expires_at": time.time() + ttl if ttl else 0}
+    try:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        is_new_entry = not os.path.exists(path)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as temp_file:
+            json.dump(entry, temp_file)
+        os.replace(temp_path, path)
+        if max_entries is not None:
+            _track_value_write(directory, int(is_new_entry), max_entries)
+    except OSError as e:
+        print(f"Failed to write {namespace}/{key} to the value cache. Error: {e}")
+
+
+def _read_entry_count(directory):
+    try:
+        with open(os.path.join(directory, COUNT_FILENAME)) as count_file:
+            return int(count_file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_entry_count(directory, entry_count):
+    with open(os.path.join(directory, COUNT_FILENAME), "w") as count_file:
+        count_file.write(str(entry_count))
+
+def _track_value_write(directory, added_entries, max_entries):
+    """Add a write to the running count of a namespace, and evict once the count exceeds max_entries."""
+    with _disk_cache_lock():
+        entry_count = _read_entry_count(directory)
+        if entry_count is None or entry_count + added_entries > max_entries:
+            entry_count = _evict_values_locked(directory, max_entries - max_entries // 10)
+        else:
+            entry_count += added_entries
+        _write_entry_count(directory, entry_count)
+
+def evict_cached_values(namespace, max_entries):
+    """Delete the least recently used values of a namespace until at most max_entries remain."""
+    directory = os.path.join(config.AUDIO_CACHE_DIR, namespace)
+    with _disk_cache_lock():
+        _write_entry_count(directory, _evict_values_locked(directory, max_entries))
+
+def _evict_values_locked(directory, max_entries):
+    """Scan a namespace of values and evict down to max_entries, under the disk cache lock. Returns the entries left."""
+    entries = _scan_entries(directory, ".json")
+    for _, _, path in sorted(entries)[:max(0, len(entries) - max_entries)]:
+        _remove_entry(path)
+    return min(len(entries), max_entries)
+
+
+def get_cache_stats():
+    """Hit/miss counters of this process, plus the current size of the memory tier."""
+    with _memory_cache_lock:
+        stats = dict(_cache_stats)
+        stats["memory_entries"] = len(_memory_cache)
+        stats["memory_bytes"] = _memory_cache_bytes
+    return stats
+
+
+def clear_memory_cache():
+    global _memory_cache_bytes
+    with _memory_cache_lock:
+        _memory_cache.clear()
+        _memory_cache_bytes = 0
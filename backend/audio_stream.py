@@ -0,0 +1,233 @@
+# Relative path: audio_stream.py
+"""
+Streaming encoding and decoding through long-lived ffmpeg processes, and sinks that forward the
+encoded bytes as they are produced, so a full copy of the encoded file never sits in memory or on disk.
+"""
+import struct
+import subprocess
+import threading
+
+import numpy as np
+from pydub import AudioSegment
+
+from data_classes import PCMAudio
+
+ENCODED_CHUNK_BYTES = 64 * 1024
+PCM_BLOCK_FRAMES = 44100
+S3_MIN_PART_BYTES = 5 * 1024 * 1024  # Every part of a multipart upload but the last must be at least 5 MiB
+
+
+def pcm_blocks(pcm_audio, block_frames=PCM_BLOCK_FRAMES):
+    """Yield PCMAudio samples as views of at most block_frames frames."""
+    for start_frame in range(0, pcm_audio.frame_count, block_frames):
+        yield pcm_audio.samples[start_frame:start_frame + block_frames]
+
+
+def _feed_process(process, byte_chunks, errors):
+    try:
+        for chunk in byte_chunks:
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early, its return code tells why
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _drain(stream, output):
+    output.append(stream.read())
+
+
+def stream_encode_pcm(blocks, sample_rate, channels, format="mp3", bitrate="192k"):
+    """
+    Encode 16-bit PCM blocks with a single ffmpeg process, yielding encoded bytes as they come out.
+
+    Blocks are written to ffmpeg's stdin from a feeder thread while this generator reads stdout,
+    so encoding overlaps with producing the blocks (mixing, gain, ...). Closing the generator
+    early (e.g. the HTTP client went away) kills the encoder.
+
+    Parameters:
+    blocks (iterable): int16 arrays shaped (frames, channels).
+    sample_rate (int): Frames per second of the blocks.
+    channels (int): Channels of the blocks.
+    format (str): ffmpeg output format.
+    bitrate (str): Encoder bitrate.
+
+    Yields:
+    bytes: Encoded chunks of at most ENCODED_CHUNK_BYTES.
+
+    Raises:
+    ValueError: A block is not int16, once the blocks before it are encoded.
+    """
+    command = [
+        AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        "-f", format, "-b:a", bitrate, "pipe:1",
+    ]
+    return _stream_through_ffmpeg(command, _int16_block_bytes(blocks))
+
+
+def _int16_block_bytes(blocks):
+    # Casting wider samples to int16 would wrap them around instead of scaling them
+    for block in blocks:
+        if block.dtype != np.int16:
+            raise ValueError(f"Expected int16 PCM blocks, got {block.dtype}")
+        yield np.ascontiguousarray(block).data
+
+
+def _stream_through_ffmpeg(command, byte_chunks):
+    """
+    Run ffmpeg with byte_chunks written to its stdin from a feeder thread, yielding its stdout as it
+    comes out. Closing the generator early kills ffmpeg, a failed run raises RuntimeError.
+    """
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    feed_errors, stderr_output = [], []
+    feeder = threading.Thread(target=_feed_process, args=(process, byte_chunks, feed_errors), daemon=True)
+    stderr_reader = threading.Thread(target=_drain, args=(process.stderr, stderr_output), daemon=True)
+    feeder.start()
+    stderr_reader.start()
+
+    finished = False
+    try:
+        while True:
+            chunk = process.stdout.read1(ENCODED_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        feeder.join()
+        stderr_reader.join()
+        return_code = process.wait()
+
+    if feed_errors:
+        raise feed_errors[0]
+    if return_code != 0:
+        stderr_text = b"".join(stderr_output).decode(errors="replace").strip()
+        raise RuntimeError(f"ffmpeg exited with code {return_code}: {stderr_text}")
+
+
+def _read_wav_stream_header(stdout_chunks, buffer):
+    """
+    Consume the RIFF header ffmpeg writes ahead of streamed WAV data.
+
+    Returns:
+    tuple: (sample_rate, channels, sample_width). `buffer` is left holding the first data bytes.
+    """
+    def fill(size):
+        while len(buffer) < size:
+            chunk = next(stdout_chunks, None)
+            if chunk is None:
+                raise RuntimeError("ffmpeg output ended inside the WAV header")
+            buffer.extend(chunk)
+
+    fill(12)
+    if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        raise RuntimeError("ffmpeg did not produce a WAV stream")
+    del buffer[:12]
+    audio_format = None
+    while True:
+        fill(8)
+        chunk_id, chunk_size = buffer[:4], struct.unpack("<I", buffer[4:8])[0]
+        del buffer[:8]
+        if chunk_id == b"data":
+            break
+        fill(chunk_size + chunk_size % 2)
+        if chunk_id == b"fmt ":
+            audio_format = struct.unpack("<HHIIHH", buffer[:16])
+        del buffer[:chunk_size + chunk_size % 2]
+    if audio_format is None:
+        raise RuntimeError("ffmpeg WAV stream has no fmt chunk")
+    _, channels, sample_rate, _, _, bits_per_sample = audio_format
+    return sample_rate, channels, bits_per_sample // 8
+
+
+def stream_decode_audio(byte_chunks, format="mp3", block_frames=PCM_BLOCK_FRAMES):
+    """
+    Decode encoded audio with a single ffmpeg process while its bytes are still arriving,
+    e.g. straight from a TTS response, yielding PCM as soon as it is decoded.
+
+    Decodes the same way AudioSegment.from_file does (16-bit WAV out of ffmpeg), so the
+    samples match decode_audio_to_pcm.
+
+    Parameters:
+    byte_chunks (iterable): Encoded bytes, in order.
+    format (str): ffmpeg input format.
+    block_frames (int): Frames per yielded block, the last one may be shorter.
+
+    Yields:
+    PCMAudio: Consecutive blocks of the decoded audio.
+    """
+    command = [
+        AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+        "-f", format, "-i", "pipe:0",
+        "-vn", "-acodec", "pcm_s16le", "-f", "wav", "pipe:1",
+    ]
+    stdout_chunks = _stream_through_ffmpeg(command, byte_chunks)
+    try:
+        buffer = bytearray()
+        sample_rate, channels, sample_width = _read_wav_stream_header(stdout_chunks, buffer)
+        frame_bytes = channels * sample_width
+        block_bytes = block_frames * frame_bytes
+        dtype = f"<i{sample_width}"
+
+        finished = False
+        while not finished:
+            chunk = next(stdout_chunks, None)
+            if chunk is None:
+                finished = True
+            else:
+                buffer.extend(chunk)
+            while len(buffer) >= block_bytes or (finished and len(buffer) >= frame_bytes):
+                usable = min(len(buffer), block_bytes) // frame_bytes * frame_bytes
+                samples = np.frombuffer(bytes(buffer[:usable]), dtype=dtype).reshape(-1, channels)
+                del buffer[:usable]
+                yield PCMAudio(samples=samples, sample_rate=sample_rate)
+    finally:
+        stdout_chunks.close()
+
+
+def upload_stream_to_s3(s3_client, byte_chunks, bucket_name, object_name, content_type="audio/mpeg",
+                        part_bytes=S3_MIN_PART_BYTES):
+    """
+    Upload an iterable of byte chunks to S3, holding at most one part in memory. A stream that ends
+    before its first part is full (most voiceovers and spots) is sent with a single put_object.
+    Longer ones go through a multipart upload, aborted if the chunks or any part request fail.
+    """
+    upload_id = None
+    parts = []
+    buffer = bytearray()
+
+    def upload_part(body):
+        part_number = len(parts) + 1
+        response = s3_client.upload_part(Bucket=bucket_name, Key=object_name, UploadId=upload_id,
+                                         PartNumber=part_number, Body=bytes(body))
+        parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    try:
+        for chunk in byte_chunks:
+            buffer += chunk
+            if len(buffer) >= part_bytes:
+                if upload_id is None:
+                    upload = s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_name, ContentType=content_type)
+                    upload_id = upload["UploadId"]
+                upload_part(buffer)
+                buffer = bytearray()
+        if upload_id is None:
+            s3_client.put_object(Bucket=bucket_name, Key=object_name, Body=bytes(buffer), ContentType=content_type)
+            return
+        if buffer:
+            upload_part(buffer)
+        s3_client.complete_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id,
+                                            MultipartUpload={"Parts": parts})
+    except BaseException:
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id)
+        raise
@@ -0,0 +1,88 @@
+# Relative path: benchmark_speech_rate.py
+"""
+Compare the in-process WSOLA speech rate engine with the soundstretch subprocess.
+
+For every SpeechRateConversions rate and WSOLA quality setting, prints the median latency of
+adjust_speech_rate and how similar its output is to soundstretch's (correlation of the
+short-time magnitude spectra, 1.0 = identical). soundstretch columns are skipped when the
+binary is not installed.
+
+Usage: python benchmark_speech_rate.py [voiceover.mp3] [--repeat N]
+"""
+import argparse
+import shutil
+import statistics
+import time
+
+import numpy as np
+
+from data_classes import PCMAudio, SpeechRateConversions
+from time_stretch import STRETCH_QUALITY_SETTINGS
+from utils import adjust_speech_rate, decode_audio_to_pcm
+
+
+def _synthetic_voiceover(seconds=30, sample_rate=44100):
+    """Syllable-like bursts of harmonics with a drifting pitch, separated by short pauses."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 8))
+    envelope = (np.sin(2 * np.pi * 4 * t) > -0.2) * (rng.random(len(t)) * 0.1 + 0.9)
+    samples = (6000 * voice * envelope).astype(np.int16)[:, None]
+    return PCMAudio(samples=samples, sample_rate=sample_rate)
+
+
+def _spectral_similarity(audio, reference, window=2048):
+    """Correlation of the log magnitude spectrograms of two mono mixes, trimmed to the shorter one."""
+    def spectrogram(pcm_audio):
+        mono = pcm_audio.samples.mean(axis=1)
+        frames = len(mono) // window
+        blocks = mono[:frames * window].reshape(frames, window) * np.hanning(window)
+        return np.log1p(np.abs(np.fft.rfft(blocks, axis=1)))
+
+    a, b = spectrogram(audio), spectrogram(reference)
+    frames = min(len(a), len(b))
+    return float(np.corrcoef(a[:frames].ravel(), b[:frames].ravel())[0, 1])
+
+
+def _time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("audio", nargs="?", help="Audio file to stretch, a synthetic 30 s voiceover by default")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.audio:
+        with open(args.audio, "rb") as audio_file:
+            audio = decode_audio_to_pcm(audio_file.read(), format=args.audio.rsplit(".", 1)[-1])
+    else:
+        audio = _synthetic_voiceover()
+    has_soundstretch = shutil.which("soundstretch") is not None
+    print(f"Input: {audio.duration_ms} ms, {audio.channels} channel(s), {audio.sample_rate} Hz")
+    if not has_soundstretch:
+        print("soundstretch is not installed, only timing WSOLA")
+
+    print(f"{'rate':>6} {'engine':>22} {'median ms':>10} {'similarity':>11}")
+    for rate, tempo_change in SpeechRateConversions.RATES_TO_PERCENTAGES.items():
+        reference = None
+        if has_soundstretch:
+            latency, reference = _time(lambda: adjust_speech_rate(audio, tempo_change, engine="soundstretch"), args.repeat)
+            print(f"{rate:>6} {'soundstretch':>22} {latency:>10.1f} {'-':>11}")
+        for quality in STRETCH_QUALITY_SETTINGS:
+            latency, stretched = _time(lambda: adjust_speech_rate(audio, tempo_change, engine="wsola", quality=quality),
+                                       args.repeat)
+            similarity = f"{_spectral_similarity(stretched, reference):.3f}" if reference is not None else "-"
+            print(f"{rate:>6} {'wsola/' + quality:>22} {latency:>10.1f} {similarity:>11}")
+
+
+if __name__ == "__main__":
+    main()
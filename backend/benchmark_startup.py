@@ -0,0 +1,69 @@
+# Relative path: benchmark_startup.py
+"""
+Benchmark of the worker startup: how long a fresh interpreter takes to import each serving mode,
+to warm up, and which modules dominate the import.
+
+Every measurement runs in a new process, as a gunicorn worker (or the master with
+GUNICORN_PRELOAD) would. The warm-up runs with the music library of the working directory.
+
+Usage:
+  python benchmark_startup.py [--repeat 5] [--top 15]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+MODULES = ("flask_api", "asgi_api")
+
+_IMPORT_SCRIPT = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+_WARM_UP_SCRIPT = ("import time, logging; logging.disable(logging.INFO); import flask_api, startup; "
+                   "start = time.perf_counter(); startup.warm_up(); print(time.perf_counter() - start)")
+
+
+def _run_timed(script):
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(completed.stdout.strip().splitlines()[-1]) * 1000
+
+def time_startup(script, repeat):
+    """Median and minimum of `repeat` runs of `script` in fresh interpreters, in milliseconds."""
+    timings = [_run_timed(script) for _ in range(repeat)]
+    return {"median_ms": round(statistics.median(timings), 1), "min_ms": round(min(timings), 1)}
+
+def slowest_imports(module, top):
+    """(cumulative microseconds, module name) of the modules imported by `module`, slowest first."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Cumulative times include the nested imports, a package and its parent module both show up
+        if cumulative.strip().isdigit() and name.strip() != module:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    args = parser.parse_args()
+
+    for module in MODULES:
+        result = time_startup(_IMPORT_SCRIPT.format(module=module), args.repeat)
+        print(f"import {module:<20} {result['median_ms']:>8.1f} ms (min {result['min_ms']:.1f} ms)")
+    result = time_startup(_WARM_UP_SCRIPT, args.repeat)
+    print(f"{'warm_up()':<27} {result['median_ms']:>8.1f} ms (min {result['min_ms']:.1f} ms)")
+
+    print("\nSlowest imports of flask_api:")
+    for cumulative, name in slowest_imports("flask_api", args.top):
+        print(f"  {name:<40} {cumulative / 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
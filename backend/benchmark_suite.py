@@ -0,0 +1,252 @@
+# Relative path: benchmark_suite.py
+"""
+Benchmark suite of the audio DSP functions and the endpoint flows.
+
+Synthetic voice and music fixtures of several lengths and section counts are generated, then
+every case is timed and its median written to a JSON baseline. Section ids get a fresh suffix on
+every run (section-0@<random>), so the section cache only serves the cases named _cached.
+ElevenLabs, S3 and Firestore are replaced by local fakes: voiceovers come from the fixtures and
+uploads only drain the encoder output. Without ffmpeg on PATH the MP3 encoder is replaced by a
+raw PCM passthrough too, which is recorded in the baseline so results of both setups are not
+compared unnoticed.
+
+Usage:
+  python benchmark_suite.py --output baseline.json            Record a baseline
+  python benchmark_suite.py --compare baseline.json [--threshold 0.25]
+                                                              Exit with 1 if a case got slower
+  python benchmark_suite.py --filter pause --repeat 10 --quick
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import numpy as np
+
+from benchmark_speech_rate import _synthetic_voiceover
+from data_classes import PCMAudio
+import utils
+import music_library
+
+VOICE_SECONDS = (15, 60)
+QUICK_VOICE_SECONDS = (15,)
+SECTION_COUNTS = (1, 4, 8)
+QUICK_SECTION_COUNTS = (4,)
+MUSIC_SECONDS = 90
+MUSIC_FILENAME = "benchmark_music.wav"
+
+
+def synthetic_music(seconds=MUSIC_SECONDS, sample_rate=44100):
+    """A stereo chord progression, one chord every two seconds."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    roots = np.array([220.0, 174.6, 261.6, 196.0])[(t // 2).astype(int) % 4]
+    phase = 2 * np.pi * np.cumsum(roots) / sample_rate
+    chord = np.sin(phase) + 0.6 * np.sin(1.25 * phase) + 0.5 * np.sin(1.5 * phase)
+    left, right = 5000 * chord, 5000 * np.roll(chord, 441)
+    return PCMAudio(samples=np.stack([left, right], axis=1).astype(np.int16), sample_rate=sample_rate)
+
+
+def _drain_upload(s3_client, byte_chunks, *args, **kwargs):
+    for _ in byte_chunks:
+        pass
+
+def _passthrough_encoder(blocks, sample_rate, channels, format="mp3", bitrate="192k"):
+    for block in blocks:
+        yield np.ascontiguousarray(block.samples if hasattr(block, "samples") else block).tobytes()
+
+def _fresh_ids(history_item_ids):
+    """History item ids never seen by the section cache, that the fakes resolve to the same fixtures."""
+    suffix = os.urandom(4).hex()
+    return [f"{history_item_id}@{suffix}" for history_item_id in history_item_ids]
+
+def _local_fakes(sections, voiceover, fake_encoder):
+    """Patches replacing every remote service, and ffmpeg when it is missing."""
+    def fixture(history_item_id):
+        return sections[history_item_id.split("@")[0]]
+
+    fakes = [
+        patch("utils.generate_voiceover_from_history_item_id", side_effect=fixture),
+        patch("flask_api.generate_voiceover_from_history_item_id", side_effect=fixture),
+        patch("flask_api.generate_voiceover_from_voice_id", return_value=voiceover),
+        patch("utils.upload_stream_to_s3", side_effect=_drain_upload),
+        patch("utils.get_s3_client", return_value=None),
+        patch("flask_api.generate_pyro_history_item_id", side_effect=lambda _: os.urandom(4).hex()),
+    ]
+    if fake_encoder:
+        fakes += [patch("utils.stream_encode_pcm", side_effect=_passthrough_encoder),
+                  patch("flask_api.stream_encode_pcm", side_effect=_passthrough_encoder)]
+    return fakes
+
+
+def dsp_cases(voice_seconds, section_counts, music):
+    """(name, callable) of the utils.py functions, for every fixture size."""
+    cases = []
+    for seconds in voice_seconds:
+        voice = _synthetic_voiceover(seconds)
+        music_of_voice_length = utils.fit_music_to_duration(music, seconds * 1000)
+        cases += [
+            (f"detect_nonsilent_ranges/{seconds}s", lambda voice=voice: utils.detect_nonsilent_ranges(voice, 100, -40)),
+            (f"process_audio_to_remove_pauses/{seconds}s", lambda voice=voice: utils.process_audio_to_remove_pauses(voice)),
+            (f"slice_audio_at_cutoff/{seconds}s", lambda voice=voice: utils.slice_audio_at_cutoff(voice, 1500)),
+            (f"append_pause/{seconds}s", lambda voice=voice: utils.append_pause(voice, 500)),
+            (f"adjust_speech_rate/{seconds}s", lambda voice=voice: utils.adjust_speech_rate(voice, 10, engine="wsola")),
+            (f"mix_voice_with_music/{seconds}s",
+             lambda voice=voice: utils.mix_voice_with_music(voice, music, seconds, 0.1, loop_music=True)),
+            (f"stream_volume_change/{seconds}s", lambda music=music_of_voice_length: list(utils.stream_volume_change(music, 0.5))),
+            (f"export_pcm_wav/{seconds}s", lambda voice=voice: utils.export_pcm(voice, tempfile.TemporaryFile(), format="wav")),
+        ]
+    for count in section_counts:
+        sections = [_synthetic_voiceover(8) for _ in range(count)]
+        cases.append((f"stitch_audio_segments/{count}_sections", lambda sections=sections: utils.stitch_audio_segments(sections)))
+    return cases
+
+def endpoint_cases(client, voice_seconds, section_counts):
+    """(name, callable) of the full /produce-spot, /generate-mix, /render-variants and /preprocess-voiceover flows."""
+    def post(path, body):
+        response = client.post(path, json=body)
+        response.get_data()  # Streamed responses are only mixed and encoded while they are read
+        response.close()  # Releases the admission slot of streamed responses
+        assert response.status_code == 200, f"{path} failed: {response.get_data(as_text=True)}"
+
+    cases = []
+    for count in section_counts:
+        body = {"user_id": "benchmark", "history_item_id_list": [f"section-{index}" for index in range(count)],
+                "end_of_section_pause_duration_list": [0.5] * count, "music_filename": MUSIC_FILENAME, "music_vol": 0.1}
+        cases.append((f"/produce-spot/{count}_sections",
+                      lambda body=body: post("/produce-spot", {**body, "history_item_id_list": _fresh_ids(body["history_item_id_list"])})))
+        # The same sections every run: processed once by the warm-up run, then served by the section cache
+        cases.append((f"/produce-spot/{count}_sections_cached", lambda body=body: post("/produce-spot", body)))
+    for seconds in voice_seconds:
+        body = {"user_id": "benchmark", "history_item_id": f"voice-{seconds}", "music_choice": MUSIC_FILENAME,
+                "ad_length": seconds, "music_vol": 0.1}
+        cases.append((f"/generate-mix/{seconds}s", lambda body=body: post("/generate-mix", body)))
+    variants = [{"music_filename": MUSIC_FILENAME, "music_vol": volume} for volume in (0.1, 0.2, 0.3, 0.4)]
+    body = {"user_id": "benchmark", "history_item_id": f"voice-{voice_seconds[0]}", "variants": variants}
+    cases.append(("/render-variants/4_variants", lambda body=body: post("/render-variants", body)))
+    # The same four renders as separate /generate-mix requests, for comparison
+    bodies = [{"user_id": "benchmark", "history_item_id": f"voice-{voice_seconds[0]}", "music_choice": MUSIC_FILENAME,
+               "ad_length": voice_seconds[0], "music_vol": variant["music_vol"]} for variant in variants]
+    cases.append(("/generate-mix/4_separate_requests", lambda: [post("/generate-mix", body) for body in bodies]))
+    body = {"script": "Benchmark take", "voice": "voice-1", "user_id": "benchmark", "emotion": "calmly",
+            "speech_rate": 10, "fresh_take": True}
+    cases.append(("/preprocess-voiceover", lambda: post("/preprocess-voiceover", body)))
+    return cases
+
+
+def time_case(function, repeat):
+    """Median and minimum wall time of `repeat` runs after one warm-up run, in milliseconds."""
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3), "repeat": repeat}
+
+def run_suite(repeat=5, quick=False, name_filter=None):
+    """
+    Run every benchmark case in a scratch working directory.
+
+    Returns:
+    dict: {"meta": {...}, "results": {case name: {"median_ms", "min_ms", "repeat"}}}
+    """
+    voice_seconds = QUICK_VOICE_SECONDS if quick else VOICE_SECONDS
+    section_counts = QUICK_SECTION_COUNTS if quick else SECTION_COUNTS
+    fake_encoder = shutil.which("ffmpeg") is None
+    music = synthetic_music()
+    sections = {f"section-{index}": _synthetic_voiceover(8) for index in range(max(section_counts))}
+    sections.update({f"voice-{seconds}": _synthetic_voiceover(seconds) for seconds in voice_seconds})
+
+    results = {}
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch_directory, ExitStack() as fakes:
+        # Routes read and write data/ relative to the working directory
+        os.chdir(scratch_directory)
+        try:
+            os.makedirs("data/background_music")
+            utils.export_pcm(music, f"data/background_music/{MUSIC_FILENAME}", format="wav")
+            # Requests may only name files of the library manifest
+            music_library._record_in_manifest("data/background_music", MUSIC_FILENAME, {"size": None, "etag": None})
+            for fake in _local_fakes(sections, _synthetic_voiceover(15), fake_encoder):
+                fakes.enter_context(fake)
+            from flask_api import app
+
+            with app.test_client() as client:
+                cases = dsp_cases(voice_seconds, section_counts, music) + endpoint_cases(client, voice_seconds, section_counts)
+                for name, function in cases:
+                    if name_filter and name_filter not in name:
+                        continue
+                    results[name] = time_case(function, repeat)
+                    print(f"{name:<45} {results[name]['median_ms']:>10.1f} ms")
+        finally:
+            os.chdir(original_directory)
+
+    meta = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "encoder": "passthrough" if fake_encoder else "ffmpeg",
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Cases whose median got slower than the baseline by more than `threshold` (0.25 = 25 %).
+
+    Returns:
+    list: (case name, baseline median ms, current median ms) of the regressions.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        baseline_median = baseline["results"][name]["median_ms"]
+        if result["median_ms"] > baseline_median * (1 + threshold):
+            regressions.append((name, baseline_median, result["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write the results to this JSON baseline file")
+    parser.add_argument("--compare", help="Baseline file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown of a median, 0.25 = 25 %%")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Only the smallest fixtures")
+    parser.add_argument("--filter", help="Only run cases whose name contains this text")
+    args = parser.parse_args()
+
+    current = run_suite(repeat=args.repeat, quick=args.quick, name_filter=args.filter)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(current, output_file, indent=2, sort_keys=True)
+        print(f"Wrote {len(current['results'])} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["meta"].get("encoder") != current["meta"]["encoder"]:
+            print(f"Warning: the baseline used the {baseline['meta'].get('encoder')} encoder, "
+                  f"this run the {current['meta']['encoder']} encoder")
+        regressions = compare_results(baseline, current, args.threshold)
+        for name, baseline_median, current_median in regressions:
+            print(f"REGRESSION {name}: {baseline_median:.1f} ms -> {current_median:.1f} ms "
+                  f"(+{(current_median / baseline_median - 1) * 100:.0f} %)")
+        if regressions:
+            sys.exit(1)
+        print(f"No case is more than {args.threshold * 100:.0f} % slower than {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
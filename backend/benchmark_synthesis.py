@@ -0,0 +1,71 @@
+# Relative path: benchmark_synthesis.py
+"""
+Benchmark of sharded synthesis: wall time of a whole take against the same script in shards.
+
+ElevenLabs is replaced by a local fake whose latency grows with the length of the text it is
+given (a fixed time to first byte plus a time per character), and which returns a tone of about
+the spoken length. Scripts are generated at about 15 characters per second of speech.
+
+Usage:
+  python benchmark_synthesis.py [--seconds 15 60] [--first-byte-ms 400] [--ms-per-char 4] [--repeat 3]
+"""
+import time
+import argparse
+import statistics
+from unittest.mock import patch
+
+import numpy as np
+
+from data_classes import PCMAudio
+import utils
+
+CHARS_PER_SECOND = 15
+SENTENCE = "Fire up the grill this weekend with the new Pyro burner."
+
+
+def synthetic_script(seconds):
+    """Sentences of about `seconds` of speech, in paragraphs of three."""
+    sentence_count = max(1, round(seconds * CHARS_PER_SECOND / len(SENTENCE)))
+    sentences = [SENTENCE] * sentence_count
+    return "\n\n".join(" ".join(sentences[start:start + 3]) for start in range(0, sentence_count, 3))
+
+def fake_synthesis(first_byte_ms, ms_per_char, sample_rate=44100):
+    def synthesize(text_input, *args):
+        time.sleep((first_byte_ms + ms_per_char * len(text_input)) / 1000)
+        frames = int(sample_rate * len(text_input) / CHARS_PER_SECOND)
+        tone = 4000 * np.sin(2 * np.pi * 220 * np.arange(frames) / sample_rate)
+        return PCMAudio(samples=tone.astype(np.int16)[:, None], sample_rate=sample_rate)
+    return synthesize
+
+def time_take(generate, script, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        voiceover = generate(script, "voice-1", "eleven_multilingual_v2")
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 1), voiceover.duration_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=int, nargs="+", default=[15, 60])
+    parser.add_argument("--first-byte-ms", type=int, default=400)
+    parser.add_argument("--ms-per-char", type=float, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Shards of up to {utils.config.SYNTHESIS_SHARD_MAX_CHARS} characters, "
+          f"{utils.config.SYNTHESIS_SHARD_CONCURRENCY} at once")
+    with patch("utils.synthesize_voiceover", side_effect=fake_synthesis(args.first_byte_ms, args.ms_per_char)):
+        for seconds in args.seconds:
+            script = synthetic_script(seconds)
+            shard_count = len(utils.plan_voiceover_shards(script)[0])
+            whole_ms, whole_duration = time_take(utils.generate_voiceover_from_voice_id, script, args.repeat)
+            sharded_ms, sharded_duration = time_take(utils.generate_sharded_voiceover, script, args.repeat)
+            print(f"{seconds:>3} s script ({len(script)} chars, {shard_count} shards): whole {whole_ms:>7.1f} ms, "
+                  f"sharded {sharded_ms:>7.1f} ms ({whole_ms / sharded_ms:.1f}x), "
+                  f"take {whole_duration} ms -> {sharded_duration} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,12 @@ import os
 class Config:
     dotenv_path: str = field(default_factory=lambda: os.path.join(os.path.dirname(__file__), '.devcontainer', '.env'))
     broker_url: str = field(init=False)
-    result_backend: str = None  # Specify if you have a result backend
+    result_backend: str = None  # Specify if you have a result backend, otherwise RESULT_BACKEND is used
+    task_always_eager: bool = field(init=False)  # Run jobs in the submitting process, only with LOCAL_JOBS and no BROKER_URL
     accept_content: list = field(default_factory=lambda: ['json'])
     task_serializer: str = 'json'
     result_serializer: str = 'json'
+    LOCAL_JOBS: bool = field(init=False)  # Without a BROKER_URL, run /jobs in the web process (local runs and tests)
     MIN_PYRO_USER_AWS_ACCESS_KEY: str = field(init=False)
     MIN_PYRO_USER_AWS_SECRET_KEY: str = field(init=False)
     ELEVENLABS_API_KEY: str = field(init=False)
@@ -20,10 +22,78 @@ class Config:
     application_version: str = field(init=False)  # New field for version
     BACKGROUND_MUSIC_URL: str = field(init=False)
     MUSIC_PREVIEW_URL: str = field(init=False)
+    SECTION_CONCURRENCY: int = field(init=False)  # Sections fetched at once per request
+    SECTION_PROCESS_WORKERS: int = field(init=False)  # Size of the shared DSP process pool, 0 runs DSP in the fetch threads
+    SERIAL_SECTION_PROCESSING: bool = field(init=False)  # Debug switch, processes sections one after another
+    AUDIO_CACHE_DIR: str = field(init=False)
+    AUDIO_CACHE_MEMORY_BYTES: int = field(init=False)  # Per worker process
+    AUDIO_CACHE_DISK_BYTES: int = field(init=False)  # Shared by all workers on the host
+    ELEVENLABS_HISTORY_CACHE_TTL: int = field(init=False)  # seconds, pyro_ objects never expire
+    S3_ENDPOINT_URL: str = field(init=False)  # Any S3 compatible endpoint (MinIO, moto), None for AWS
+    S3_REGION: str = field(init=False)
+    S3_MAX_POOL_CONNECTIONS: int = field(init=False)  # Kept-alive connections shared by all threads of a process
+    S3_MULTIPART_THRESHOLD: int = field(init=False)  # bytes, larger objects are transferred in ranged parts
+    S3_MULTIPART_CHUNKSIZE: int = field(init=False)  # bytes per part
+    S3_TRANSFER_CONCURRENCY: int = field(init=False)  # Parts transferred in parallel per object
+    SPEECH_RATE_ENGINE: str = field(init=False)  # "wsola" (in process) or "soundstretch" (subprocess)
+    SPEECH_RATE_QUALITY: str = field(init=False)  # WSOLA search precision: fast, balanced or high
+    TTS_RESULT_CACHE_TTL: int = field(init=False)  # seconds a rendered voiceover is reused for identical inputs
+    TTS_RESULT_CACHE_MAX_ENTRIES: int = field(init=False)
+    ASYNC_IO_THREADS: int = field(init=False)  # Async mode: threads for S3 transfers and ffmpeg runs per worker
+    ASYNC_FLASK_THREADS: int = field(init=False)  # Async mode: threads serving the remaining Flask routes per worker
+    MUSIC_SYNC_CONCURRENCY: int = field(init=False)  # Parallel checks and downloads of music library files
+    MUSIC_SYNC_TIMEOUT: int = field(init=False)  # seconds to connect or wait for data from the music origin
+    MUSIC_LIBRARY_DIR: str = field(init=False)  # Synced background music, with the PCM sidecars of its files
+    MUSIC_PREVIEW_DIR: str = field(init=False)  # Synced music previews
+    SINGLE_FLIGHT_BACKEND: str = field(init=False)  # "file" coalesces identical work across workers, "local" within each worker
+    SINGLE_FLIGHT_LOCK_DIR: str = field(init=False)
+    SINGLE_FLIGHT_RESULT_TTL: int = field(init=False)  # seconds a coalesced result is kept for the workers waiting on it
+    SINGLE_FLIGHT_RESULT_MAX_ENTRIES: int = field(init=False)  # Coalesced results kept on disk, least recently used evicted
+    SINGLE_FLIGHT_LOCK_TIMEOUT: int = field(init=False)  # seconds a worker waits for the leader before running the work itself
+    METRICS_ENABLED: bool = field(init=False)  # Per-stage timings, /metrics and per-request trace logs
+    METRICS_DIR: str = field(init=False)  # Where every process publishes its counters for /metrics
+    METRICS_JANITOR_INTERVAL: int = field(init=False)  # seconds between two folds of the counters of dead processes
+    ADMISSION_ENABLED: bool = field(init=False)  # Admission control of the heavy endpoints
+    ADMISSION_DIR: str = field(init=False)  # Holds the admission ledger shared by the workers of the host
+    ADMISSION_MAX_CONCURRENT: int = field(init=False)  # Heavy requests running at once on the host
+    ADMISSION_MAX_PER_USER: int = field(init=False)  # Heavy requests running or queued at once per user
+    ADMISSION_MEMORY_BUDGET_MB: int = field(init=False)  # Memory the running requests may reserve together
+    ADMISSION_QUEUE_LIMIT: int = field(init=False)  # Requests waiting for admission before 503s are returned
+    ADMISSION_QUEUE_TIMEOUT: int = field(init=False)  # seconds a request may wait for admission
+    ADMISSION_RETRY_AFTER: int = field(init=False)  # seconds sent in the Retry-After header of rejections
+    ADMISSION_BASE_MB: int = field(init=False)  # Estimated memory of any heavy request
+    ADMISSION_SECTION_MB: int = field(init=False)  # Estimated memory per voiceover section
+    ADMISSION_AUDIO_SECOND_MB: int = field(init=False)  # Estimated memory per second of mixed or synthesized audio
+    PREVIEW_VOLUME_STEPS: int = field(init=False)  # Preview volumes are snapped to 1/PREVIEW_VOLUME_STEPS, one cached render each
+    PREVIEW_PRERENDER: bool = field(init=False)  # Render previews at every volume step during the library sync
+    RENDER_VARIANT_CONCURRENCY: int = field(init=False)  # Variants of /render-variants mixed and encoded at once
+    GUNICORN_PRELOAD: bool = field(init=False)  # Import and warm up the app once in the gunicorn master
+    WARM_UP_ENABLED: bool = field(init=False)  # Prime SDKs, ffmpeg and the music library before /ready passes
+    SCHEDULER_LOCK_PATH: str = field(init=False)  # The worker holding this lock runs the scheduled jobs of the host
+    SCHEDULER_LEADER_RETRY: int = field(init=False)  # seconds between two attempts of a worker to take over the jobs
+    SCRATCH_DIR: str = field(init=False)  # Root of the scratch workspaces, /dev/shm or data/workdir when empty
+    SCRATCH_IN_MEMORY: bool = field(init=False)  # Put the scratch workspaces on the RAM backed /dev/shm when it exists
+    SCRATCH_WORKSPACE_MAX_BYTES: int = field(init=False)  # Per request
+    SCRATCH_MAX_BYTES: int = field(init=False)  # All workspaces of the host
+    SCRATCH_MAX_AGE: int = field(init=False)  # seconds after which the janitor removes a workspace, even of a live process
+    SCRATCH_JANITOR_INTERVAL: int = field(init=False)  # seconds between two runs of the scratch janitor
+    SHARDED_SYNTHESIS: bool = field(init=False)  # Default of sharded_synthesis in /preprocess-voiceover requests
+    SYNTHESIS_SHARD_MAX_CHARS: int = field(init=False)  # Sentences are packed into shards of up to this many characters
+    SYNTHESIS_SHARD_CONCURRENCY: int = field(init=False)  # Shards synthesized at once per request
+    SYNTHESIS_SHARD_RETRIES: int = field(init=False)  # Attempts after the first for a failed shard
+    SYNTHESIS_SHARD_RETRY_DELAY: int = field(init=False)  # milliseconds before the first retry, doubled after each
+    SYNTHESIS_SENTENCE_PAUSE: int = field(init=False)  # milliseconds between shards cut at the end of a sentence
+    SYNTHESIS_PARAGRAPH_PAUSE: int = field(init=False)  # milliseconds between shards cut at the end of a paragraph
 
     def __post_init__(self):
         load_dotenv(self.dotenv_path)
-        self.broker_url = os.getenv("BROKER_URL")
+        # Without a BROKER_URL jobs use an in-memory broker and result backend instead of SQS, and only
+        # run with LOCAL_JOBS (local runs and tests): /jobs is disabled otherwise
+        self.LOCAL_JOBS = os.getenv('LOCAL_JOBS', 'false').lower() == 'true'
+        self.broker_url = os.getenv("BROKER_URL") or "memory://"
+        self.task_always_eager = self.broker_url.startswith("memory://") and self.LOCAL_JOBS
+        self.result_backend = self.result_backend or os.getenv("RESULT_BACKEND") or \
+            ("cache+memory://" if self.broker_url.startswith("memory://") else None)
         self.broker_transport_options = {'region': 'us-east-2', "predefined_queues": {
             "celery": {  ## the name of the SQS queue
                 "url": os.getenv('SQS_URL'),
@@ -40,6 +110,68 @@ class Config:
         self.application_version = self.read_version()
         self.BACKGROUND_MUSIC_URL = os.getenv('BACKGROUND_MUSIC_URL')
         self.MUSIC_PREVIEW_URL = os.getenv('MUSIC_PREVIEW_URL')
+        self.SECTION_CONCURRENCY = int(os.getenv('SECTION_CONCURRENCY') or 4)
+        self.SECTION_PROCESS_WORKERS = int(os.getenv('SECTION_PROCESS_WORKERS') or 2)
+        self.SERIAL_SECTION_PROCESSING = os.getenv('SERIAL_SECTION_PROCESSING', 'false').lower() == 'true'
+        self.AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR') or 'data/cache'
+        self.AUDIO_CACHE_MEMORY_BYTES = int(os.getenv('AUDIO_CACHE_MEMORY_BYTES') or 256 * 1024 * 1024)
+        self.AUDIO_CACHE_DISK_BYTES = int(os.getenv('AUDIO_CACHE_DISK_BYTES') or 2 * 1024 * 1024 * 1024)
+        self.ELEVENLABS_HISTORY_CACHE_TTL = int(os.getenv('ELEVENLABS_HISTORY_CACHE_TTL') or 24 * 60 * 60)
+        self.S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+        self.S3_REGION = os.getenv('S3_REGION') or 'us-east-2'
+        self.S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS') or 32)
+        self.S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD') or 8 * 1024 * 1024)
+        self.S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE') or 8 * 1024 * 1024)
+        self.S3_TRANSFER_CONCURRENCY = int(os.getenv('S3_TRANSFER_CONCURRENCY') or 8)
+        self.SPEECH_RATE_ENGINE = (os.getenv('SPEECH_RATE_ENGINE') or 'wsola').lower()
+        self.SPEECH_RATE_QUALITY = (os.getenv('SPEECH_RATE_QUALITY') or 'balanced').lower()
+        self.TTS_RESULT_CACHE_TTL = int(os.getenv('TTS_RESULT_CACHE_TTL') or 24 * 60 * 60)
+        self.TTS_RESULT_CACHE_MAX_ENTRIES = int(os.getenv('TTS_RESULT_CACHE_MAX_ENTRIES') or 10000)
+        self.ASYNC_IO_THREADS = int(os.getenv('ASYNC_IO_THREADS') or 64)
+        self.ASYNC_FLASK_THREADS = int(os.getenv('ASYNC_FLASK_THREADS') or 10)
+        self.MUSIC_SYNC_CONCURRENCY = int(os.getenv('MUSIC_SYNC_CONCURRENCY') or 8)
+        self.MUSIC_SYNC_TIMEOUT = int(os.getenv('MUSIC_SYNC_TIMEOUT') or 30)
+        self.MUSIC_LIBRARY_DIR = os.getenv('MUSIC_LIBRARY_DIR') or 'data/background_music'
+        self.MUSIC_PREVIEW_DIR = os.getenv('MUSIC_PREVIEW_DIR') or 'data/background_music_previews'
+        self.SINGLE_FLIGHT_BACKEND = os.getenv('SINGLE_FLIGHT_BACKEND') or 'file'
+        self.SINGLE_FLIGHT_LOCK_DIR = os.getenv('SINGLE_FLIGHT_LOCK_DIR') or 'data/locks'
+        self.SINGLE_FLIGHT_RESULT_TTL = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL') or 600)
+        self.SINGLE_FLIGHT_RESULT_MAX_ENTRIES = int(os.getenv('SINGLE_FLIGHT_RESULT_MAX_ENTRIES') or 1000)
+        self.SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.getenv('SINGLE_FLIGHT_LOCK_TIMEOUT') or 120)
+        self.METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+        self.METRICS_DIR = os.getenv('METRICS_DIR') or 'data/metrics'
+        self.METRICS_JANITOR_INTERVAL = int(os.getenv('METRICS_JANITOR_INTERVAL') or 10 * 60)
+        self.ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+        self.ADMISSION_DIR = os.getenv('ADMISSION_DIR') or 'data/admission'
+        self.ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT') or os.cpu_count() or 4)
+        self.ADMISSION_MAX_PER_USER = int(os.getenv('ADMISSION_MAX_PER_USER') or 3)
+        self.ADMISSION_MEMORY_BUDGET_MB = int(os.getenv('ADMISSION_MEMORY_BUDGET_MB') or 1024)
+        self.ADMISSION_QUEUE_LIMIT = int(os.getenv('ADMISSION_QUEUE_LIMIT') or 32)
+        self.ADMISSION_QUEUE_TIMEOUT = int(os.getenv('ADMISSION_QUEUE_TIMEOUT') or 30)
+        self.ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER') or 5)
+        self.ADMISSION_BASE_MB = int(os.getenv('ADMISSION_BASE_MB') or 32)
+        self.ADMISSION_SECTION_MB = int(os.getenv('ADMISSION_SECTION_MB') or 24)
+        self.ADMISSION_AUDIO_SECOND_MB = int(os.getenv('ADMISSION_AUDIO_SECOND_MB') or 2)
+        self.PREVIEW_VOLUME_STEPS = int(os.getenv('PREVIEW_VOLUME_STEPS') or 20)
+        self.PREVIEW_PRERENDER = os.getenv('PREVIEW_PRERENDER', 'false').lower() == 'true'
+        self.RENDER_VARIANT_CONCURRENCY = int(os.getenv('RENDER_VARIANT_CONCURRENCY') or 4)
+        self.GUNICORN_PRELOAD = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+        self.WARM_UP_ENABLED = os.getenv('WARM_UP_ENABLED', 'true').lower() == 'true'
+        self.SCHEDULER_LOCK_PATH = os.getenv('SCHEDULER_LOCK_PATH') or 'data/locks/scheduler.lock'
+        self.SCHEDULER_LEADER_RETRY = int(os.getenv('SCHEDULER_LEADER_RETRY') or 60)
+        self.SCRATCH_DIR = os.getenv('SCRATCH_DIR') or ''
+        self.SCRATCH_IN_MEMORY = os.getenv('SCRATCH_IN_MEMORY', 'true').lower() == 'true'
+        self.SCRATCH_WORKSPACE_MAX_BYTES = int(os.getenv('SCRATCH_WORKSPACE_MAX_BYTES') or 256 * 1024 * 1024)
+        self.SCRATCH_MAX_BYTES = int(os.getenv('SCRATCH_MAX_BYTES') or 1024 * 1024 * 1024)
+        self.SCRATCH_MAX_AGE = int(os.getenv('SCRATCH_MAX_AGE') or 60 * 60)
+        self.SCRATCH_JANITOR_INTERVAL = int(os.getenv('SCRATCH_JANITOR_INTERVAL') or 10 * 60)
+        self.SHARDED_SYNTHESIS = os.getenv('SHARDED_SYNTHESIS', 'false').lower() == 'true'
+        self.SYNTHESIS_SHARD_MAX_CHARS = int(os.getenv('SYNTHESIS_SHARD_MAX_CHARS') or 250)
+        self.SYNTHESIS_SHARD_CONCURRENCY = int(os.getenv('SYNTHESIS_SHARD_CONCURRENCY') or 4)
+        self.SYNTHESIS_SHARD_RETRIES = int(os.getenv('SYNTHESIS_SHARD_RETRIES') or 2)
+        self.SYNTHESIS_SHARD_RETRY_DELAY = int(os.getenv('SYNTHESIS_SHARD_RETRY_DELAY') or 500)
+        self.SYNTHESIS_SENTENCE_PAUSE = int(os.getenv('SYNTHESIS_SENTENCE_PAUSE') or 300)
+        self.SYNTHESIS_PARAGRAPH_PAUSE = int(os.getenv('SYNTHESIS_PARAGRAPH_PAUSE') or 700)
 
     def read_version(self):
         # Path to the VERSION file relative to this script
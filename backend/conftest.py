@@ -0,0 +1,37 @@
+import sys
+import importlib
+import pytest
+import metrics
+from config import Config
+
+# Directories of the Config fields the app writes to, relative to the data directory of a test
+DATA_DIRS = {
+    "AUDIO_CACHE_DIR": "cache",
+    "SINGLE_FLIGHT_LOCK_DIR": "locks",
+    "METRICS_DIR": "metrics",
+    "ADMISSION_DIR": "admission",
+    "MUSIC_LIBRARY_DIR": "background_music",
+    "MUSIC_PREVIEW_DIR": "background_music_previews",
+}
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path_factory, monkeypatch):
+    """
+    Point the data directories of every module at a fresh directory, so tests never write into
+    backend/data. Kept apart from tmp_path, which tests list and fill themselves. The environment
+    is set too, for the pool workers and interpreters the tests start.
+    """
+    importlib.import_module("flask_api")  # Creates the config of every module the routes use
+    directory = tmp_path_factory.mktemp("data")
+    module_configs = {id(module.config): module.config for module in list(sys.modules.values())
+                      if isinstance(getattr(module, "config", None), Config)}
+    for field_name, dirname in DATA_DIRS.items():
+        monkeypatch.setenv(field_name, str(directory / dirname))
+        for module_config in module_configs.values():
+            monkeypatch.setattr(module_config, field_name, str(directory / dirname))
+    yield directory
+    # A snapshot metrics.stage scheduled would otherwise land in backend/data once the fields are restored
+    snapshot_timer = metrics._snapshot_timer
+    if snapshot_timer is not None and snapshot_timer.is_alive():
+        snapshot_timer.cancel()
+        metrics.write_metrics_snapshot()
@@ -1,3 +1,8 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
 class SpeechRateConversions:
     RATES_TO_PERCENTAGES = {
         "1.25X": 25,
@@ -9,4 +14,56 @@ class SpeechRateConversions:
     @classmethod
     def get_percentage_increase(cls, rate):
         normalized_rate = rate.upper()
-        return cls.RATES_TO_PERCENTAGES.get(normalized_rate, None)
\ No newline at end of file
+        return cls.RATES_TO_PERCENTAGES.get(normalized_rate, None)
+
+
+@dataclass
+class PCMAudio:
+    """
+    Decoded audio kept in memory as a contiguous NumPy array.
+
+    samples (np.ndarray): Signed integer samples shaped (frames, channels).
+    sample_rate (int): Frames per second.
+    """
+    samples: np.ndarray
+    sample_rate: int
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def sample_width(self):
+        return self.samples.dtype.itemsize
+
+    @property
+    def frame_count(self):
+        return self.samples.shape[0]
+
+    @property
+    def duration_ms(self):
+        return round(1000 * self.frame_count / self.sample_rate)
+
+
+@dataclass
+class ScriptShard:
+    """
+    Part of a script synthesized on its own, see script_shards.py.
+
+    text (str): What is sent to ElevenLabs.
+    pause_after_ms (int): Silence between this shard and the next one.
+    """
+    text: str
+    pause_after_ms: int
+
+
+@dataclass
+class ScratchWorkspace:
+    """
+    The private scratch directory of a request, see workspace.py.
+
+    directory (str): Where the request writes its files, removed when the workspace is left.
+    max_bytes (int): Most bytes the directory may hold.
+    """
+    directory: str
+    max_bytes: int
@@ -1,9 +1,8 @@
 import os
-import requests
 from firebase_admin import firestore
 from dotenv import load_dotenv
 from utils import initialize_firebase
-from tqdm import tqdm
+from music_library import sync_library
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,19 +28,9 @@ def download_music_files_from_collection():
     # Prepare list of file names
     music_filenames = [doc.get('background_music_filename') for doc in docs if doc.get('background_music_filename')]
 
-    # Check if the directory is empty
-    if not os.listdir(music_directory):
-        print('\n---Downloading background music files---\n')
-        for filename in tqdm(music_filenames, desc="Downloading files", unit="file"):
-            file_url = base_url + filename.replace(' ', '%20')
-            response = requests.get(file_url)
-            if response.status_code == 200:
-                with open(os.path.join(music_directory, filename), 'wb') as music_file:
-                    music_file.write(response.content)
-                print(f"Downloaded {filename}")
-        print("MP3 files downloaded.")
-    else:
-        print("Background music directory is not empty, skipping download.")
+    # Download only the files that are missing or changed since the last sync
+    print('\n---Syncing background music files---\n')
+    sync_library(base_url, music_directory, music_filenames)
 
 if __name__ == "__main__":
     download_music_files_from_collection()
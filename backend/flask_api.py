@@ -1,18 +1,26 @@
 #Relative path: flask_api.py
-import os
-from utils import voice_music_mixer, generate_voiceover_from_history_item_id, generate_voiceover_from_voice_id, download_music_files_helper
-from utils import generate_timestamped_filename, cleanup_workdir, require_api_key, change_audio_volume
-from utils import stitch_audio_segments, process_audio_to_remove_pauses, append_pause, immediate_file_cleanup
-from utils import moodify_script, upload_audio_segment_to_s3, generate_pyro_history_item_id, adjust_speech_rate, slice_audio_at_cutoff
-from utils import adjust_music_length_to_voiceover
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import generate_voiceover_from_history_item_id, generate_voiceover_from_voice_id, download_music_files_helper
+from utils import generate_sharded_voiceover
+from utils import generate_timestamped_filename, require_api_key, stream_volume_change
+from utils import process_and_stitch_sections
+from utils import moodify_script, upload_audio_segment_to_s3, generate_pyro_history_item_id, render_preprocessed_voiceover
+from utils import ensure_music_sidecar, load_music_pcm, stream_voice_music_mix, upload_pcm_blocks_to_s3
+from utils import tts_result_cache_key, quantize_preview_volume, ensure_music_loudness_index
+from utils import cached_preview_render, cache_preview_render
+from audio_stream import stream_encode_pcm
+from audio_cache import get_cached_value, put_cached_value
+from music_library import requested_library_file, UnknownLibraryFile
+from single_flight import single_flight
+from metrics import timed_iteration, start_request_trace, finish_request_trace, render_metrics
+from admission import admission_controlled, run_admitted, rejection_response, AdmissionRejected
+from startup import is_ready, start_warm_up
 from flask_cors import CORS
-from apscheduler.schedulers.background import BackgroundScheduler
-from pytz import timezone
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, jsonify, g
 import logging
 from config import Config
-from celery import Celery
-from pydub import AudioSegment  
 
 config = Config()
 logging.basicConfig(level=logging.INFO)
@@ -21,24 +29,38 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes for now
 
-scheduler = BackgroundScheduler()
-scheduler.start()
-scheduler.add_job(cleanup_workdir, 'cron', hour=0, minute=0, timezone=timezone('US/Eastern'))
+# The scheduled jobs (the scratch janitor) run in one worker per host, see startup.py
 
-celery_app_name = "audio_services"
-celery = Celery(
-    celery_app_name, 
-    broker=config.broker_url,
-    broker_transport_options=config.broker_transport_options, 
-    task_create_missing_queues=False, # If this is set to true, Celery will automatically create a queue in AWS.
-    )
+if config.task_always_eager:
+    logger.warning("LOCAL_JOBS is set: /jobs run in the web process with an in-memory result backend")
+elif config.broker_url.startswith("memory://"):
+    logger.warning("BROKER_URL is not set, /jobs is disabled. Set LOCAL_JOBS=true to run jobs in the web process")
+elif not config.result_backend:
+    logger.warning("RESULT_BACKEND is not set, /jobs is disabled")
+
+
+@app.before_request
+def start_metrics_trace():
+    g.metrics_trace_token = start_request_trace(request.url_rule.rule if request.url_rule else "unmatched")
 
-celery.conf.update(
-    accept_content=config.accept_content,
-    task_serializer = config.task_serializer,
-    result_serializer = config.result_serializer
-)
+@app.after_request
+def finish_metrics_trace(response):
+    if "metrics_trace_token" in g:
+        finish_request_trace(g.pop("metrics_trace_token"), request.method, response.status_code)
+    return response
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Per-stage timings and request durations of every worker on this host, for Prometheus."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until this worker is warmed up. A probe reaching a cold worker starts its warm-up."""
+    if is_ready():
+        return "Ready", 200
+    start_warm_up()
+    return "Warming up", 503
 
 @app.route('/')
 def home():
@@ -49,107 +71,150 @@ def home():
 @app.route('/update-music-lib', methods=['GET'])
 @require_api_key(config.FIREBAY_MUSIC_UPDATE_KEY)
 def download_music_files_from_collection():
-    download_music_files_helper()
+    # Concurrent update requests join the sync already running
+    single_flight("update_music_lib", {}, download_music_files_helper)
     return "Music library update completed successfully.", 200
 
 @app.route('/produce-spot', methods=['POST'])
 def produce_spot():
-    voice_file_path, music_file_path, output_file_path = None, None, None
-    adjusted_music_path = None  # Initialize adjusted_music_path to None
-
     try:
         data = request.get_json()
         logger.info("Received data at produce_spot: %s", data)
-        user_id = data.get('user_id')
-        history_item_id_list = data.get('history_item_id_list')
-        end_of_section_pause_duration_list = data.get('end_of_section_pause_duration_list')
-        music_filename = data.get('music_filename', "No Music")
-        music_vol = float(data.get('music_vol', 0.1))
-
-        # Step 1: Stitch Sections
-        section_voiceover_segments = []
-        for history_item_id, end_of_section_pause_duration in zip(history_item_id_list, end_of_section_pause_duration_list):
-            end_of_section_pause_duration_milliseconds = end_of_section_pause_duration * 1000
-            section_voiceover_segment = _process_section(history_item_id, end_of_section_pause_duration_milliseconds)
-            section_voiceover_segments.append(section_voiceover_segment)
-
-        stitched_voiceover = stitch_audio_segments(section_voiceover_segments)
-
-        # Save stitched voiceover to a file
-        voice_file_path = f"data/workdir/{generate_timestamped_filename('sectioned_voiceover_', user_id, '.mp3')}"
-        stitched_voiceover.export(voice_file_path, format="mp3", bitrate="192k")
-        logger.info("Stitched voiceover exported to %s", voice_file_path)
-
-        # Generate S3 object details
-        pyro_history_item_id = generate_pyro_history_item_id(generate_timestamped_filename('produced_spot_', user_id, '.mp3'))
-        pyro_history_item_id = "pyro_" + pyro_history_item_id
-        bucket_name = 'workingdir--storage'
-        object_name = f"primary--distribution/{pyro_history_item_id}"
-
-        # Step 2: Check for "No Music" option
-        if not music_filename.strip() or music_filename.lower() == "no music":
-            # Upload the stitched voiceover directly to S3
-            try:
-                # Read the audio file into an AudioSegment
-                voiceover_audio = AudioSegment.from_file(voice_file_path)
-                upload_audio_segment_to_s3(voiceover_audio, bucket_name, object_name)
-                logger.info("No music selected. Uploaded voiceover to S3: %s", pyro_history_item_id)
-                return jsonify({"pyro_history_item_id": pyro_history_item_id})
-            except Exception as e:
-                logger.error(f"Failed to upload the audio: {str(e)}")
-                return jsonify({"error": "Failed to upload the audio", "details": str(e)}), 500
-
-        # Step 3: Adjust Background Music Length
-        music_file_path = f"data/background_music/{music_filename}"
-        if not os.path.exists(music_file_path):
-            logger.info(f"Music file {music_filename} not found. Initiating download.")
-            download_music_files_helper()
-
-        adjusted_music_path = f"data/workdir/{generate_timestamped_filename('adjusted_music_', user_id, '.mp3')}"
-        adjust_music_length_to_voiceover(music_file_path, voice_file_path, adjusted_music_path)
-        logger.info("Adjusted music length saved to %s", adjusted_music_path)
-
-        # Step 4: Mix Voiceover with Adjusted Music
-        output_file_path = f"data/workdir/{generate_timestamped_filename('combined_', user_id, '.mp3')}"
-
-        voice_music_mixer(
-            voice_file_path,
-            adjusted_music_path,
-            len(stitched_voiceover) / 1000,  # Duration in seconds
-            music_vol,
-            output_file_path=output_file_path
-        )
-        logger.info("Produced mixed audio stored at %s", output_file_path)
-
-        # Upload the combined audio to S3
-        try:
-            combined_audio = AudioSegment.from_file(output_file_path)
-            upload_audio_segment_to_s3(combined_audio, bucket_name, object_name)
-            logger.info("Mixed audio uploaded to S3: %s", pyro_history_item_id)
-            return jsonify({"pyro_history_item_id": pyro_history_item_id})
-        except Exception as e:
-            logger.error(f"Failed to upload the audio: {str(e)}")
-            return jsonify({"error": "Failed to upload the audio", "details": str(e)}), 500
-
+        # Identical requests wait for the leader's result, only the leader is admitted
+        pyro_history_item_id = single_flight("produce_spot", data,
+                                             lambda: run_admitted('/produce-spot', data, lambda: produce_spot_pipeline(data)))
+        return jsonify({"pyro_history_item_id": pyro_history_item_id})
+
+    except AdmissionRejected as rejected:
+        return rejection_response(rejected.rejection)
+    except UnknownLibraryFile as e:
+        return {"error": str(e)}, 400
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         return {"error": str(e)}, 500
 
-    finally:
-            # Cleanup: Delete generated files to free up space
-            paths_to_delete = [voice_file_path, output_file_path]
-            if adjusted_music_path:
-                paths_to_delete.append(adjusted_music_path)
-            # Filter out any None values
-            paths_to_delete = [path for path in paths_to_delete if path]
-            immediate_file_cleanup(paths_to_delete)
-            logger.info(f"Cleaned up temporary files: {paths_to_delete}")
+def produce_spot_pipeline(data):
+    """Stitch the sections, mix in the background music and upload the spot. Returns its pyro_history_item_id."""
+    user_id = data.get('user_id')
+    history_item_id_list = data.get('history_item_id_list')
+    end_of_section_pause_duration_list = data.get('end_of_section_pause_duration_list')
+    music_filename = data.get('music_filename', "No Music")
+    music_vol = float(data.get('music_vol', 0.1))
+
+    # Step 1: Stitch Sections, only the sections changed since an earlier render are processed
+    end_of_section_pause_duration_milliseconds_list = [duration * 1000 for duration in end_of_section_pause_duration_list]
+    stitched_voiceover = process_and_stitch_sections(history_item_id_list, end_of_section_pause_duration_milliseconds_list)
+    logger.info("Stitched %s sections into %s ms of voiceover", len(history_item_id_list), stitched_voiceover.duration_ms)
+
+    return mix_and_upload_spot(stitched_voiceover, user_id, music_filename, music_vol)
+
+def new_pyro_object(base_name, user_id, extension):
+    """Name a new pyro_ upload. Returns (pyro_history_item_id, bucket_name, object_name)."""
+    pyro_history_item_id = "pyro_" + generate_pyro_history_item_id(generate_timestamped_filename(base_name, user_id, extension))
+    return pyro_history_item_id, 'workingdir--storage', f"primary--distribution/{pyro_history_item_id}"
+
+def mix_and_upload_spot(stitched_voiceover, user_id, music_filename, music_vol, ad_length=None, base_name='produced_spot_'):
+    """
+    Steps 2 to 4 of produce_spot_pipeline, mixing in the background music and uploading. Returns the pyro_history_item_id.
+    The music is looped under the whole voiceover, or mixed to `ad_length` seconds like /generate-mix when given.
+    """
+    # Generate S3 object details
+    pyro_history_item_id, bucket_name, object_name = new_pyro_object(base_name, user_id, '.mp3')
+
+    # Step 2: Check for "No Music" option
+    if not music_filename.strip() or music_filename.lower() == "no music":
+        # Upload the stitched voiceover directly to S3
+        if not upload_audio_segment_to_s3(stitched_voiceover, bucket_name, object_name):
+            raise RuntimeError("Failed to upload the audio")
+        logger.info("No music selected. Uploaded voiceover to S3: %s", pyro_history_item_id)
+        return pyro_history_item_id
+
+    # Step 3: Load the background music sidecar
+    music_file_path = requested_library_file(config.BACKGROUND_MUSIC_URL, config.MUSIC_LIBRARY_DIR, music_filename)
+    ensure_music_sidecar(music_file_path)
+
+    # Step 4: Loop, trim, fade and mix the music under the voiceover in a single pass
+    music_audio = load_music_pcm(music_file_path)
+    mixed_blocks = timed_iteration("mix", stream_voice_music_mix(
+        stitched_voiceover,
+        music_audio,
+        stitched_voiceover.duration_ms / 1000 if ad_length is None else ad_length,  # Duration in seconds
+        music_vol,
+        loop_music=ad_length is None,
+    ))
+
+    # Encode and upload the combined audio to S3 while it is being mixed
+    channels = max(stitched_voiceover.channels, music_audio.channels)
+    if not upload_pcm_blocks_to_s3(mixed_blocks, music_audio.sample_rate, channels, bucket_name, object_name):
+        raise RuntimeError("Failed to upload the audio")
+    logger.info("Mixed audio uploaded to S3: %s", pyro_history_item_id)
+    return pyro_history_item_id
+
+
+@app.route('/render-variants', methods=['POST'])
+def render_variants():
+    try:
+        data = request.get_json()
+        logger.info("Received data at render_variants: %s", data)
+        # Identical requests wait for the leader's result, only the leader is admitted
+        pyro_history_item_ids = single_flight("render_variants", data,
+                                              lambda: run_admitted('/render-variants', data, lambda: render_variants_pipeline(data)))
+        return jsonify({"pyro_history_item_ids": pyro_history_item_ids})
+
+    except AdmissionRejected as rejected:
+        return rejection_response(rejected.rejection)
+    except UnknownLibraryFile as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return {"error": str(e)}, 500
 
+def render_variants_pipeline(data):
+    """
+    Mix one voiceover with several music tracks and volumes. The voiceover is fetched, decoded and
+    processed once, then the variants are mixed, encoded and uploaded in parallel.
+
+    Parameters:
+    data (dict): The voice source, either history_item_id_list with end_of_section_pause_duration_list
+                 (stitched like /produce-spot) or a history_item_id or pyro_history_item_id (like /generate-mix),
+                 and "variants", a list of {"music_filename", "music_vol", "ad_length" (optional)}.
+
+    Returns:
+    list: The pyro_history_item_id of each variant, in order.
+    """
+    user_id = data.get('user_id')
+    variants = data.get('variants') or []
+    if not variants:
+        raise ValueError("At least one variant must be provided.")
+
+    if data.get('history_item_id_list'):
+        end_of_section_pause_duration_milliseconds_list = [duration * 1000 for duration in data.get('end_of_section_pause_duration_list')]
+        voiceover = process_and_stitch_sections(data.get('history_item_id_list'),
+                                                end_of_section_pause_duration_milliseconds_list)
+    elif data.get('history_item_id') or data.get('pyro_history_item_id'):
+        voiceover = generate_voiceover_from_history_item_id(data.get('history_item_id') or data.get('pyro_history_item_id'))
+        if voiceover is None:
+            raise Exception("Failed to fetch the voiceover.")
+    else:
+        raise Exception("Either history_item_id_list, history_item_id or pyro_history_item_id must be provided.")
+    logger.info("Prepared %s ms of voiceover for %s variants", voiceover.duration_ms, len(variants))
+
+    def render_variant(index, variant):
+        ad_length = variant.get('ad_length')
+        # Each variant is uploaded under its own name
+        return mix_and_upload_spot(voiceover, user_id, variant.get('music_filename', "No Music"),
+                                   float(variant.get('music_vol', 0.1)),
+                                   ad_length=None if ad_length is None else int(ad_length),
+                                   base_name=f'produced_spot_variant_{index}_')
+
+    with ThreadPoolExecutor(max_workers=min(config.RENDER_VARIANT_CONCURRENCY, len(variants))) as render_pool:
+        futures = [render_pool.submit(contextvars.copy_context().run, render_variant, index, variant)
+                   for index, variant in enumerate(variants)]
+        return [future.result() for future in futures]
 
 @app.route('/generate-mix', methods=['POST'])
+@admission_controlled
 def generate_and_mix_audio():
-    music_file_path, voice_file_path, output_file_path = None, None, None
-
     try:
         data = request.get_json()
         logger.info("Received data at generate_and_mix_audio: %s", data)
@@ -162,80 +227,67 @@ def generate_and_mix_audio():
 
         if history_item_id:
             logger.info("Generating voiceover from history_item_id: %s", history_item_id)
-            voice_file_path = f"data/workdir/{generate_timestamped_filename('script_voiceover', user_id, '.wav')}"
-            script_voiceover = generate_voiceover_from_history_item_id(history_item_id)
-            script_voiceover.export(voice_file_path, format="wav", bitrate="192k")
+            voiceover = generate_voiceover_from_history_item_id(history_item_id)
             logger.info("Generated voiceover from history_item_id: %s", history_item_id)
 
         elif pyro_history_item_id:
             logger.info("Generating voiceover from pyro_history_item_id: %s", pyro_history_item_id)
-            voice_file_path = f"data/workdir/{generate_timestamped_filename('stitched_voiceover' , user_id, '.wav')}"
-            stitched_voiceover = generate_voiceover_from_history_item_id(pyro_history_item_id)
-            stitched_voiceover.export(voice_file_path, format="wav", bitrate="192k")
+            voiceover = generate_voiceover_from_history_item_id(pyro_history_item_id)
             logger.info("Generated voiceover from pyro_history_item_id: %s", pyro_history_item_id)
         else:
             raise Exception("Either history_item_id or pyro_history_item_id must be provided.")
 
-        music_file_path = f"data/background_music/{music_filename}"
-        if not os.path.exists(music_file_path):
-            logger.info(f"Music file {music_filename} not found. Initiating download.")
-            download_music_files_helper()
+        if voiceover is None:
+            raise Exception("Failed to fetch the voiceover.")
 
-        output_file_path = f"data/workdir/{generate_timestamped_filename('combined', user_id, '.mp3')}"
-        voice_music_mixer(voice_file_path, music_file_path, ad_length, music_vol, output_file_path=output_file_path)
-        logger.info("All mp3 files stored at", os.listdir('data'))
+        music_file_path = requested_library_file(config.BACKGROUND_MUSIC_URL, config.MUSIC_LIBRARY_DIR, music_filename)
+        ensure_music_sidecar(music_file_path)
 
-        # Send the combined audio file as response
-        response = send_file(output_file_path, as_attachment=True, download_name=f"combined_{user_id}.mp3")
+        music_audio = load_music_pcm(music_file_path)
+        mixed_blocks = timed_iteration("mix", stream_voice_music_mix(voiceover, music_audio, ad_length, music_vol))
+        channels = max(voiceover.channels, music_audio.channels)
+        encoded_chunks = stream_encode_pcm(mixed_blocks, music_audio.sample_rate, channels)
+        logger.info("Streaming the mix of %s for user %s", music_filename, user_id)
 
-        return response
+        # Send the combined audio as it is being mixed and encoded
+        return _streamed_audio_response(encoded_chunks, f"combined_{user_id}.mp3")
 
+    except UnknownLibraryFile as e:
+        return {"error": str(e)}, 400
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return {"error": str(e)}, 500
 
-    finally:
-        # Cleanup: Delete generated files to free up space
-        paths_to_delete = [voice_file_path, output_file_path]
-        immediate_file_cleanup(paths_to_delete)
-
 @app.route('/stitch-sections', methods=['POST'])
 def stitch_sections():
-    voice_file_path = None
-
     try:
         data = request.get_json()
         logger.info("Received data at stitch_sections: %s", data)
-        user_id = data.get('user_id')
-        history_item_id_list = data.get('history_item_id_list')
-        end_of_section_pause_duration_list = data.get('end_of_section_pause_duration_list')
-        section_voiceover_segments = []
-        voice_file_path = f"data/workdir/{generate_timestamped_filename('sectioned_voiceover_', user_id, '.mp3')}"
-
-        for history_item_id, end_of_section_pause_duration in zip(history_item_id_list, end_of_section_pause_duration_list):
-            end_of_section_pause_duration_milliseconds = end_of_section_pause_duration * 1000
-            section_voiceover_segment = _process_section(history_item_id, end_of_section_pause_duration_milliseconds )
-            section_voiceover_segments.append(section_voiceover_segment)
-
-        stitched_voiceover =stitch_audio_segments(section_voiceover_segments)
-        pyro_history_item_id = generate_pyro_history_item_id(generate_timestamped_filename('stitched_voiceover_', user_id, '.wav'))
-        pyro_history_item_id = "pyro_" + pyro_history_item_id
-        bucket_name='workingdir--storage'
-        object_name =f"primary--distribution/{pyro_history_item_id}"
-
-        try:
-            upload_audio_segment_to_s3(stitched_voiceover, bucket_name, object_name)
-            logger.info("Generated voiceover pyro_history_item_id and uploaded to S3: %s", pyro_history_item_id)
-            return jsonify({"pyro_history_item_id": pyro_history_item_id})
-        except Exception as e:
-            return jsonify({"error": "Failed to upload the audio", "details": str(e)}), 500
+        # Identical requests wait for the leader's result, only the leader is admitted
+        pyro_history_item_id = single_flight("stitch_sections", data,
+                                             lambda: run_admitted('/stitch-sections', data, lambda: stitch_sections_pipeline(data)))
+        return jsonify({"pyro_history_item_id": pyro_history_item_id})
 
+    except AdmissionRejected as rejected:
+        return rejection_response(rejected.rejection)
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return {"error": str(e)}, 500
 
-    finally:
-        immediate_file_cleanup([voice_file_path])
+def stitch_sections_pipeline(data):
+    """Stitch the sections into one voiceover and upload it. Returns its pyro_history_item_id."""
+    user_id = data.get('user_id')
+    history_item_id_list = data.get('history_item_id_list')
+    end_of_section_pause_duration_list = data.get('end_of_section_pause_duration_list')
+
+    end_of_section_pause_duration_milliseconds_list = [duration * 1000 for duration in end_of_section_pause_duration_list]
+    stitched_voiceover = process_and_stitch_sections(history_item_id_list, end_of_section_pause_duration_milliseconds_list)
+    pyro_history_item_id, bucket_name, object_name = new_pyro_object('stitched_voiceover_', user_id, '.wav')
+
+    if not upload_audio_segment_to_s3(stitched_voiceover, bucket_name, object_name):
+        raise RuntimeError("Failed to upload the audio")
+    logger.info("Generated voiceover pyro_history_item_id and uploaded to S3: %s", pyro_history_item_id)
+    return pyro_history_item_id
 
 
 @app.route('/music_preview_volume_change', methods=['POST'])
@@ -243,84 +295,217 @@ def music_preview_volume_change():
     try:
         data = request.get_json()
         logger.info("Received data at music_preview_volume_change: %s", data)
-        music_vol = float(data.get('music_vol', 0.10))
+        # Slider positions are snapped to the volume steps whose renders are cached
+        music_vol = quantize_preview_volume(float(data.get('music_vol', 0.10)))
         music_choice = data.get('music_choice')
         user_id = data.get('user_id')
 
-        input_file_path = f"data/background_music_previews/{music_choice}"
-        if not os.path.exists(input_file_path):
-            logger.info(f"Music file {music_choice} not found. Initiating download.")
-            download_music_files_helper()
-        output_file_path = f"data/workdir/{generate_timestamped_filename('vol_changed', user_id, '.mp3')}"
-
-        change_audio_volume(input_file_path, output_file_path, music_vol)
-        logger.info("Changed audio volume at", os.listdir('data'))
-
-        response = send_file(output_file_path, as_attachment=True, download_name=f"vol_changed_{user_id}.mp3")
-
-        return response
-
+        input_file_path = requested_library_file(config.MUSIC_PREVIEW_URL, config.MUSIC_PREVIEW_DIR, music_choice)
+        loudness_index = ensure_music_loudness_index(input_file_path)
+        gain_db = music_vol * 30 - 30
+        loudness_headers = {"X-Peak-dBFS": f"{loudness_index['peak_dbfs'] + gain_db:.2f}",
+                            "X-RMS-dBFS": f"{loudness_index['rms_dbfs'] + gain_db:.2f}"}
+
+        encoded_chunks = cached_preview_render(input_file_path, music_vol)
+        if encoded_chunks is None:
+            preview_audio = load_music_pcm(input_file_path)
+            adjusted_blocks = stream_volume_change(preview_audio, music_vol)
+            encoded_chunks = cache_preview_render(
+                stream_encode_pcm(adjusted_blocks, preview_audio.sample_rate, preview_audio.channels),
+                input_file_path, music_vol)
+        logger.info("Streaming %s at volume %s", music_choice, music_vol)
+
+        return _streamed_audio_response(encoded_chunks, f"vol_changed_{user_id}.mp3", loudness_headers)
+
+    except UnknownLibraryFile as e:
+        return {"error": str(e)}, 400
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return {"error": str(e)}, 500
 
-    finally:
-        # Cleanup: Delete the generated file to free up space
-        immediate_file_cleanup([output_file_path])
-
 @app.route('/preprocess-voiceover', methods=['POST'])
+@admission_controlled
 def preprocess_voiceover_endpoint():
     data = request.get_json()
     logger.info("Received data at preprocess_voiceover_endpoint: %s", data)
     
     try:
-        script = data.get('script')
-        voice = data.get('voice')
-        voice_gender = data.get('voice_gender')
-        model_id = data.get('model_id', "eleven_multilingual_v2")
-        user_id = data.get('user_id')
-        speech_rate = float(data.get('speech_rate', 0))
-        intonation_consistency = data.get('voice_intonation_consistency', 50)
-        intonation_consistency = float(intonation_consistency) / 100
-        emotion = data.get('emotion', None)
-
-        logger.info("Parsed data: script=%s, voice=%s, voice_gender=%s, model_id=%s, user_id=%s, dragons_breath_mode=%s, speech_rate=%s, intonation_consistency=%s",
-                    script, voice, voice_gender, model_id, user_id, emotion, speech_rate, intonation_consistency)
-
-        if emotion:
-            script = moodify_script(script, voice_gender, emotion)
-            logger.info("Moodified script: %s", script)
-            
-            script_voiceover = generate_voiceover_from_voice_id(script, voice, model_id, "mp3_44100_192", intonation_consistency)
-            script_voiceover = slice_audio_at_cutoff(script_voiceover, config.MOOD_INTERVAL)
-            script_voiceover = process_audio_to_remove_pauses(script_voiceover)
-            logger.info("Processed voiceover with Dragon's Breath mode")
-        else:
-            script_voiceover = generate_voiceover_from_voice_id(script, voice, model_id, "mp3_44100_192", intonation_consistency)
-            logger.info("Generated voiceover without Dragon's Breath mode")
-
-        if speech_rate != 0:
-            script_voiceover = adjust_speech_rate(script_voiceover, speech_rate)
-            logger.info("Adjusted speech rate by %s%%", speech_rate)
-
-        pyro_history_item_id = "pyro_" + generate_pyro_history_item_id(generate_timestamped_filename('processed_voiceover_', user_id, '.wav'))
-        object_name = f"primary--distribution/{pyro_history_item_id}"
-        bucket_name = 'workingdir--storage'
-
-        upload_audio_segment_to_s3(script_voiceover, bucket_name, object_name)
-        logger.info("Uploaded audio segment to S3: bucket=%s, object=%s", bucket_name, object_name)
-
+        pyro_history_item_id = preprocess_voiceover_pipeline(data)
         return jsonify({'pyro_history_item_id': pyro_history_item_id}), 200
 
     except Exception as e:
         logger.error("Failed to process or upload the audio", exc_info=True)
         return jsonify({"error": "Failed to process or upload the audio", "details": str(e)}), 500
 
-def _process_section(history_item_id, end_of_section_pause_duration):
-    section_voiceover_segment = generate_voiceover_from_history_item_id(history_item_id)
-    section_voiceover_segment = process_audio_to_remove_pauses(section_voiceover_segment)
-    section_voiceover_segment = append_pause(section_voiceover_segment, duration=end_of_section_pause_duration)
-    return section_voiceover_segment
+def preprocess_voiceover_pipeline(data):
+    """
+    Synthesize a script, apply Dragon's Breath and speech rate, and upload it. Returns its pyro_history_item_id.
+    Identical inputs reuse the previous upload unless `fresh_take` is set.
+    """
+    voiceover_request = parse_preprocess_voiceover_request(data)
+    cached_pyro_history_item_id = cached_preprocessed_voiceover(voiceover_request)
+    if cached_pyro_history_item_id:
+        return cached_pyro_history_item_id
+
+    synthesize = generate_sharded_voiceover if voiceover_request['sharded'] else generate_voiceover_from_voice_id
+    script_voiceover = synthesize(voiceover_request['script'], voiceover_request['voice'],
+                                  voiceover_request['model_id'], "mp3_44100_192",
+                                  voiceover_request['intonation_consistency'])
+    if script_voiceover is None:
+        raise ValueError("Failed to generate the voiceover")
+    script_voiceover = render_preprocessed_voiceover(script_voiceover, voiceover_request['emotion'], voiceover_request['speech_rate'])
+
+    pyro_history_item_id, bucket_name, object_name = new_pyro_object('processed_voiceover_', voiceover_request['user_id'], '.wav')
+    if not upload_audio_segment_to_s3(script_voiceover, bucket_name, object_name):
+        raise RuntimeError("Failed to upload the audio")
+    logger.info("Uploaded audio segment to S3: bucket=%s, object=%s", bucket_name, object_name)
+    remember_preprocessed_voiceover(voiceover_request, pyro_history_item_id)
+    return pyro_history_item_id
+
+def parse_preprocess_voiceover_request(data):
+    """Read the /preprocess-voiceover body, moodify the script and key the inputs for the TTS result cache."""
+    script = data.get('script')
+    voice = data.get('voice')
+    voice_gender = data.get('voice_gender')
+    model_id = data.get('model_id', "eleven_multilingual_v2")
+    user_id = data.get('user_id')
+    speech_rate = float(data.get('speech_rate', 0))
+    intonation_consistency = data.get('voice_intonation_consistency', 50)
+    intonation_consistency = float(intonation_consistency) / 100
+    emotion = data.get('emotion', None)
+    fresh_take = bool(data.get('fresh_take', False))
+    sharded = bool(data.get('sharded_synthesis', config.SHARDED_SYNTHESIS))
+
+    logger.info("Parsed data: script=%s, voice=%s, voice_gender=%s, model_id=%s, user_id=%s, dragons_breath_mode=%s, speech_rate=%s, intonation_consistency=%s",
+                script, voice, voice_gender, model_id, user_id, emotion, speech_rate, intonation_consistency)
+
+    if emotion:
+        script = moodify_script(script, voice_gender, emotion)
+        logger.info("Moodified script: %s", script)
+
+    return {
+        'script': script,
+        'voice': voice,
+        'model_id': model_id,
+        'user_id': user_id,
+        'speech_rate': speech_rate,
+        'intonation_consistency': intonation_consistency,
+        'emotion': emotion,
+        'fresh_take': fresh_take,
+        'sharded': sharded,
+        'cache_key': tts_result_cache_key(script, voice, model_id, "mp3_44100_192", intonation_consistency, emotion, speech_rate,
+                                          sharded),
+    }
+
+def cached_preprocessed_voiceover(voiceover_request):
+    """pyro_history_item_id previously rendered from the same inputs, None on a miss or a fresh take."""
+    if voiceover_request['fresh_take']:
+        return None
+    cached_pyro_history_item_id = get_cached_value("tts_results", voiceover_request['cache_key'])
+    if cached_pyro_history_item_id:
+        logger.info("Reusing voiceover rendered from identical inputs: %s", cached_pyro_history_item_id)
+    return cached_pyro_history_item_id
+
+def remember_preprocessed_voiceover(voiceover_request, pyro_history_item_id):
+    put_cached_value("tts_results", voiceover_request['cache_key'], pyro_history_item_id,
+                     ttl=config.TTS_RESULT_CACHE_TTL, max_entries=config.TTS_RESULT_CACHE_MAX_ENTRIES)
+
+def produce_spot_task(data):
+    return single_flight("produce_spot", data, lambda: produce_spot_pipeline(data))
+
+def stitch_sections_task(data):
+    return single_flight("stitch_sections", data, lambda: stitch_sections_pipeline(data))
+
+def preprocess_voiceover_task(data):
+    return preprocess_voiceover_pipeline(data)
+
+# Pipeline of each /jobs route, with the name of its Celery task
+JOB_TASKS = {
+    "produce-spot": ("produce_spot", produce_spot_task),
+    "stitch-sections": ("stitch_sections", stitch_sections_task),
+    "preprocess-voiceover": ("preprocess_voiceover", preprocess_voiceover_task),
+}
+
+# Building the Celery app takes about as long as the rest of the imports of the app, so it is
+# created on first use, by /jobs or by `celery -A flask_api.celery worker`
+celery_app_name = "audio_services"
+_celery = None
+_celery_lock = threading.Lock()
+
+def get_celery():
+    """Return the Celery app, creating it and registering the job tasks on first use."""
+    global _celery
+    with _celery_lock:
+        if _celery is None:
+            from celery import Celery
+            celery = Celery(
+                celery_app_name,
+                broker=config.broker_url,
+                backend=config.result_backend,
+                broker_transport_options=config.broker_transport_options,
+                task_create_missing_queues=False, # If this is set to true, Celery will automatically create a queue in AWS.
+                )
+            celery.conf.update(
+                accept_content=config.accept_content,
+                task_serializer = config.task_serializer,
+                result_serializer = config.result_serializer,
+                task_track_started=True,
+                task_always_eager=config.task_always_eager,
+                task_store_eager_result=True,
+            )
+            for task_name, task in JOB_TASKS.values():
+                celery.task(name=task_name)(task)
+            _celery = celery
+        return _celery
+
+def __getattr__(name):
+    # Keeps flask_api.celery, the app the workers are started with, working without building it at import
+    if name == "celery":
+        return get_celery()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@app.route('/jobs/<pipeline_name>', methods=['POST'])
+def submit_job(pipeline_name):
+    """Queue one of the audio pipelines on the Celery workers. Takes the same JSON body as its synchronous endpoint."""
+    job_task = JOB_TASKS.get(pipeline_name)
+    if job_task is None:
+        return jsonify({"error": f"Unknown pipeline {pipeline_name}", "pipelines": list(JOB_TASKS)}), 404
+
+    if config.broker_url.startswith("memory://") and not config.task_always_eager:
+        return jsonify({"error": "No broker is configured, set BROKER_URL (or LOCAL_JOBS=true for local runs)"}), 501
+    if not config.result_backend:
+        # The job would run, but GET /jobs/<job_id> could never report its result
+        return jsonify({"error": "No result backend is configured, set RESULT_BACKEND"}), 501
+
+    data = request.get_json()
+    logger.info("Received data at submit_job for %s: %s", pipeline_name, data)
+    task_name, _ = job_task
+    job = get_celery().tasks[task_name].apply_async(args=[data])
+    return jsonify({"job_id": job.id}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Report a job as PENDING, STARTED, SUCCESS (with its pyro_history_item_id) or FAILURE (with the error).
+    Celery cannot tell unknown job IDs apart from queued ones, both are PENDING.
+    """
+    job = get_celery().AsyncResult(job_id)
+    try:
+        status = job.state
+    except NotImplementedError:
+        return jsonify({"error": "No result backend is configured, set RESULT_BACKEND"}), 501
+
+    response = {"job_id": job_id, "status": status}
+    if status == "SUCCESS":
+        response["pyro_history_item_id"] = job.result
+    elif status == "FAILURE":
+        response["error"] = str(job.result)
+    return jsonify(response)
+
+def _streamed_audio_response(encoded_chunks, download_name, headers=None):
+    """Send encoded audio with chunked transfer encoding while it is still being encoded."""
+    return Response(encoded_chunks, mimetype="audio/mpeg",
+                    headers={"Content-Disposition": f"attachment; filename={download_name}", **(headers or {})})
 
 # if __name__ == '__main__':
 #     app.run(debug=True, port=5008)
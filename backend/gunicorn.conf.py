@@ -0,0 +1,28 @@
+# Relative path: gunicorn.conf.py
+"""
+Gunicorn settings, read from the working directory by both serving modes (flask_api:app and
+asgi_api:app). See startup.py for what the hooks do.
+
+With GUNICORN_PRELOAD=true the app is imported and warmed up once in the master, and the workers
+fork with it loaded. Otherwise each worker imports the app and warms up on a background thread
+while /ready answers 503.
+"""
+from config import Config
+
+config = Config()
+
+preload_app = config.GUNICORN_PRELOAD
+
+def when_ready(server):
+    if preload_app:
+        from startup import warm_up
+        warm_up()
+
+def post_worker_init(worker):
+    from startup import start_warm_up, start_scheduler
+    start_warm_up()
+    start_scheduler()
+
+def worker_exit(server, worker):
+    from startup import stop_scheduler
+    stop_scheduler()
@@ -0,0 +1,120 @@
+# Relative path: load_test_async.py
+"""
+Load test of /preprocess-voiceover against a simulated slow upstream, sync mode vs async mode.
+
+ElevenLabs synthesis and the S3 upload are replaced by sleeps of --tts-latency and
+--upload-latency seconds, so the numbers measure how well each serving mode overlaps network
+waits rather than DSP speed. Sync mode sends the requests through --sync-workers threads, one
+per gunicorn sync worker. Async mode keeps all --requests in flight on a single event loop.
+
+Usage: python load_test_async.py [--requests 200] [--sync-workers 4] [--tts-latency 1.0] [--upload-latency 0.3]
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import numpy as np
+
+import admission
+import asgi_api
+import audio_cache
+import flask_api
+from data_classes import PCMAudio
+
+
+def _voiceover():
+    return PCMAudio(samples=np.zeros((44100, 1), dtype=np.int16), sample_rate=44100)
+
+def _request_body(index):
+    return {"script": f"Load test take {index}", "voice": "voice-1", "user_id": f"user-{index}", "fresh_take": True}
+
+def _report(mode, latencies, elapsed):
+    latencies = sorted(latencies)
+    print(f"{mode:>6}: {len(latencies) / elapsed:7.1f} requests/s, "
+          f"p50 {statistics.median(latencies):.2f} s, p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} s, "
+          f"total {elapsed:.1f} s")
+
+
+def run_sync(args):
+    def slow_generate(**kwargs):
+        time.sleep(args.tts_latency)
+        return iter([b"mp3"])
+
+    def slow_upload(*upload_args):
+        time.sleep(args.upload_latency)
+        return True
+
+    def send(index):
+        start = time.monotonic()
+        with flask_api.app.test_client() as client:
+            response = client.post("/preprocess-voiceover", json=_request_body(index))
+        assert response.status_code == 200, response.get_json()
+        return time.monotonic() - start
+
+    with patch("utils.get_elevenlabs_client", return_value=SimpleNamespace(generate=slow_generate)), \
+            patch("utils.decode_audio_stream_to_pcm", side_effect=lambda *_, **__: _voiceover()), \
+            patch("flask_api.upload_audio_segment_to_s3", side_effect=slow_upload):
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.sync_workers) as workers:
+            latencies = list(workers.map(send, range(args.requests)))
+        _report("sync", latencies, time.monotonic() - start)
+
+
+def run_async(args):
+    async def slow_generate(**kwargs):
+        await asyncio.sleep(args.tts_latency)
+
+        async def chunks():
+            yield b"mp3"
+        return chunks()
+
+    def slow_upload(*upload_args):
+        time.sleep(args.upload_latency)
+        return True
+
+    async def send(client, index):
+        start = time.monotonic()
+        response = await client.post("/preprocess-voiceover", json=_request_body(index))
+        assert response.status_code == 200, response.json()
+        return time.monotonic() - start
+
+    async def send_all():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=asgi_api.config.ASYNC_IO_THREADS))
+        transport = httpx.ASGITransport(app=asgi_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+            return await asyncio.gather(*[send(client, index) for index in range(args.requests)])
+
+    with patch("asgi_api._elevenlabs_async_client", SimpleNamespace(generate=slow_generate)), \
+            patch.object(asgi_api.config, "SECTION_PROCESS_WORKERS", 0), \
+            patch("asgi_api.decode_audio_stream_to_pcm", side_effect=lambda chunks, format: (list(chunks), _voiceover())[1]), \
+            patch("asgi_api.upload_audio_segment_to_s3", side_effect=slow_upload):
+        start = time.monotonic()
+        latencies = asyncio.run(send_all())
+        _report("async", latencies, time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--sync-workers", type=int, default=4)
+    parser.add_argument("--tts-latency", type=float, default=1.0)
+    parser.add_argument("--upload-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, upstream latency {args.tts_latency} s synthesis + {args.upload_latency} s upload")
+    # Admission control would cap both modes at the same concurrency, measure the serving modes alone
+    with tempfile.TemporaryDirectory() as cache_dir, patch.object(audio_cache.config, "AUDIO_CACHE_DIR", cache_dir), \
+            patch.object(admission.config, "ADMISSION_ENABLED", False), \
+            patch.object(asgi_api.config, "ADMISSION_ENABLED", False):
+        run_sync(args)
+        run_async(args)
+
+
+if __name__ == "__main__":
+    main()
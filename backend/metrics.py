@@ -0,0 +1,380 @@
+# Relative path: metrics.py
+"""
+Per-stage latency and resource instrumentation of the audio pipeline.
+
+Pipeline stages (fetch, decode, pause_removal, stitch, mix, encode, upload, ...) are wrapped in
+stage() or, when they are streamed, timed_iteration(). Each run records its wall time, the CPU
+time of its thread, the bytes it produced or moved and the peak RSS of its process:
+  - into the counters of this process, published as METRICS_DIR/<pid>-<random>.json and merged
+    across gunicorn workers and section pool processes by render_metrics() (served at /metrics).
+    The random part keeps a process that reuses the pid of a dead one from overwriting its
+    counters. The janitor (fold_dead_snapshots, run by the scheduler every METRICS_JANITOR_INTERVAL
+    seconds) folds the snapshots of dead processes into METRICS_DIR/retired.json,
+  - into the trace of the current request, logged as one JSON line when the request ends.
+Streamed stages run interleaved, so their times overlap rather than add up to the request time.
+Plain event counts (e.g. cache hits) are kept with increment_counter() and merged the same way.
+A stage costs a few clock reads and one getrusage call, cheap enough to leave on in production.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import bisect
+import logging
+import resource
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from config import Config
+from processes import process_is_alive
+
+config = Config()
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SNAPSHOT_DELAY = 1.0
+LOCK_FILENAME = ".lock"
+RETIRED_FILENAME = "retired.json"  # Counters of the processes that died
+
+_stage_stats = {}
+_request_stats = {}
+_counter_stats = {}
+_stats_pid = os.getpid()
+_snapshot_filename = f"{_stats_pid}-{uuid.uuid4().hex[:8]}.json"
+_stats_lock = threading.Lock()
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+_snapshot_timer = None
+_gauge_providers = []
+
+
+def _peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss is in KiB on Linux
+
+def _size_of(item):
+    if hasattr(item, "samples"):
+        return item.samples.nbytes
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return len(item)
+    return 0
+
+def _new_histogram():
+    return {"count": 0, "wall_seconds": 0.0, "buckets": [0] * (len(DURATION_BUCKETS) + 1)}
+
+def _observe(histogram, wall_seconds):
+    histogram["count"] += 1
+    histogram["wall_seconds"] += wall_seconds
+    histogram["buckets"][bisect.bisect_left(DURATION_BUCKETS, wall_seconds)] += 1
+
+def _reset_after_fork():
+    """Forked processes start with a copy of their parent's counters, which the parent already publishes."""
+    global _stats_pid, _snapshot_filename
+    if _stats_pid != os.getpid():
+        _stage_stats.clear()
+        _request_stats.clear()
+        _counter_stats.clear()
+        _stats_pid = os.getpid()
+        _snapshot_filename = f"{_stats_pid}-{uuid.uuid4().hex[:8]}.json"
+
+
+def _record_stage(name, wall_seconds, cpu_seconds, size, peak_rss_before, trace):
+    peak_rss = _peak_rss_bytes()
+    with _stats_lock:
+        _reset_after_fork()
+        stats = _stage_stats.setdefault(name, dict(_new_histogram(), cpu_seconds=0.0, bytes=0, peak_rss_bytes=0))
+        _observe(stats, wall_seconds)
+        stats["cpu_seconds"] += cpu_seconds
+        stats["bytes"] += size
+        stats["peak_rss_bytes"] = max(stats["peak_rss_bytes"], peak_rss)
+
+    if trace is not None:
+        trace["stages"].append({
+            "stage": name,
+            "wall_ms": round(wall_seconds * 1000, 1),
+            "cpu_ms": round(cpu_seconds * 1000, 1),
+            "bytes": size,
+            "peak_rss_mb": round(peak_rss / 2**20, 1),
+            "peak_rss_growth_mb": round((peak_rss - peak_rss_before) / 2**20, 1),
+        })
+    else:
+        # Outside of a request (section pool processes, scheduled jobs) nothing else would publish it
+        _schedule_snapshot()
+
+@contextmanager
+def stage(name):
+    """
+    Time one pipeline stage. Yields a dict whose "bytes" the stage sets to the bytes it produced or moved.
+
+    Usage:
+    with stage("decode") as measured:
+        pcm_audio = decode_audio_to_pcm(mp3_data)
+        measured["bytes"] = pcm_audio.samples.nbytes
+    """
+    measured = {"bytes": 0}
+    if not config.METRICS_ENABLED:
+        yield measured
+        return
+    trace = _current_trace.get()
+    peak_rss_before = _peak_rss_bytes()
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield measured
+    finally:
+        _record_stage(name, time.perf_counter() - start, time.thread_time() - start_cpu, measured["bytes"],
+                      peak_rss_before, trace)
+
+def timed_iteration(name, iterable):
+    """
+    Time a streamed stage: the time spent producing each item of `iterable`, summed over the items,
+    and their total size (bytes, or PCMAudio blocks). Recorded once the iteration ends.
+    """
+    if not config.METRICS_ENABLED:
+        return iter(iterable)
+    # Streams are often consumed on another thread (ffmpeg feeders), capture the request now
+    return _timed_items(name, iter(iterable), _current_trace.get())
+
+def _timed_items(name, iterator, trace):
+    wall_seconds = cpu_seconds = 0.0
+    size = 0
+    peak_rss_before = _peak_rss_bytes()
+    try:
+        while True:
+            start, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                wall_seconds += time.perf_counter() - start
+                cpu_seconds += time.thread_time() - start_cpu
+            size += _size_of(item)
+            yield item
+    finally:
+        _record_stage(name, wall_seconds, cpu_seconds, size, peak_rss_before, trace)
+
+
+def increment_counter(metric, description, labels=None, amount=1):
+    """Add `amount` to a counter of this process, e.g. cache hits. Merged across processes like the stages."""
+    if not config.METRICS_ENABLED or not amount:
+        return
+    labels = labels or {}
+    key = metric + json.dumps(labels, sort_keys=True)
+    with _stats_lock:
+        _reset_after_fork()
+        counter = _counter_stats.setdefault(key, {"metric": metric, "description": description, "labels": labels, "value": 0})
+        counter["value"] += amount
+    if _current_trace.get() is None:
+        _schedule_snapshot()
+
+
+def start_request_trace(route):
+    """Start collecting the stages of a request. Returns the token to pass to finish_request_trace."""
+    return _current_trace.set({"route": route, "started_at": time.perf_counter(), "stages": []})
+
+def finish_request_trace(token, method, status):
+    """Count the request, log its stages as one JSON line and publish the counters of this process."""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None or not config.METRICS_ENABLED:
+        return
+    wall_seconds = time.perf_counter() - trace["started_at"]
+    with _stats_lock:
+        _reset_after_fork()
+        _observe(_request_stats.setdefault(f"{trace['route']} {status}", _new_histogram()), wall_seconds)
+
+    if trace["stages"]:
+        logger.info(json.dumps({
+            "event": "request_trace",
+            "method": method,
+            "route": trace["route"],
+            "status": status,
+            "wall_ms": round(wall_seconds * 1000, 1),
+            "stages": trace["stages"],
+        }))
+    write_metrics_snapshot()
+
+
+def _write_snapshot_file(filename, snapshot):
+    """Atomically replace METRICS_DIR/<filename> with `snapshot`, a JSON string."""
+    os.makedirs(config.METRICS_DIR, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=config.METRICS_DIR, suffix=".tmp")
+    with os.fdopen(file_descriptor, "w") as temp_file:
+        temp_file.write(snapshot)
+    os.replace(temp_path, os.path.join(config.METRICS_DIR, filename))
+
+def write_metrics_snapshot():
+    """Atomically publish the counters of this process as METRICS_DIR/<pid>-<random>.json."""
+    with _stats_lock:
+        _reset_after_fork()
+        snapshot = json.dumps({"stages": _stage_stats, "requests": _request_stats, "counters": _counter_stats})
+        filename = _snapshot_filename
+    try:
+        _write_snapshot_file(filename, snapshot)
+    except OSError as e:
+        print(f"Failed to write the metrics snapshot. Error: {e}")
+
+def _schedule_snapshot():
+    """Publish the counters within SNAPSHOT_DELAY seconds, at most one write per delay."""
+    global _snapshot_timer
+    with _stats_lock:
+        if _snapshot_timer is not None and _snapshot_timer.is_alive():
+            return
+        _snapshot_timer = threading.Timer(SNAPSHOT_DELAY, write_metrics_snapshot)
+        _snapshot_timer.daemon = True
+        _snapshot_timer.start()
+
+@contextmanager
+def _snapshots_lock(operation):
+    """Lock METRICS_DIR, shared (fcntl.LOCK_SH) to merge the snapshots, exclusive (fcntl.LOCK_EX) to fold them."""
+    os.makedirs(config.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(config.METRICS_DIR, LOCK_FILENAME), "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_snapshot(filename):
+    try:
+        with open(os.path.join(config.METRICS_DIR, filename)) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable metrics snapshot {filename}. Error: {e}")
+        return None
+
+def _new_snapshot():
+    return {"stages": {}, "requests": {}, "counters": {}}
+
+def _merge_snapshot(merged_snapshot, snapshot):
+    """Add the counters of `snapshot` to those of `merged_snapshot`."""
+    counters = merged_snapshot["counters"]
+    for key, counter in snapshot.get("counters", {}).items():
+        if key in counters:
+            counters[key]["value"] += counter["value"]
+        else:
+            counters[key] = counter
+    for section in ("stages", "requests"):
+        merged = merged_snapshot[section]
+        for key, stats in snapshot.get(section, {}).items():
+            if key not in merged:
+                merged[key] = stats
+                continue
+            for field_name, value in stats.items():
+                if field_name == "buckets":
+                    merged[key]["buckets"] = [a + b for a, b in zip(merged[key]["buckets"], value)]
+                elif field_name == "peak_rss_bytes":
+                    merged[key][field_name] = max(merged[key][field_name], value)
+                else:
+                    merged[key][field_name] += value
+
+def _merge_snapshots():
+    merged_snapshot = _new_snapshot()
+    with _snapshots_lock(fcntl.LOCK_SH):
+        for filename in os.listdir(config.METRICS_DIR):
+            if filename.endswith(".json"):
+                snapshot = _read_snapshot(filename)
+                if snapshot is not None:
+                    _merge_snapshot(merged_snapshot, snapshot)
+    return merged_snapshot["stages"], merged_snapshot["requests"], merged_snapshot["counters"]
+
+def _snapshot_pid(filename):
+    """The pid in the name of a process snapshot (<pid>-<random>.json), None for anything else."""
+    if not filename.endswith(".json"):
+        return None
+    pid = filename[:-len(".json")].split("-")[0]
+    return int(pid) if pid.isdigit() else None
+
+def fold_dead_snapshots():
+    """
+    Add the snapshots of processes that died to METRICS_DIR/retired.json and remove them, so their
+    counters stay in /metrics without a file to read per process that ever ran.
+
+    Returns:
+    int: Snapshots folded.
+    """
+    if not os.path.isdir(config.METRICS_DIR):
+        return 0
+    with _snapshots_lock(fcntl.LOCK_EX):
+        dead_filenames = [filename for filename in os.listdir(config.METRICS_DIR)
+                          if _snapshot_pid(filename) is not None and not process_is_alive(_snapshot_pid(filename))]
+        if not dead_filenames:
+            return 0
+        retired = _new_snapshot()
+        if os.path.exists(os.path.join(config.METRICS_DIR, RETIRED_FILENAME)):
+            retired = _read_snapshot(RETIRED_FILENAME) or retired
+        for filename in dead_filenames:
+            snapshot = _read_snapshot(filename)
+            if snapshot is not None:
+                _merge_snapshot(retired, snapshot)
+        try:
+            _write_snapshot_file(RETIRED_FILENAME, json.dumps(retired))
+        except OSError as e:
+            print(f"Failed to write the retired metrics. Error: {e}")
+            return 0
+        for filename in dead_filenames:
+            os.remove(os.path.join(config.METRICS_DIR, filename))
+    logger.info("Folded the metrics snapshots of %s dead processes into %s", len(dead_filenames), RETIRED_FILENAME)
+    return len(dead_filenames)
+
+def register_gauge_provider(provider):
+    """
+    Add host wide values to /metrics. provider() is called on every scrape and returns a list of
+    (metric name, "gauge" or "counter", description, labels dict, value).
+    """
+    _gauge_providers.append(provider)
+
+def _provided_lines(counters):
+    lines = []
+    described = set()
+    samples = [(counter["metric"], "counter", counter["description"], counter["labels"], counter["value"])
+               for _, counter in sorted(counters.items())]
+    for provider in _gauge_providers:
+        try:
+            samples += provider()
+        except Exception as e:
+            print(f"Failed to collect the metrics of {provider.__name__}. Error: {e}")
+    for metric, kind, description, labels, value in samples:
+        if metric not in described:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+            described.add(metric)
+        label_text = ",".join(f'{name}="{label}"' for name, label in labels.items())
+        lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+    return lines
+
+def _histogram_lines(metric, labels, stats):
+    lines = []
+    cumulative = 0
+    for upper_bound, count in zip(DURATION_BUCKETS + ("+Inf",), stats["buckets"]):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels},le="{upper_bound}"}} {cumulative}')
+    lines.append(f"{metric}_sum{{{labels}}} {stats['wall_seconds']:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {stats['count']}")
+    return lines
+
+def render_metrics():
+    """Counters of every process on this host in the Prometheus text exposition format."""
+    write_metrics_snapshot()
+    stages, requests, counters = _merge_snapshots()
+
+    lines = ["# HELP pyro_stage_duration_seconds Wall time of audio pipeline stages.",
+             "# TYPE pyro_stage_duration_seconds histogram"]
+    for name in sorted(stages):
+        lines += _histogram_lines("pyro_stage_duration_seconds", f'stage="{name}"', stages[name])
+    for metric, field_name, kind, description in (
+        ("pyro_stage_cpu_seconds_total", "cpu_seconds", "counter", "CPU time of audio pipeline stages."),
+        ("pyro_stage_bytes_total", "bytes", "counter", "Bytes produced or moved by audio pipeline stages."),
+        ("pyro_stage_peak_rss_bytes", "peak_rss_bytes", "gauge", "Highest peak RSS of a process running the stage."),
+    ):
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{stage="{name}"}} {stages[name][field_name]}' for name in sorted(stages)]
+
+    lines += ["# HELP pyro_request_duration_seconds Wall time of requests.",
+              "# TYPE pyro_request_duration_seconds histogram"]
+    for key in sorted(requests):
+        route, status = key.rsplit(" ", 1)
+        lines += _histogram_lines("pyro_request_duration_seconds", f'route="{route}",status="{status}"', requests[key])
+    lines += _provided_lines(counters)
+    return "\n".join(lines) + "\n"
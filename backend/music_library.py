@@ -0,0 +1,278 @@
+# Relative path: music_library.py
+"""
+Incremental sync of the background music and preview libraries from their HTTP origin.
+
+Every library directory keeps a manifest (.manifest.json) of the size and ETag each local file was
+downloaded with. A sync HEADs every remote file in parallel, diffs the answers against the manifest
+and the files on disk, and downloads only what is missing or changed:
+  - over one pooled keep-alive session,
+  - streamed to <file>.part and atomically renamed into place once complete,
+  - resuming an interrupted .part with a ranged GET (guarded by If-Range so a changed file restarts),
+  - under a per-file lock, so concurrent requests and workers never fetch the same file twice.
+A sync also records the filenames it was given (.listed.json, the Firestore list). A request may
+only name a file of the manifest or of that list (requested_library_file), so a request can
+neither write outside the library directory nor make the server fetch an arbitrary name.
+"""
+import os
+import json
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+
+config = Config()
+
+MANIFEST_FILENAME = ".manifest.json"
+LISTED_FILENAME = ".listed.json"
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Session shared by all library downloads of this process, with a keep-alive pool per host."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=config.MUSIC_SYNC_CONCURRENCY,
+                max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                                  allowed_methods=["HEAD", "GET"]),
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def library_file_url(base_url, filename):
+    return base_url + filename.replace(' ', '%20')
+
+
+@contextmanager
+def _file_lock(path):
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_manifest(directory):
+    """{filename: {"size": int, "etag": str}} of the files downloaded into a library directory."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"Ignoring the unreadable manifest of {directory}. Error: {e}")
+        return {}
+
+
+class UnknownLibraryFile(ValueError):
+    """A request named a file that is not part of the library."""
+
+
+def _write_json(directory, filename, value):
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(file_descriptor, "w") as temp_file:
+        json.dump(value, temp_file, indent=1, sort_keys=True)
+    os.replace(temp_path, os.path.join(directory, filename))
+
+
+def _record_in_manifest(directory, filename, entry):
+    with _file_lock(os.path.join(directory, ".manifest.lock")):
+        manifest = read_manifest(directory)
+        manifest[filename] = entry
+        _write_json(directory, MANIFEST_FILENAME, manifest)
+
+
+def read_listed_filenames(directory):
+    """Filenames the last sync of a library directory was given, an empty list before the first sync."""
+    try:
+        with open(os.path.join(directory, LISTED_FILENAME)) as listed_file:
+            return json.load(listed_file)
+    except FileNotFoundError:
+        return []
+    except ValueError as e:
+        print(f"Ignoring the unreadable file list of {directory}. Error: {e}")
+        return []
+
+
+def is_library_filename(directory, filename):
+    """Whether `filename` is a plain file name in the manifest of a library directory or in its listed files."""
+    if not isinstance(filename, str) or not filename or filename.startswith(".") or os.path.basename(filename) != filename:
+        return False
+    return filename in read_manifest(directory) or filename in read_listed_filenames(directory)
+
+
+def fetch_remote_entry(base_url, filename):
+    """HEAD a library file. Returns {"size", "etag"} (either may be None), or None if it is not available."""
+    try:
+        response = get_http_session().head(library_file_url(base_url, filename), allow_redirects=True,
+                                           timeout=config.MUSIC_SYNC_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Failed to check {filename}. Error: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to check {filename}, status {response.status_code}")
+        return None
+    size = response.headers.get("Content-Length")
+    return {"size": int(size) if size is not None else None, "etag": response.headers.get("ETag")}
+
+
+def is_up_to_date(directory, filename, remote_entry, manifest):
+    """Whether the local copy matches the remote file. Unknown remote state keeps any local copy."""
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        return False
+    if remote_entry is None:
+        return True
+    if remote_entry["size"] is not None and os.path.getsize(path) != remote_entry["size"]:
+        return False
+    local_etag = manifest.get(filename, {}).get("etag")
+    # Files downloaded before the manifest existed are adopted when their size matches
+    return local_etag is None or remote_entry["etag"] is None or local_etag == remote_entry["etag"]
+
+
+def download_library_file(base_url, directory, filename, remote_entry=None):
+    """
+    Download one library file unless another worker already brought it up to date.
+
+    Returns:
+    str: Path of the downloaded file.
+
+    Raises:
+    requests.RequestException or OSError if the download fails. The partial file is kept for the next attempt.
+    """
+    path = os.path.join(directory, filename)
+    with _file_lock(os.path.join(directory, f".{filename}.lock")):
+        if is_up_to_date(directory, filename, remote_entry, read_manifest(directory)):
+            return path
+        size, etag = _download_to_part_file(base_url, path, remote_entry)
+
+        expected_size = (remote_entry or {}).get("size")
+        if expected_size is not None and size != expected_size:
+            os.remove(path + ".part")
+            raise OSError(f"Downloaded {size} bytes of {filename}, expected {expected_size}")
+        os.replace(path + ".part", path)
+        _record_in_manifest(directory, filename, {"size": size, "etag": etag})
+    print(f"Downloaded {filename}")
+    return path
+
+
+def _download_to_part_file(base_url, path, remote_entry):
+    """Stream a library file into <path>.part, resuming what an earlier attempt left there. Returns (size, etag)."""
+    filename = os.path.basename(path)
+    with open(path + ".part", "ab") as part_file:
+        offset = part_file.tell()
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if (remote_entry or {}).get("etag"):
+                headers["If-Range"] = remote_entry["etag"]
+
+        response = get_http_session().get(library_file_url(base_url, filename), headers=headers, stream=True,
+                                          timeout=config.MUSIC_SYNC_TIMEOUT)
+        if response.status_code == 416:
+            # The partial file is no prefix of the remote one, start over
+            response.close()
+            part_file.truncate(0)
+            part_file.seek(0)
+            response = get_http_session().get(library_file_url(base_url, filename), stream=True,
+                                              timeout=config.MUSIC_SYNC_TIMEOUT)
+        with response:
+            response.raise_for_status()
+            if response.status_code == 200 and part_file.tell():
+                part_file.truncate(0)  # The origin ignored the range or the file changed, start over
+                part_file.seek(0)
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                part_file.write(chunk)
+            etag = response.headers.get("ETag") or (remote_entry or {}).get("etag")
+        part_file.flush()
+        os.fsync(part_file.fileno())
+        return part_file.tell(), etag
+
+
+def requested_library_file(base_url, directory, filename):
+    """
+    Path of the library file a request named, fetched if it is missing.
+
+    Raises:
+    UnknownLibraryFile: When `filename` is not a plain file name known to the library.
+    """
+    if not is_library_filename(directory, filename):
+        raise UnknownLibraryFile(f"Unknown music file {filename!r}")
+    return ensure_library_file(base_url, os.path.join(directory, filename))
+
+
+def ensure_library_file(base_url, file_path):
+    """Fetch a single library file if it is missing, e.g. one track a request needs right now."""
+    if os.path.exists(file_path):
+        return file_path
+    directory, filename = os.path.split(file_path)
+    os.makedirs(directory or ".", exist_ok=True)
+    return download_library_file(base_url, directory or ".", filename, fetch_remote_entry(base_url, filename))
+
+
+def sync_library(base_url, directory, filenames, on_file_ready=None, max_workers=None):
+    """
+    Bring a library directory up to date with the remote files.
+
+    Parameters:
+    base_url (str): URL prefix of the library files.
+    directory (str): Local library directory.
+    filenames (list): Files the library should contain.
+    on_file_ready (callable, optional): Called with the path of every file present after the sync.
+    max_workers (int, optional): Parallel HEADs and downloads. Defaults to config.MUSIC_SYNC_CONCURRENCY.
+
+    Returns:
+    dict: Filenames that were "downloaded", "unchanged" or "failed".
+    """
+    os.makedirs(directory, exist_ok=True)
+    max_workers = max_workers or config.MUSIC_SYNC_CONCURRENCY
+    filenames = list(dict.fromkeys(filenames))
+    with _file_lock(os.path.join(directory, ".manifest.lock")):
+        _write_json(directory, LISTED_FILENAME, filenames)
+    manifest = read_manifest(directory)
+    summary = {"downloaded": [], "unchanged": [], "failed": []}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        remote_entries = dict(zip(filenames, pool.map(lambda filename: fetch_remote_entry(base_url, filename), filenames)))
+        changed = []
+        for filename in filenames:
+            if is_up_to_date(directory, filename, remote_entries[filename], manifest):
+                summary["unchanged"].append(filename)
+            elif remote_entries[filename] is None:
+                summary["failed"].append(filename)
+            else:
+                changed.append(filename)
+
+        futures = {filename: pool.submit(download_library_file, base_url, directory, filename, remote_entries[filename])
+                   for filename in changed}
+        for filename, future in futures.items():
+            try:
+                future.result()
+                summary["downloaded"].append(filename)
+            except Exception as e:
+                print(f"Failed to download {filename}. Error: {e}")
+                summary["failed"].append(filename)
+
+    if on_file_ready is not None:
+        for filename in summary["downloaded"] + summary["unchanged"]:
+            on_file_ready(os.path.join(directory, filename))
+    print(f"Synced {directory}: {len(summary['downloaded'])} downloaded, "
+          f"{len(summary['unchanged'])} unchanged, {len(summary['failed'])} failed")
+    return summary
@@ -0,0 +1,18 @@
+# Relative path: processes.py
+"""
+Helpers about the processes of the host, shared by the modules that keep per-process state in
+files (admission ledger, scratch workspaces, metrics snapshots). Kept free of Flask and of the
+other modules, so the janitor can import it without loading the app.
+"""
+import os
+
+
+def process_is_alive(pid):
+    """Whether a process with this pid exists. One of another user counts as alive."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
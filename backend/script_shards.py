@@ -0,0 +1,75 @@
+# Relative path: script_shards.py
+"""
+Split a script into shards that are synthesized separately and stitched back together.
+
+Shards only end where the script pauses anyway: at an SSML <break> tag, at the end of a paragraph
+or at the end of a sentence, never within a sentence. Sentences are packed greedily into shards of
+at most max_chars characters, a longer sentence makes a shard of its own. Each shard carries the
+pause that belongs after it: the time of the break tag it ends at (the tag itself is left out of
+both shards), else the paragraph or sentence pause. Breaks, paragraphs and sentences within a
+shard are kept as written.
+"""
+import re
+
+from data_classes import ScriptShard
+
+BOUNDARY = re.compile(
+    r'\s*<break\s+time="(?P<time>\d+(?:\.\d+)?)(?P<unit>ms|s)"\s*/>\s*'
+    r'|(?P<paragraph>\s*\n\s*\n\s*)'
+    r'|(?:(?<=[.!?…])|(?<=[.!?…]["”’)\]]))\s+'
+)
+
+
+def _pause_ms(boundary, sentence_pause_ms, paragraph_pause_ms):
+    if boundary.group("time"):
+        return round(float(boundary.group("time")) * (1000 if boundary.group("unit") == "s" else 1))
+    if boundary.group("paragraph"):
+        return paragraph_pause_ms
+    return sentence_pause_ms
+
+def _sentences(script, sentence_pause_ms, paragraph_pause_ms):
+    """[text, boundary after it as written, pause after it in milliseconds] of every sentence."""
+    sentences = []
+    leading_text = ""
+    position = 0
+    for boundary in BOUNDARY.finditer(script):
+        text = script[position:boundary.start()]
+        pause_ms = _pause_ms(boundary, sentence_pause_ms, paragraph_pause_ms)
+        position = boundary.end()
+        if text.strip():
+            sentences.append([leading_text + text, boundary.group(0), pause_ms])
+            leading_text = ""
+        elif sentences:
+            # Two boundaries in a row, e.g. a break tag after a paragraph: their pauses add up
+            sentences[-1][1] += text + boundary.group(0)
+            sentences[-1][2] += pause_ms
+        else:
+            leading_text += text + boundary.group(0)  # A break the script starts with stays in front of it
+    if script[position:].strip() or leading_text:
+        sentences.append([leading_text + script[position:], "", 0])
+    return sentences
+
+def split_script(script, max_chars, sentence_pause_ms=0, paragraph_pause_ms=0):
+    """
+    Split a script at its pauses into shards of at most max_chars characters.
+
+    Parameters:
+    script (str): Text to synthesize, with optional SSML <break time="0.8s" /> tags.
+    max_chars (int): Longest shard, unless a single sentence is longer.
+    sentence_pause_ms (int): Pause after a shard that ends with a sentence.
+    paragraph_pause_ms (int): Pause after a shard that ends with a paragraph.
+
+    Returns:
+    list: ScriptShard of the script in order, a single one when it fits max_chars.
+    """
+    shards = []
+    text, separator, pause_ms = "", "", 0
+    for sentence, boundary, boundary_pause_ms in _sentences(script, sentence_pause_ms, paragraph_pause_ms):
+        if text and len(text) + len(separator) + len(sentence) > max_chars:
+            shards.append(ScriptShard(text=text, pause_after_ms=pause_ms))
+            text = ""
+        text = text + separator + sentence if text else sentence
+        separator, pause_ms = boundary, boundary_pause_ms
+    if text:
+        shards.append(ScriptShard(text=text, pause_after_ms=0))
+    return shards
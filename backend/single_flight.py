@@ -0,0 +1,206 @@
+# Relative path: single_flight.py
+"""
+Request coalescing ("single flight"): identical work that is already running is joined, not repeated.
+
+Work is identified by a namespace and the SHA-256 of its canonical JSON payload. The first caller
+(the leader) runs it, callers arriving while it runs (followers) wait for it and share its result:
+  - within a process, followers wait on the leader's thread or task and share its result or error,
+    for at most SINGLE_FLIGHT_LOCK_TIMEOUT seconds before they run the work themselves,
+  - across processes, the leader holds a lock of the SINGLE_FLIGHT_BACKEND and publishes its result
+    in the value cache, where the followers polling the lock pick it up once it is released.
+    A follower that finds no result newer than its own arrival (the leader failed) runs the work
+    itself, and so does a follower still waiting after SINGLE_FLIGHT_LOCK_TIMEOUT seconds (the
+    leader hung). Async followers poll from the event loop, not from a blocked executor thread.
+Results must be JSON serializable.
+"""
+import os
+import json
+import time
+import fcntl
+import asyncio
+import hashlib
+import threading
+
+from config import Config
+from audio_cache import get_cached_value, put_cached_value
+
+config = Config()
+
+RESULT_NAMESPACE = "single_flight"
+POLL_INTERVAL = 0.05  # seconds between two attempts of a follower to take the lock
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_in_flight_async = {}
+
+
+def single_flight_key(namespace, payload):
+    """Key of a unit of work, identical for payloads that only differ in the order of their keys."""
+    canonical_payload = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{namespace}-{hashlib.sha256(canonical_payload.encode()).hexdigest()}"
+
+
+def _try_file_lock(key):
+    """Take <SINGLE_FLIGHT_LOCK_DIR>/<key>.lock if it is free. Returns the handle, or None."""
+    os.makedirs(config.SINGLE_FLIGHT_LOCK_DIR, exist_ok=True)
+    path = os.path.join(config.SINGLE_FLIGHT_LOCK_DIR, f"{key}.lock")
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    try:
+        # Leaders delete the file before unlocking it, so only a lock on the file still in place counts
+        if os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino:
+            return path, lock_file
+    except FileNotFoundError:
+        pass
+    lock_file.close()
+    return None
+
+def _release_file_lock(handle):
+    path, lock_file = handle
+    try:
+        os.remove(path)
+    finally:
+        lock_file.close()
+
+# name: (try_acquire(key) -> handle or None when taken, release(handle)). Add an entry to plug in
+# e.g. a lock shared between hosts.
+SINGLE_FLIGHT_BACKENDS = {
+    "file": (_try_file_lock, _release_file_lock),
+    "local": (lambda key: True, lambda handle: None),  # Coalesce within each process only
+}
+
+def _stop_waiting(key):
+    print(f"Waited {config.SINGLE_FLIGHT_LOCK_TIMEOUT} s for the leader of {key}, running the work without it")
+
+def _lock_timed_out(key, arrived_at):
+    if time.time() - arrived_at < config.SINGLE_FLIGHT_LOCK_TIMEOUT:
+        return False
+    _stop_waiting(key)
+    return True
+
+def _acquire(key, arrived_at):
+    """Poll the lock of `key` until it is taken. Returns its handle, or None once SINGLE_FLIGHT_LOCK_TIMEOUT passed."""
+    try_acquire, _ = SINGLE_FLIGHT_BACKENDS[config.SINGLE_FLIGHT_BACKEND]
+    while True:
+        handle = try_acquire(key)
+        if handle is not None or _lock_timed_out(key, arrived_at):
+            return handle
+        time.sleep(POLL_INTERVAL)
+
+async def _acquire_async(key, arrived_at):
+    try_acquire, _ = SINGLE_FLIGHT_BACKENDS[config.SINGLE_FLIGHT_BACKEND]
+    loop = asyncio.get_running_loop()
+    while True:
+        handle = await loop.run_in_executor(None, try_acquire, key)
+        if handle is not None or _lock_timed_out(key, arrived_at):
+            return handle
+        await asyncio.sleep(POLL_INTERVAL)
+
+def _release(handle):
+    if handle is not None:
+        SINGLE_FLIGHT_BACKENDS[config.SINGLE_FLIGHT_BACKEND][1](handle)
+
+
+def _shared_result(key, arrived_at):
+    """The entry another process published for `key` after `arrived_at`, or None."""
+    entry = get_cached_value(RESULT_NAMESPACE, key)
+    if entry is not None and entry["finished_at"] >= arrived_at:
+        return entry
+    return None
+
+def _share_result(key, result):
+    # Followers read the result right after the leader releases the lock, older results are only
+    # kept up to SINGLE_FLIGHT_RESULT_MAX_ENTRIES so the namespace does not grow with every request
+    put_cached_value(RESULT_NAMESPACE, key, {"result": result, "finished_at": time.time()},
+                     ttl=config.SINGLE_FLIGHT_RESULT_TTL, max_entries=config.SINGLE_FLIGHT_RESULT_MAX_ENTRIES)
+
+def _run_as_leader(key, function):
+    arrived_at = time.time()
+    handle = _acquire(key, arrived_at)
+    try:
+        entry = _shared_result(key, arrived_at)
+        if entry is not None:
+            return entry["result"]
+        result = function()
+        _share_result(key, result)
+        return result
+    finally:
+        _release(handle)
+
+async def _run_as_leader_async(key, coroutine_function):
+    loop = asyncio.get_running_loop()
+    arrived_at = time.time()
+    handle = await _acquire_async(key, arrived_at)
+    try:
+        entry = await loop.run_in_executor(None, _shared_result, key, arrived_at)
+        if entry is not None:
+            return entry["result"]
+        result = await coroutine_function()
+        await loop.run_in_executor(None, _share_result, key, result)
+        return result
+    finally:
+        _release(handle)
+
+
+def single_flight(namespace, payload, function):
+    """
+    Run function(), unless identical work is in flight, in which case wait for it and return its result.
+
+    Parameters:
+    namespace (str): Kind of work, e.g. "produce_spot".
+    payload: JSON serializable description of the work, e.g. the request body.
+    function (callable): Computes the result, called without arguments.
+
+    Returns:
+    The result of function(), computed by this call or by the leader it joined.
+    """
+    key = single_flight_key(namespace, payload)
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _in_flight[key] = {"done": threading.Event(), "result": None, "error": None}
+
+    if not is_leader:
+        if not call["done"].wait(config.SINGLE_FLIGHT_LOCK_TIMEOUT):
+            _stop_waiting(key)
+            return function()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    try:
+        call["result"] = _run_as_leader(key, function)
+        return call["result"]
+    except BaseException as e:
+        call["error"] = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call["done"].set()
+
+async def single_flight_async(namespace, payload, coroutine_function):
+    """
+    Async counterpart of single_flight, coroutine_function() returns the awaitable computing the result.
+    The work runs as its own task, so a caller that disconnects does not cancel it for the others.
+    """
+    key = single_flight_key(namespace, payload)
+    leader = _in_flight_async.get(key)
+    if leader is None:
+        leader = asyncio.ensure_future(_run_as_leader_async(key, coroutine_function))
+        _in_flight_async[key] = leader
+        leader.add_done_callback(lambda _: _in_flight_async.pop(key, None))
+        return await asyncio.shield(leader)  # Only followers give up on a hung leader
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(leader), config.SINGLE_FLIGHT_LOCK_TIMEOUT)
+    except asyncio.TimeoutError:
+        if leader.done():
+            raise  # The work itself timed out
+        _stop_waiting(key)
+        return await coroutine_function()
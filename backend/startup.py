@@ -0,0 +1,159 @@
+# Relative path: startup.py
+"""
+Worker startup: the warm-up behind the readiness probe, and the scheduled jobs of the host.
+
+The ElevenLabs, Firebase and boto3 SDKs are imported and their clients created on first use, and
+every per-process resource (S3 and ElevenLabs clients, section process pool, metrics counters) is
+rebuilt after a fork. The app can therefore be imported once in the gunicorn master with
+GUNICORN_PRELOAD and shared copy-on-write by the workers. Importing it starts no thread, the
+gunicorn hooks (gunicorn.conf.py) call:
+  - warm_up(): imports the SDKs, runs ffmpeg once each way and builds the missing sidecars and
+    loudness indexes of the music library. /ready answers 503 until it has finished.
+  - start_scheduler(): runs the scheduled jobs in a single process per host. Every worker tries to
+    take an exclusive lock on SCHEDULER_LOCK_PATH. The holder runs the jobs, the others try again
+    every SCHEDULER_LEADER_RETRY seconds, so one of them takes over when the leader dies and the
+    kernel releases its lock.
+"""
+import os
+import time
+import fcntl
+import logging
+import importlib
+import threading
+
+from config import Config
+
+config = Config()
+logger = logging.getLogger(__name__)
+
+# Modules imported lazily by the request handlers
+WARM_UP_IMPORTS = ("elevenlabs.client", "elevenlabs.types", "firebase_admin.firestore", "firebase_admin.credentials",
+                   "boto3", "boto3.s3.transfer", "botocore.config")
+
+_ready = False
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock_file = None
+_leader_retry_timer = None
+_scheduler_state_lock = threading.Lock()
+
+
+def _import_sdks():
+    for module_name in WARM_UP_IMPORTS:
+        importlib.import_module(module_name)
+
+def _warm_up_codecs():
+    from utils import silent_pcm, decode_audio_stream_to_pcm
+    from audio_stream import pcm_blocks, stream_encode_pcm
+    silence = silent_pcm(100)
+    encoded = b"".join(stream_encode_pcm(pcm_blocks(silence), silence.sample_rate, silence.channels))
+    decode_audio_stream_to_pcm([encoded], format="mp3")
+
+def _prime_music_library():
+    from utils import _write_sidecar, _prepare_preview
+    from music_library import read_manifest
+    for directory, prepare in ((config.MUSIC_LIBRARY_DIR, _write_sidecar), (config.MUSIC_PREVIEW_DIR, _prepare_preview)):
+        for filename in sorted(read_manifest(directory)):
+            if os.path.exists(os.path.join(directory, filename)):
+                prepare(os.path.join(directory, filename))
+
+WARM_UP_STEPS = (("imports", _import_sdks), ("codecs", _warm_up_codecs), ("music_library", _prime_music_library))
+
+
+def warm_up():
+    """
+    Prepare this process for its first requests, then mark it ready. A failing step is logged and
+    skipped: the work it would have done happens on first use instead.
+    """
+    global _ready
+    if not config.WARM_UP_ENABLED:
+        _ready = True
+        return
+    start = time.perf_counter()
+    for name, step in WARM_UP_STEPS:
+        step_start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up step {name} failed. Error: {e}")
+        logger.info("Warm-up step %s took %.0f ms", name, (time.perf_counter() - step_start) * 1000)
+    _ready = True
+    logger.info("Process %s warmed up in %.0f ms", os.getpid(), (time.perf_counter() - start) * 1000)
+
+def start_warm_up():
+    """Run warm_up on a background thread, once per process."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _ready or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        _warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        _warm_up_thread.start()
+
+def is_ready():
+    return _ready
+
+
+def _add_scheduled_jobs(scheduler):
+    from workspace import collect_scratch_garbage
+    from metrics import fold_dead_snapshots
+    scheduler.add_job(collect_scratch_garbage, 'interval', seconds=config.SCRATCH_JANITOR_INTERVAL)
+    scheduler.add_job(fold_dead_snapshots, 'interval', seconds=config.METRICS_JANITOR_INTERVAL)
+
+def _try_to_lead():
+    global _scheduler, _scheduler_lock_file, _leader_retry_timer
+    with _scheduler_state_lock:
+        if _scheduler_pid != os.getpid():
+            return False  # Stopped, or a timer inherited through a fork
+        os.makedirs(os.path.dirname(config.SCHEDULER_LOCK_PATH) or ".", exist_ok=True)
+        lock_file = open(config.SCHEDULER_LOCK_PATH, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            _leader_retry_timer = threading.Timer(config.SCHEDULER_LEADER_RETRY, _try_to_lead)
+            _leader_retry_timer.daemon = True
+            _leader_retry_timer.start()
+            return False
+
+        # The lock is held for as long as the file stays open, i.e. until this process exits
+        _scheduler_lock_file = lock_file
+        from apscheduler.schedulers.background import BackgroundScheduler
+        scheduler = BackgroundScheduler()
+        _add_scheduled_jobs(scheduler)
+        scheduler.start()
+        _scheduler = scheduler
+    logger.info("Process %s runs the scheduled jobs of this host", os.getpid())
+    return True
+
+def start_scheduler():
+    """Run the scheduled jobs in this process if no other process on the host does, or wait to take over."""
+    global _scheduler_pid, _scheduler
+    with _scheduler_state_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        # A scheduler copied through a fork has no thread left, only the process that started it runs it
+        _scheduler_pid = os.getpid()
+        _scheduler = None
+    _try_to_lead()
+
+def is_scheduler_leader():
+    return _scheduler is not None and _scheduler_pid == os.getpid()
+
+def stop_scheduler():
+    """Stop the scheduled jobs of this process and hand the lock over to the next worker."""
+    global _scheduler, _scheduler_pid, _scheduler_lock_file
+    with _scheduler_state_lock:
+        if _scheduler_pid != os.getpid():
+            return
+        _scheduler_pid = None
+        if _leader_retry_timer is not None:
+            _leader_retry_timer.cancel()
+        if _scheduler is not None:
+            _scheduler.shutdown(wait=False)
+            _scheduler = None
+        if _scheduler_lock_file is not None:
+            _scheduler_lock_file.close()
+            _scheduler_lock_file = None
@@ -0,0 +1,167 @@
+import time
+import threading
+import pytest
+from unittest.mock import patch
+from flask import Flask, Response
+import admission
+from admission import request_admission, poll_admission, release_admission, wait_for_admission, admission_controlled
+from admission import estimate_request_bytes
+from metrics import render_metrics
+
+
+@pytest.fixture(autouse=True)
+def admission_config(tmp_path):
+    with patch.object(admission.config, "ADMISSION_DIR", str(tmp_path / "admission")), \
+            patch.object(admission.config, "ADMISSION_ENABLED", True), \
+            patch.object(admission.config, "ADMISSION_MAX_CONCURRENT", 2), \
+            patch.object(admission.config, "ADMISSION_MAX_PER_USER", 2), \
+            patch.object(admission.config, "ADMISSION_MEMORY_BUDGET_MB", 1024), \
+            patch.object(admission.config, "ADMISSION_QUEUE_LIMIT", 2), \
+            patch.object(admission.config, "ADMISSION_QUEUE_TIMEOUT", 1), \
+            patch.object(admission.config, "ADMISSION_RETRY_AFTER", 7):
+        yield
+
+def _spot(user_id, sections=1):
+    return {"user_id": user_id, "history_item_id_list": ["section"] * sections}
+
+def test_memory_estimate_grows_with_sections_and_audio_length():
+    assert estimate_request_bytes("/produce-spot", _spot("a", 8)) > estimate_request_bytes("/produce-spot", _spot("a", 1))
+    assert estimate_request_bytes("/generate-mix", {"ad_length": 60}) > estimate_request_bytes("/generate-mix", {"ad_length": 15})
+    assert estimate_request_bytes("/render-variants", {"variants": [{"ad_length": 30}] * 4}) > \
+        estimate_request_bytes("/render-variants", {"variants": [{"ad_length": 30}]})
+    assert estimate_request_bytes("/preprocess-voiceover", {"script": "word " * 200}) > \
+        estimate_request_bytes("/preprocess-voiceover", {"script": "Hi"})
+
+def test_malformed_bodies_are_admitted_with_the_base_estimate_for_the_view_to_reject():
+    base_bytes = admission.config.ADMISSION_BASE_MB * 2**20
+    assert estimate_request_bytes("/generate-mix", {"ad_length": "abc"}) == base_bytes
+    assert estimate_request_bytes("/render-variants", {"variants": ["abc"]}) == base_bytes
+    assert estimate_request_bytes("/produce-spot", [1, 2]) == base_bytes
+
+    ticket, rejection = request_admission("/generate-mix", [1, 2])
+    assert rejection is None and ticket["admitted"]
+    release_admission(ticket)
+
+def test_requests_beyond_the_concurrency_limit_queue_in_order():
+    first, _ = request_admission("/produce-spot", _spot("a"))
+    second, _ = request_admission("/produce-spot", _spot("b"))
+    third, _ = request_admission("/produce-spot", _spot("c"))
+    fourth, _ = request_admission("/produce-spot", _spot("d"))
+
+    assert first["admitted"] and second["admitted"]
+    assert not third["admitted"] and not fourth["admitted"]
+    assert not poll_admission(fourth)  # Behind the third
+
+    release_admission(first)
+    assert not poll_admission(fourth)
+    assert poll_admission(third)
+
+def test_saturated_requests_are_rejected_with_retry_after():
+    for user_id in ("a", "b", "c", "d"):
+        request_admission("/produce-spot", _spot(user_id))
+
+    ticket, rejection = request_admission("/produce-spot", _spot("e"))
+
+    assert ticket is None
+    assert rejection == {"status": 503, "error": "The server is busy, retry later", "retry_after": 7}
+
+def test_users_over_their_limit_are_rejected_with_429():
+    request_admission("/produce-spot", _spot("a"))
+    request_admission("/produce-spot", _spot("a"))
+
+    ticket, rejection = request_admission("/produce-spot", _spot("a"))
+
+    assert ticket is None and rejection["status"] == 429
+    assert request_admission("/produce-spot", _spot("b"))[0] is not None
+
+def test_memory_budget_limits_admission_but_a_lone_large_request_runs():
+    with patch.object(admission.config, "ADMISSION_MEMORY_BUDGET_MB", 100):
+        large, _ = request_admission("/produce-spot", _spot("a", sections=20))
+        small, _ = request_admission("/produce-spot", _spot("b", sections=1))
+
+    assert large["admitted"]
+    assert not small["admitted"]
+
+def test_queued_requests_time_out():
+    request_admission("/produce-spot", _spot("a"))
+    request_admission("/produce-spot", _spot("b"))
+    queued, _ = request_admission("/produce-spot", _spot("c"))
+
+    start = time.monotonic()
+    rejection = wait_for_admission(queued)
+
+    assert rejection["status"] == 503
+    assert 0.5 < time.monotonic() - start < 3
+    assert 'pyro_admission_rejections_total{reason="queue_timeout"} 1' in render_metrics()
+
+def test_entries_of_dead_processes_are_dropped():
+    ticket, _ = request_admission("/produce-spot", _spot("a"))
+    request_admission("/produce-spot", _spot("b"))
+    with patch("admission.process_is_alive", side_effect=lambda pid: False):
+        replacement, _ = request_admission("/produce-spot", _spot("c"))
+
+    assert replacement["admitted"]
+
+def test_decorator_admits_releases_and_rejects():
+    app = Flask(__name__)
+    release = threading.Event()
+
+    @app.route('/produce-spot', methods=['POST'])
+    @admission_controlled
+    def produce_spot():
+        release.wait(timeout=5)
+        return {"pyro_history_item_id": "pyro_1"}
+
+    @app.route('/generate-mix', methods=['POST'])
+    @admission_controlled
+    def generate_mix():
+        return Response(iter([b"a", b"b"]))
+
+    client = app.test_client()
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(client.post('/produce-spot', json=_spot("a"))))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3)
+    rejected = client.post('/produce-spot', json=_spot("a"))
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "7"
+    assert [response.status_code for response in responses] == [200, 200]
+
+    streamed = client.post('/generate-mix', json={"user_id": "a", "ad_length": 15})
+    assert streamed.get_data() == b"ab"
+    streamed.close()
+    assert 'pyro_admission_running 0' in render_metrics()
+    assert 'pyro_admission_queue_depth 0' in render_metrics()
+
+def test_only_the_leader_of_coalesced_requests_takes_a_slot(tmp_path):
+    import audio_cache
+    import single_flight
+    from admission import run_admitted
+    running = []
+
+    def produce_spot():
+        running.append(render_metrics())
+        time.sleep(0.3)
+        return "pyro_1"
+
+    results = []
+    coalesced = lambda: results.append(single_flight.single_flight(
+        "produce_spot", _spot("a"), lambda: run_admitted("/produce-spot", _spot("a"), produce_spot)))
+    with patch.object(single_flight.config, "SINGLE_FLIGHT_LOCK_DIR", str(tmp_path / "locks")), \
+            patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path / "cache")), \
+            patch.object(admission.config, "ADMISSION_MAX_CONCURRENT", 1), \
+            patch.object(admission.config, "ADMISSION_QUEUE_LIMIT", 0):
+        threads = [threading.Thread(target=coalesced) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == ["pyro_1"] * 4
+    assert len(running) == 1 and 'pyro_admission_running 1' in running[0]
@@ -0,0 +1,185 @@
+import asyncio
+import time
+import shutil
+import importlib
+from types import SimpleNamespace
+import numpy as np
+import httpx
+import pytest
+from unittest.mock import patch
+import asgi_api
+import audio_cache
+from data_classes import PCMAudio
+from pydub import AudioSegment
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which(AudioSegment.converter) is None, reason="ffmpeg is not installed")
+
+
+def _request(method, path, **kwargs):
+    async def send():
+        transport = httpx.ASGITransport(app=asgi_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(send())
+
+def _voiceover(frames=4410, value=0):
+    return PCMAudio(samples=np.full((frames, 1), value, dtype=np.int16), sample_rate=44100)
+
+def _slow_async_elevenlabs(latency):
+    """Stands in for AsyncElevenLabs, taking `latency` seconds to synthesize."""
+    async def generate(**kwargs):
+        await asyncio.sleep(latency)
+
+        async def chunks():
+            yield b"mp3"
+        return chunks()
+    return SimpleNamespace(generate=generate)
+
+@pytest.fixture
+def async_upstream(tmp_path):
+    audio_cache.clear_memory_cache()
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path)), \
+            patch.object(asgi_api.config, "SECTION_PROCESS_WORKERS", 0), \
+            patch("utils.config.SECTION_PROCESS_WORKERS", 0), \
+            patch("admission.config.ADMISSION_ENABLED", False), \
+            patch("asgi_api._elevenlabs_async_client", _slow_async_elevenlabs(0.3)), \
+            patch("asgi_api.decode_audio_stream_to_pcm", side_effect=lambda chunks, format: (list(chunks), _voiceover())[1]), \
+            patch("asgi_api.upload_audio_segment_to_s3", return_value=True) as upload, \
+            patch("asgi_api.new_pyro_object", side_effect=lambda *_: ("pyro_" + str(time.monotonic_ns()), "bucket", "key")):
+        yield upload
+
+def test_routes_without_an_async_variant_are_served_by_flask():
+    response = _request("GET", "/")
+
+    assert response.status_code == 200
+    assert "Machiavelli" in response.text
+
+def test_async_routes_answer_malformed_bodies_with_a_json_error(tmp_path):
+    with patch("admission.config.ADMISSION_ENABLED", True), \
+            patch("admission.config.ADMISSION_DIR", str(tmp_path)):
+        response = _request("POST", "/produce-spot", json=[1, 2])
+
+    assert response.status_code == 500
+    assert "error" in response.json()
+
+def test_async_preprocess_voiceover_overlaps_upstream_waits(async_upstream):
+    async def send_many():
+        transport = httpx.ASGITransport(app=asgi_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.post("/preprocess-voiceover", json={"script": f"Take {index}", "voice": "voice-1", "user_id": "user"})
+                for index in range(20)
+            ])
+
+    start = time.monotonic()
+    responses = asyncio.run(send_many())
+    elapsed = time.monotonic() - start
+
+    assert [response.status_code for response in responses] == [200] * 20
+    assert len({response.json()["pyro_history_item_id"] for response in responses}) == 20
+    assert elapsed < 20 * 0.3 / 4
+    assert async_upstream.call_count == 20
+
+def test_async_stitch_sections_keeps_the_sync_error_shape(async_upstream):
+    with patch("asgi_api.fetch_voiceover_async", return_value=None):
+        response = _request("POST", "/stitch-sections", json={
+            "user_id": "user", "history_item_id_list": ["abc"], "end_of_section_pause_duration_list": [0.5],
+        })
+
+    assert response.status_code == 500
+    assert response.json() == {"error": "Failed to fetch the voiceover for section abc"}
+
+def test_async_stitch_sections_processes_sections_in_order(async_upstream):
+    sections = {"first": _voiceover(44100, value=1), "second": _voiceover(22050, value=2)}
+
+    async def fetch(history_item_id):
+        await asyncio.sleep(0.1 if history_item_id == "first" else 0)
+        return sections[history_item_id]
+
+    with patch("asgi_api.fetch_voiceover_async", side_effect=fetch), \
+            patch("utils.finish_section", side_effect=lambda audio, pause: audio):
+        response = _request("POST", "/stitch-sections", json={
+            "user_id": "user", "history_item_id_list": ["first", "second"], "end_of_section_pause_duration_list": [0, 0],
+        })
+
+    assert response.status_code == 200
+    stitched = async_upstream.call_args.args[0]
+    assert stitched.frame_count == 44100 + 22050
+    assert stitched.samples[0, 0] == 1 and stitched.samples[-1, 0] == 2
+
+def test_async_stitch_sections_only_processes_edited_sections(async_upstream):
+    sections = {"first": _voiceover(44100, value=1), "second": _voiceover(22050, value=2), "edited": _voiceover(4410, value=3)}
+
+    async def fetch(history_item_id):
+        return sections[history_item_id]
+
+    with patch("asgi_api.fetch_voiceover_async", side_effect=fetch) as fetched, \
+            patch("utils.finish_section", side_effect=lambda audio, pause: audio):
+        for history_item_id_list in (["first", "second"], ["first", "edited"]):
+            response = _request("POST", "/stitch-sections", json={
+                "user_id": "user", "history_item_id_list": history_item_id_list, "end_of_section_pause_duration_list": [0, 0],
+            })
+            assert response.status_code == 200
+
+    assert [call.args[0] for call in fetched.call_args_list] == ["first", "second", "edited"]
+    assert async_upstream.call_args.args[0].frame_count == 44100 + 4410
+
+def test_async_sharded_synthesis_runs_the_shards_concurrently_and_retries_failures(async_upstream):
+    texts = []
+
+    async def generate(text, **kwargs):
+        texts.append(text)
+        await asyncio.sleep(0.3)
+        if texts.count(text) == 1 and text == "Third comes now.":
+            raise RuntimeError("upstream error")
+
+        async def chunks():
+            yield b"mp3"
+        return chunks()
+
+    importlib.import_module("elevenlabs.types")  # Imported on the first synthesis, not to be timed
+    script = "First sentence here. Second one is here.\n\nThird comes now. And the fourth."
+    with patch("asgi_api._elevenlabs_async_client", SimpleNamespace(generate=generate)), \
+            patch("utils.config.SYNTHESIS_SHARD_MAX_CHARS", 20), \
+            patch("utils.config.SYNTHESIS_SHARD_RETRY_DELAY", 0):
+        start = time.monotonic()
+        response = _request("POST", "/preprocess-voiceover", json={"script": script, "voice": "voice-1", "user_id": "user",
+                                                                   "sharded_synthesis": True})
+        elapsed = time.monotonic() - start
+
+    assert response.status_code == 200
+    assert sorted(texts) == sorted(["First sentence here.", "Second one is here.", "Third comes now.",
+                                    "Third comes now.", "And the fourth."])
+    assert elapsed < 1.0  # 1.8 s one shard after another
+
+@requires_ffmpeg
+def test_history_audio_is_decoded_as_its_chunks_arrive(tmp_path):
+    import io
+    from utils import export_pcm
+    mp3_buffer = io.BytesIO()
+    export_pcm(_voiceover(44100, value=1000), mp3_buffer, format="mp3")
+    mp3_data = mp3_buffer.getvalue()
+    received = []
+
+    async def get_audio(history_item_id):
+        for start in range(0, len(mp3_data), 4096):
+            received.append(start)
+            await asyncio.sleep(0)
+            yield mp3_data[start:start + 4096]
+
+    async def failing_get_audio(history_item_id):
+        yield mp3_data[:4096]
+        raise httpx.ReadError("connection reset")
+
+    audio_cache.clear_memory_cache()
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path)), \
+            patch("asgi_api._elevenlabs_async_client", SimpleNamespace(history=SimpleNamespace(get_audio=get_audio))), \
+            patch("asgi_api.decode_audio_stream_to_pcm", wraps=asgi_api.decode_audio_stream_to_pcm) as decode:
+        voiceover = asyncio.run(asgi_api.fetch_voiceover_async("history_item"))
+        with patch("asgi_api._elevenlabs_async_client.history.get_audio", failing_get_audio):
+            failed = asyncio.run(asgi_api.fetch_voiceover_async("other_history_item"))
+
+    assert len(received) > 1
+    assert decode.call_count == 2 and not isinstance(decode.call_args_list[0].args[0], bytes)
+    assert abs(voiceover.duration_ms - 1000) < 100
+    assert failed is None
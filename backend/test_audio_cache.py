@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pytest
+from unittest.mock import patch
+import audio_cache
+from audio_cache import write_pcm_file, read_pcm_file, get_cached_audio, put_cached_audio, get_cache_stats, clear_memory_cache
+from audio_cache import get_cached_value, put_cached_value
+from data_classes import PCMAudio
+
+
+def _noise(frames, channels=1, seed=0):
+    samples = np.random.default_rng(seed).integers(-20000, 20000, (frames, channels)).astype(np.int16)
+    return PCMAudio(samples=samples, sample_rate=44100)
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    clear_memory_cache()
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path)):
+        yield tmp_path
+    clear_memory_cache()
+
+def test_pcm_file_round_trip_is_memory_mapped(tmp_path):
+    voiceover = _noise(4410, channels=2)
+    path = str(tmp_path / "voiceover.pcm")
+
+    write_pcm_file(path, voiceover)
+    loaded = read_pcm_file(path)
+
+    assert isinstance(loaded.samples, np.memmap)
+    assert loaded.sample_rate == 44100
+    assert np.array_equal(loaded.samples, voiceover.samples)
+    assert [name for name in os.listdir(tmp_path)] == ["voiceover.pcm"]
+
+def test_cache_serves_memory_then_disk_hits(cache_dir):
+    voiceover = _noise(1000)
+    before = get_cache_stats()
+
+    assert get_cached_audio("voiceovers", "pyro_abc1234") is None
+    put_cached_audio("voiceovers", "pyro_abc1234", voiceover)
+    assert get_cached_audio("voiceovers", "pyro_abc1234") is voiceover
+    clear_memory_cache()
+    assert np.array_equal(get_cached_audio("voiceovers", "pyro_abc1234").samples, voiceover.samples)
+
+    after = get_cache_stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["memory_hits"] - before["memory_hits"] == 1
+    assert after["disk_hits"] - before["disk_hits"] == 1
+
+def test_expired_entries_are_misses(cache_dir):
+    put_cached_audio("voiceovers", "history_item", _noise(100), ttl=60)
+
+    with patch("audio_cache.time.time", return_value=audio_cache.time.time() + 61):
+        assert get_cached_audio("voiceovers", "history_item") is None
+    assert not list((cache_dir / "voiceovers").iterdir())
+
+def test_disk_cache_evicts_least_recently_used_entries(cache_dir):
+    entry_bytes = audio_cache.PCM_FILE_HEADER.size + 2000
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DISK_BYTES", 2 * entry_bytes):
+        for index in range(3):
+            put_cached_audio("voiceovers", f"pyro_{index}", _noise(1000, seed=index))
+            os.utime(audio_cache._cache_path("voiceovers", f"pyro_{index}"), (index, index))
+        clear_memory_cache()
+        audio_cache.evict_disk_cache()
+
+        assert get_cached_audio("voiceovers", "pyro_0") is None
+        assert get_cached_audio("voiceovers", "pyro_1") is not None
+        assert get_cached_audio("voiceovers", "pyro_2") is not None
+
+def test_writes_only_scan_the_disk_cache_once_it_is_over_budget(cache_dir):
+    entry_bytes = audio_cache.PCM_FILE_HEADER.size + 2000
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DISK_BYTES", 3 * entry_bytes):
+        put_cached_audio("voiceovers", "pyro_0", _noise(1000))  # Counts the cache once
+        with patch("audio_cache._scan_entries", wraps=audio_cache._scan_entries) as scan:
+            put_cached_audio("voiceovers", "pyro_1", _noise(1000, seed=1))
+            put_cached_audio("voiceovers", "pyro_1", _noise(1000, seed=2))  # Replaces its entry
+            put_cached_audio("sections", "section", _noise(1000, seed=3))
+            assert scan.call_count == 0
+            put_cached_audio("sections", "over_budget", _noise(1000, seed=4))
+            assert scan.call_count > 0
+
+    assert len(list(cache_dir.glob("*/*.pcm"))) == 3
+    assert (cache_dir / audio_cache.SIZE_FILENAME).read_text() == str(3 * entry_bytes)
+
+def test_memory_cache_is_bounded(cache_dir):
+    with patch.object(audio_cache.config, "AUDIO_CACHE_MEMORY_BYTES", 3000):
+        put_cached_audio("voiceovers", "first", _noise(1000))
+        put_cached_audio("voiceovers", "second", _noise(1000))
+
+        assert get_cache_stats()["memory_entries"] == 1
+        assert get_cache_stats()["memory_bytes"] == 2000
+
+
+def test_cached_values_expire_and_are_evicted_by_count(cache_dir):
+    put_cached_value("tts_results", "expired", "pyro_old", ttl=60)
+    with patch("audio_cache.time.time", return_value=10 ** 12):
+        assert get_cached_value("tts_results", "expired") is None
+
+    for index in range(3):
+        put_cached_value("tts_results", f"take-{index}", f"pyro_{index}", max_entries=2)
+        os.utime(audio_cache._cache_path("tts_results", f"take-{index}", extension="json"), (index, index))
+    put_cached_value("tts_results", "take-3", "pyro_3", max_entries=2)
+
+    assert get_cached_value("tts_results", "take-0") is None
+    assert get_cached_value("tts_results", "take-1") is None
+    assert get_cached_value("tts_results", "take-2") == "pyro_2"
+    assert get_cached_value("tts_results", "take-3") == "pyro_3"
+
+def test_value_writes_only_scan_the_namespace_once_it_is_full(cache_dir):
+    put_cached_value("tts_results", "take-0", "pyro_0", max_entries=20)  # Counts the namespace once
+    with patch("audio_cache._scan_entries", wraps=audio_cache._scan_entries) as scan:
+        for index in range(1, 20):
+            put_cached_value("tts_results", f"take-{index}", f"pyro_{index}", max_entries=20)
+        put_cached_value("tts_results", "take-0", "pyro_again", max_entries=20)  # Replaces its entry
+        assert scan.call_count == 0
+        put_cached_value("tts_results", "take-20", "pyro_20", max_entries=20)
+        put_cached_value("tts_results", "take-21", "pyro_21", max_entries=20)
+        assert scan.call_count == 1  # Evicted to a tenth below the limit
+
+    assert len(list((cache_dir / "tts_results").glob("*.json"))) == 19
@@ -0,0 +1,139 @@
+import io
+import shutil
+import subprocess
+import numpy as np
+import pytest
+from unittest.mock import Mock
+from pydub import AudioSegment
+from audio_stream import pcm_blocks, stream_encode_pcm, stream_decode_audio, upload_stream_to_s3
+from data_classes import PCMAudio
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which(AudioSegment.converter) is None, reason="ffmpeg is not installed")
+
+
+def _noise(frames, channels=2):
+    samples = np.random.default_rng(0).integers(-20000, 20000, (frames, channels)).astype(np.int16)
+    return PCMAudio(samples=samples, sample_rate=44100)
+
+def _fake_s3_client():
+    s3_client = Mock()
+    s3_client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    s3_client.upload_part.side_effect = lambda **kwargs: {"ETag": f"etag-{kwargs['PartNumber']}"}
+    return s3_client
+
+def test_pcm_blocks_are_views_of_at_most_block_frames():
+    audio = _noise(25000)
+
+    blocks = list(pcm_blocks(audio, block_frames=10000))
+
+    assert [len(block) for block in blocks] == [10000, 10000, 5000]
+    assert all(np.shares_memory(block, audio.samples) for block in blocks)
+
+def test_upload_stream_to_s3_uploads_minimum_sized_parts():
+    s3_client = _fake_s3_client()
+    chunks = [b"a" * 400, b"b" * 400, b"c" * 100]
+
+    upload_stream_to_s3(s3_client, iter(chunks), "bucket", "key", part_bytes=500)
+
+    part_bodies = [call.kwargs["Body"] for call in s3_client.upload_part.call_args_list]
+    assert part_bodies == [b"a" * 400 + b"b" * 400, b"c" * 100]
+    s3_client.complete_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="key", UploadId="upload-1",
+        MultipartUpload={"Parts": [{"ETag": "etag-1", "PartNumber": 1}, {"ETag": "etag-2", "PartNumber": 2}]},
+    )
+
+def test_upload_stream_to_s3_puts_streams_shorter_than_a_part_at_once():
+    s3_client = _fake_s3_client()
+
+    upload_stream_to_s3(s3_client, iter([b"a" * 400, b"b" * 99]), "bucket", "key", part_bytes=500)
+
+    s3_client.put_object.assert_called_once_with(Bucket="bucket", Key="key", Body=b"a" * 400 + b"b" * 99,
+                                                 ContentType="audio/mpeg")
+    s3_client.create_multipart_upload.assert_not_called()
+    s3_client.upload_part.assert_not_called()
+
+def test_upload_stream_to_s3_aborts_when_the_stream_fails():
+    s3_client = _fake_s3_client()
+
+    def failing_chunks():
+        yield b"a" * 500
+        yield b"partial"
+        raise RuntimeError("encoder crashed")
+
+    with pytest.raises(RuntimeError):
+        upload_stream_to_s3(s3_client, failing_chunks(), "bucket", "key", part_bytes=500)
+
+    s3_client.abort_multipart_upload.assert_called_once_with(Bucket="bucket", Key="key", UploadId="upload-1")
+    s3_client.complete_multipart_upload.assert_not_called()
+
+    s3_client = _fake_s3_client()
+    with pytest.raises(RuntimeError):
+        upload_stream_to_s3(s3_client, failing_chunks(), "bucket", "key")
+    s3_client.put_object.assert_not_called()  # Nothing was sent yet
+
+@requires_ffmpeg
+def test_stream_encode_pcm_encodes_all_blocks():
+    audio = _noise(44100)
+
+    encoded = b"".join(stream_encode_pcm(pcm_blocks(audio, 4096), 44100, 2, format="wav"))
+    decoded = AudioSegment.from_file(io.BytesIO(encoded), format="wav")
+
+    assert np.array_equal(np.frombuffer(decoded.raw_data, dtype=np.int16).reshape(-1, 2), audio.samples)
+
+@requires_ffmpeg
+def test_stream_encode_pcm_produces_mp3():
+    encoded = b"".join(stream_encode_pcm(pcm_blocks(_noise(44100)), 44100, 2))
+
+    assert encoded[:3] == b"ID3" or encoded[0] == 0xFF
+
+@requires_ffmpeg
+def test_stream_encode_pcm_rejects_samples_wider_than_16_bits():
+    wide = PCMAudio(samples=np.full((1000, 2), 1 << 20, dtype=np.int32), sample_rate=44100)
+
+    with pytest.raises(ValueError, match="int32"):
+        list(stream_encode_pcm(pcm_blocks(wide), 44100, 2, format="wav"))
+
+@requires_ffmpeg
+def test_stream_encode_pcm_reports_encoder_failures():
+    with pytest.raises(RuntimeError):
+        list(stream_encode_pcm(pcm_blocks(_noise(1000)), 44100, 2, format="not-a-format"))
+
+
+def _mp3_chunks(audio, chunk_bytes=1000):
+    encoded = b"".join(stream_encode_pcm(pcm_blocks(audio), audio.sample_rate, audio.channels))
+    return [encoded[start:start + chunk_bytes] for start in range(0, len(encoded), chunk_bytes)], encoded
+
+@requires_ffmpeg
+def test_stream_decode_audio_matches_decoding_the_whole_file():
+    chunks, encoded = _mp3_chunks(_noise(3 * 44100, channels=1))
+    # The same ffmpeg invocation AudioSegment.from_file(..., format="mp3") runs, without needing ffprobe
+    wav = subprocess.run([AudioSegment.converter, "-f", "mp3", "-i", "pipe:0", "-vn", "-acodec", "pcm_s16le", "-f", "wav", "pipe:1"],
+                         input=encoded, capture_output=True, check=True).stdout
+    expected = AudioSegment.from_file(io.BytesIO(wav), format="wav")
+
+    blocks = list(stream_decode_audio(iter(chunks), format="mp3", block_frames=10000))
+
+    assert all(len(block.samples) == 10000 for block in blocks[:-1])
+    assert {(block.sample_rate, block.channels) for block in blocks} == {(expected.frame_rate, expected.channels)}
+    decoded = np.concatenate([block.samples for block in blocks])
+    assert np.array_equal(decoded, np.frombuffer(expected.raw_data, dtype=np.int16).reshape(-1, 1))
+
+@requires_ffmpeg
+def test_stream_decode_audio_yields_before_the_input_ends():
+    chunks, _ = _mp3_chunks(_noise(10 * 44100, channels=1))
+    consumed = []
+
+    def slow_tts():
+        for chunk in chunks:
+            consumed.append(chunk)
+            yield chunk
+
+    decoder = stream_decode_audio(slow_tts(), format="mp3", block_frames=4410)
+    next(decoder)
+    assert len(consumed) < len(chunks)
+    decoder.close()
+
+@requires_ffmpeg
+def test_stream_decode_audio_reports_decoder_failures():
+    with pytest.raises(RuntimeError):
+        list(stream_decode_audio(iter([b"not audio" * 100]), format="mp3"))
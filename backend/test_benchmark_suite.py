@@ -0,0 +1,19 @@
+from benchmark_suite import compare_results, run_suite
+
+
+def _results(**medians):
+    return {"meta": {}, "results": {name: {"median_ms": median, "min_ms": median, "repeat": 1} for name, median in medians.items()}}
+
+def test_compare_flags_only_slowdowns_past_the_threshold():
+    baseline = _results(stitch=10.0, mix=100.0, removed=5.0)
+    current = _results(stitch=12.0, mix=140.0, added=1.0)
+
+    assert compare_results(baseline, current, threshold=0.25) == [("mix", 100.0, 140.0)]
+    assert compare_results(baseline, current, threshold=0.1) == [("stitch", 10.0, 12.0), ("mix", 100.0, 140.0)]
+
+def test_suite_records_every_selected_case():
+    suite = run_suite(repeat=1, quick=True, name_filter="stitch_audio_segments")
+
+    assert list(suite["results"]) == ["stitch_audio_segments/4_sections"]
+    assert suite["results"]["stitch_audio_segments/4_sections"]["median_ms"] >= 0
+    assert suite["meta"]["encoder"] in ("ffmpeg", "passthrough")
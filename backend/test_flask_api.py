@@ -1,4 +1,6 @@
+import os
 import pytest
+from unittest.mock import patch
 from flask_api import app
 
 from config import Config
@@ -20,3 +22,242 @@ def test_home_message(client):
     response = client.get('/')
     assert response.status_code == 200
     assert response.data.decode('utf-8') == expected_message
+
+
+def _add_to_library(path):
+    import music_library
+    music_library._record_in_manifest(os.path.dirname(path), os.path.basename(path), {"size": os.path.getsize(path), "etag": None})
+
+def _fake_encoder(blocks, sample_rate, channels, format="mp3", bitrate="192k"):
+    for block in blocks:
+        yield block.tobytes()
+
+@pytest.fixture
+def preview_file():
+    import numpy as np
+    from data_classes import PCMAudio
+    from utils import export_pcm
+    os.makedirs(config.MUSIC_PREVIEW_DIR, exist_ok=True)
+    preview_path = os.path.join(config.MUSIC_PREVIEW_DIR, 'test_preview.wav')
+    samples = np.full((44100, 2), 10000, dtype=np.int16)
+    export_pcm(PCMAudio(samples=samples, sample_rate=44100), preview_path, format="wav")
+    _add_to_library(preview_path)
+    return preview_path
+
+def test_music_preview_volume_change_streams_the_adjusted_preview(client, preview_file):
+    import numpy as np
+    with patch('flask_api.stream_encode_pcm', side_effect=_fake_encoder):
+        response = client.post('/music_preview_volume_change',
+                               json={'music_vol': 0.5, 'music_choice': 'test_preview.wav', 'user_id': 'user'})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename=vol_changed_user.mp3'
+    samples = np.frombuffer(response.data, dtype=np.int16)
+    assert len(samples) == 44100 * 2
+    assert set(samples) == {int(np.floor(10000 * 10 ** (-15 / 20)))}
+
+def test_music_requests_only_accept_files_of_the_library(client, preview_file):
+    from data_classes import PCMAudio
+    import numpy as np
+    voiceover = PCMAudio(samples=np.zeros((4410, 1), dtype=np.int16), sample_rate=44100)
+    with patch('music_library.get_http_session') as session, \
+            patch('flask_api.generate_voiceover_from_history_item_id', return_value=voiceover):
+        traversal = client.post('/music_preview_volume_change',
+                                json={'music_vol': 0.5, 'music_choice': '../../app.py', 'user_id': 'user'})
+        unlisted = client.post('/generate-mix', json={'user_id': 'user', 'ad_length': 15, 'music_choice': 'unlisted.mp3',
+                                                      'history_item_id': 'voice'})
+
+    assert traversal.status_code == unlisted.status_code == 400
+    assert "Unknown music file" in traversal.get_json()["error"]
+    session.assert_not_called()
+
+def test_music_preview_volume_change_reuses_the_render_of_a_volume_step(client, preview_file):
+    import numpy as np
+    with patch('flask_api.stream_encode_pcm', side_effect=_fake_encoder) as encode:
+        first = client.post('/music_preview_volume_change',
+                            json={'music_vol': 0.5, 'music_choice': 'test_preview.wav', 'user_id': 'user'})
+        first_data = first.data
+        # 0.51 snaps to the same 0.5 step
+        again = client.post('/music_preview_volume_change',
+                            json={'music_vol': 0.51, 'music_choice': 'test_preview.wav', 'user_id': 'user'})
+        other = client.post('/music_preview_volume_change',
+                            json={'music_vol': 0.8, 'music_choice': 'test_preview.wav', 'user_id': 'user'})
+        other.data
+
+    assert again.data == first_data
+    assert encode.call_count == 2
+    peak_dbfs = 20 * np.log10(10000 / 32768)
+    assert float(again.headers['X-Peak-dBFS']) == pytest.approx(peak_dbfs - 15, abs=0.01)
+    assert float(other.headers['X-RMS-dBFS']) == pytest.approx(peak_dbfs - 6, abs=0.01)
+
+
+@pytest.fixture
+def local_jobs():
+    import flask_api
+    with patch.object(flask_api.config, "task_always_eager", True):
+        flask_api.get_celery().conf.task_always_eager = True
+        try:
+            yield flask_api.config
+        finally:
+            flask_api.get_celery().conf.task_always_eager = False
+
+def test_jobs_run_a_pipeline_and_report_its_result(client, local_jobs):
+    with patch('flask_api.stitch_sections_pipeline', return_value='pyro_abc') as pipeline:
+        response = client.post('/jobs/stitch-sections', json={'user_id': 'user'})
+
+    assert response.status_code == 202
+    pipeline.assert_called_once_with({'user_id': 'user'})
+    status = client.get(f"/jobs/{response.get_json()['job_id']}").get_json()
+    assert status['status'] == 'SUCCESS'
+    assert status['pyro_history_item_id'] == 'pyro_abc'
+
+def test_jobs_report_pipeline_failures(client, local_jobs):
+    with patch('flask_api.produce_spot_pipeline', side_effect=RuntimeError("Failed to upload the audio")):
+        response = client.post('/jobs/produce-spot', json={'user_id': 'user'})
+
+    status = client.get(f"/jobs/{response.get_json()['job_id']}").get_json()
+    assert status['status'] == 'FAILURE'
+    assert status['error'] == "Failed to upload the audio"
+
+def test_jobs_reject_unknown_pipelines(client):
+    response = client.post('/jobs/render-everything', json={})
+    assert response.status_code == 404
+
+def test_jobs_are_refused_without_a_broker_or_a_result_backend(client, local_jobs):
+    with patch('flask_api.stitch_sections_pipeline') as pipeline:
+        with patch.object(local_jobs, "task_always_eager", False):
+            without_broker = client.post('/jobs/stitch-sections', json={'user_id': 'user'})
+        with patch.object(local_jobs, "broker_url", "sqs://"), patch.object(local_jobs, "result_backend", None):
+            without_result_backend = client.post('/jobs/stitch-sections', json={'user_id': 'user'})
+
+    assert without_broker.status_code == without_result_backend.status_code == 501
+    assert "BROKER_URL" in without_broker.get_json()["error"]
+    assert "RESULT_BACKEND" in without_result_backend.get_json()["error"]
+    pipeline.assert_not_called()
+
+
+def test_malformed_bodies_get_a_json_error_past_admission(client, tmp_path):
+    import admission
+    with patch.object(admission.config, "ADMISSION_ENABLED", True), \
+            patch.object(admission.config, "ADMISSION_DIR", str(tmp_path)):
+        bad_ad_length = client.post('/generate-mix', json={'user_id': 'user', 'ad_length': 'abc'})
+        list_body = client.post('/produce-spot', json=[1, 2])
+
+    for response in (bad_ad_length, list_body):
+        assert response.status_code == 500
+        assert "error" in response.get_json()
+
+
+@pytest.fixture
+def tts_pipeline(tmp_path):
+    import audio_cache
+    from data_classes import PCMAudio
+    import numpy as np
+    voiceover = PCMAudio(samples=np.zeros((4410, 1), dtype=np.int16), sample_rate=44100)
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path)), \
+            patch('flask_api.generate_voiceover_from_voice_id', return_value=voiceover) as synthesize, \
+            patch('flask_api.upload_audio_segment_to_s3', return_value=True) as upload, \
+            patch('flask_api.generate_pyro_history_item_id', side_effect=lambda _: os.urandom(4).hex()):
+        yield synthesize, upload
+
+def test_preprocess_voiceover_reuses_renders_of_identical_inputs(client, tts_pipeline):
+    synthesize, upload = tts_pipeline
+    request_body = {'script': 'Hello', 'voice': 'voice-1', 'voice_gender': 'female', 'user_id': 'user', 'emotion': 'calmly'}
+
+    first = client.post('/preprocess-voiceover', json=request_body).get_json()
+    again = client.post('/preprocess-voiceover', json=request_body).get_json()
+    other_voice = client.post('/preprocess-voiceover', json={**request_body, 'voice': 'voice-2'}).get_json()
+    fresh = client.post('/preprocess-voiceover', json={**request_body, 'fresh_take': True}).get_json()
+
+    assert again == first
+    assert other_voice != first
+    assert fresh != first
+    assert synthesize.call_count == upload.call_count == 3
+    assert client.post('/preprocess-voiceover', json=request_body).get_json() == fresh
+
+def test_preprocess_voiceover_can_synthesize_in_shards(client, tts_pipeline):
+    synthesize, _ = tts_pipeline
+    request_body = {'script': 'Hello. Bye.', 'voice': 'voice-1', 'user_id': 'user'}
+
+    with patch('flask_api.generate_sharded_voiceover', return_value=synthesize.return_value) as synthesize_sharded:
+        whole = client.post('/preprocess-voiceover', json=request_body).get_json()
+        sharded = client.post('/preprocess-voiceover', json={**request_body, 'sharded_synthesis': True}).get_json()
+
+    assert sharded != whole
+    synthesize.assert_called_once()
+    synthesize_sharded.assert_called_once()
+
+
+def test_produce_spot_mixes_and_uploads_without_intermediate_files(client):
+    import numpy as np
+    import audio_cache
+    from data_classes import PCMAudio
+    from utils import export_pcm, ensure_music_sidecar
+    os.makedirs(config.MUSIC_LIBRARY_DIR, exist_ok=True)
+    music_path = os.path.join(config.MUSIC_LIBRARY_DIR, 'test_spot_music.wav')
+    export_pcm(PCMAudio(samples=np.full((44100, 2), 1000, dtype=np.int16), sample_rate=44100), music_path, format="wav")
+    ensure_music_sidecar(music_path)
+    _add_to_library(music_path)
+    sections = [PCMAudio(samples=np.full((22050, 1), 5000, dtype=np.int16), sample_rate=44100)] * 2
+    uploaded = []
+    audio_cache.clear_memory_cache()
+
+    def upload(s3_client, byte_chunks, bucket_name, object_name, **kwargs):
+        uploaded.append(b"".join(byte_chunks))
+
+    with patch('utils.process_sections', return_value=sections), \
+            patch('utils.stream_encode_pcm', side_effect=_fake_encoder), \
+            patch('utils.upload_stream_to_s3', side_effect=upload), \
+            patch('utils.get_s3_client'), \
+            patch('utils.export_pcm') as export, \
+            patch('utils.AudioSegment.from_file') as decode:
+        response = client.post('/produce-spot', json={
+            'user_id': 'user', 'history_item_id_list': ['a', 'b'], 'end_of_section_pause_duration_list': [0, 0],
+            'music_filename': 'test_spot_music.wav', 'music_vol': 0.5,
+        })
+
+    assert response.status_code == 200
+    export.assert_not_called()
+    decode.assert_not_called()
+    assert len(uploaded) == 1 and len(uploaded[0]) == 44100 * 2 * 2
+
+def test_render_variants_prepares_the_voiceover_once(client):
+    import numpy as np
+    from data_classes import PCMAudio
+    from utils import export_pcm, ensure_music_sidecar
+    os.makedirs(config.MUSIC_LIBRARY_DIR, exist_ok=True)
+    music_path = os.path.join(config.MUSIC_LIBRARY_DIR, 'test_variant_music.wav')
+    export_pcm(PCMAudio(samples=np.full((44100, 2), 1000, dtype=np.int16), sample_rate=44100), music_path, format="wav")
+    ensure_music_sidecar(music_path)
+    _add_to_library(music_path)
+    voiceover = PCMAudio(samples=np.full((44100, 1), 5000, dtype=np.int16), sample_rate=44100)
+    uploaded = {}
+
+    def upload(s3_client, byte_chunks, bucket_name, object_name, **kwargs):
+        uploaded[object_name] = b"".join(byte_chunks)
+
+    with patch('flask_api.generate_voiceover_from_history_item_id', return_value=voiceover) as fetch, \
+            patch('utils.stream_encode_pcm', side_effect=_fake_encoder), \
+            patch('utils.upload_stream_to_s3', side_effect=upload), \
+            patch('utils.get_s3_client'):
+        response = client.post('/render-variants', json={
+            'user_id': 'user', 'history_item_id': 'voice',
+            'variants': [{'music_filename': 'test_variant_music.wav', 'music_vol': 0.1},
+                         {'music_filename': 'test_variant_music.wav', 'music_vol': 0.5, 'ad_length': 2},
+                         {'music_filename': 'test_variant_music.wav', 'music_vol': 0.9}],
+        })
+
+    assert response.status_code == 200
+    fetch.assert_called_once_with('voice')
+    pyro_history_item_ids = response.get_json()["pyro_history_item_ids"]
+    assert len(set(pyro_history_item_ids)) == 3
+    renders = [uploaded[f"primary--distribution/{item_id}"] for item_id in pyro_history_item_ids]
+    # In variant order: one second under the voiceover, two seconds of ad length, then louder music
+    assert [len(render) for render in renders] == [44100 * 2 * 2, 2 * 44100 * 2 * 2, 44100 * 2 * 2]
+    assert renders[0] != renders[2]
+
+def test_render_variants_requires_variants(client):
+    response = client.post('/render-variants', json={'user_id': 'user', 'history_item_id': 'voice', 'variants': []})
+
+    assert response.status_code == 500
@@ -0,0 +1,125 @@
+import json
+import logging
+import numpy as np
+import pytest
+from unittest.mock import patch
+import metrics
+from metrics import stage, timed_iteration, start_request_trace, finish_request_trace, render_metrics
+from data_classes import PCMAudio
+
+
+@pytest.fixture(autouse=True)
+def isolated_metrics(tmp_path):
+    with patch.object(metrics.config, "METRICS_DIR", str(tmp_path / "metrics")), \
+            patch.object(metrics.config, "METRICS_ENABLED", True), \
+            patch.dict(metrics._stage_stats, clear=True), \
+            patch.dict(metrics._request_stats, clear=True):
+        yield tmp_path / "metrics"
+
+def _metric_value(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not in the metrics")
+
+def test_stages_are_exposed_as_prometheus_histograms_and_counters():
+    for _ in range(3):
+        with stage("decode") as measured:
+            measured["bytes"] = 1000
+
+    text = render_metrics()
+
+    assert "# TYPE pyro_stage_duration_seconds histogram" in text
+    assert _metric_value(text, 'pyro_stage_duration_seconds_count{stage="decode"}') == 3
+    assert _metric_value(text, 'pyro_stage_duration_seconds_bucket{stage="decode",le="+Inf"}') == 3
+    assert _metric_value(text, 'pyro_stage_bytes_total{stage="decode"}') == 3000
+    assert _metric_value(text, 'pyro_stage_peak_rss_bytes{stage="decode"}') > 0
+
+def test_timed_iteration_measures_a_streamed_stage():
+    blocks = [PCMAudio(samples=np.zeros((100, 2), dtype=np.int16), sample_rate=44100) for _ in range(4)]
+
+    assert len(list(timed_iteration("mix", blocks))) == 4
+    assert len(list(timed_iteration("encode", [b"abc", b"de"]))) == 2
+
+    text = render_metrics()
+    assert _metric_value(text, 'pyro_stage_bytes_total{stage="mix"}') == 4 * 100 * 2 * 2
+    assert _metric_value(text, 'pyro_stage_bytes_total{stage="encode"}') == 5
+
+def test_metrics_of_all_processes_are_merged(isolated_metrics):
+    with stage("upload") as measured:
+        measured["bytes"] = 10
+    isolated_metrics.mkdir(exist_ok=True)
+    other_worker = {"count": 2, "wall_seconds": 1.5, "buckets": [0] * len(metrics.DURATION_BUCKETS) + [2],
+                    "cpu_seconds": 0.1, "bytes": 90, "peak_rss_bytes": 1}
+    (isolated_metrics / "999999.json").write_text(json.dumps({"stages": {"upload": other_worker}, "requests": {}}))
+
+    text = render_metrics()
+
+    assert _metric_value(text, 'pyro_stage_duration_seconds_count{stage="upload"}') == 3
+    assert _metric_value(text, 'pyro_stage_bytes_total{stage="upload"}') == 100
+    assert _metric_value(text, 'pyro_stage_duration_seconds_bucket{stage="upload",le="+Inf"}') == 3
+
+def test_request_trace_logs_its_stages_as_json(caplog):
+    token = start_request_trace("/produce-spot")
+    with stage("fetch") as measured:
+        measured["bytes"] = 42
+    # Streamed stages belong to the request that created them, even when consumed later
+    encoded = timed_iteration("encode", [b"x"])
+    with caplog.at_level(logging.INFO, logger="metrics"):
+        list(encoded)
+        finish_request_trace(token, "POST", 200)
+
+    trace = json.loads(caplog.records[-1].getMessage())
+    assert trace["route"] == "/produce-spot" and trace["status"] == 200
+    assert [(entry["stage"], entry["bytes"]) for entry in trace["stages"]] == [("fetch", 42), ("encode", 1)]
+    assert _metric_value(render_metrics(), 'pyro_request_duration_seconds_count{route="/produce-spot",status="200"}') == 1
+
+def test_disabled_metrics_record_nothing():
+    with patch.object(metrics.config, "METRICS_ENABLED", False):
+        with stage("decode"):
+            pass
+        list(timed_iteration("mix", [b"x"]))
+
+    assert metrics._stage_stats == {}
+
+def test_metrics_endpoint_serves_the_flask_routes(tmp_path):
+    import audio_cache
+    from flask_api import app
+    sections = [PCMAudio(samples=np.ones((4410, 1), dtype=np.int16), sample_rate=44100)] * 2
+    audio_cache.clear_memory_cache()
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path / "cache")), \
+            patch("utils.process_sections", return_value=sections), \
+            patch("flask_api.upload_audio_segment_to_s3", return_value=True), \
+            app.test_client() as client:
+        client.post("/stitch-sections", json={"user_id": "user", "history_item_id_list": ["a", "b"],
+                                              "end_of_section_pause_duration_list": [0, 0]})
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert _metric_value(text, 'pyro_stage_duration_seconds_count{stage="stitch"}') == 1
+    assert _metric_value(text, 'pyro_request_duration_seconds_count{route="/stitch-sections",status="200"}') == 1
+
+def test_snapshots_of_dead_processes_are_folded_into_one_file(isolated_metrics):
+    import os
+    import subprocess
+    process = subprocess.Popen(["true"])
+    process.wait()
+    isolated_metrics.mkdir(exist_ok=True)
+    dead_worker = {"count": 2, "wall_seconds": 1.5, "buckets": [0] * len(metrics.DURATION_BUCKETS) + [2],
+                   "cpu_seconds": 0.1, "bytes": 90, "peak_rss_bytes": 1}
+    for filename in (f"{process.pid}-a1b2c3d4.json", f"{process.pid}-e5f6a7b8.json"):
+        (isolated_metrics / filename).write_text(json.dumps({"stages": {"upload": dead_worker}, "requests": {}}))
+    with stage("upload") as measured:
+        measured["bytes"] = 10
+    before = render_metrics()
+
+    assert metrics.fold_dead_snapshots() == 2
+    assert metrics.fold_dead_snapshots() == 0
+
+    assert sorted(os.listdir(isolated_metrics)) == sorted([".lock", metrics._snapshot_filename, metrics.RETIRED_FILENAME])
+    after = render_metrics()
+    assert _metric_value(before, 'pyro_stage_bytes_total{stage="upload"}') == 190
+    assert _metric_value(after, 'pyro_stage_bytes_total{stage="upload"}') == 190
+    assert _metric_value(after, 'pyro_stage_duration_seconds_count{stage="upload"}') == 5
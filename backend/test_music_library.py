@@ -0,0 +1,114 @@
+import os
+import json
+import pytest
+import requests_mock
+import music_library
+from music_library import sync_library, ensure_library_file, read_manifest, requested_library_file, UnknownLibraryFile
+
+BASE_URL = "https://music.example.com/library/"
+
+
+@pytest.fixture
+def origin():
+    with requests_mock.Mocker() as mocker:
+        def serve(filename, content, etag):
+            url = BASE_URL + filename.replace(' ', '%20')
+            headers = {"Content-Length": str(len(content)), "ETag": etag}
+            mocker.head(url, headers=headers)
+            mocker.get(url, content=content, headers={"ETag": etag})
+        yield mocker, serve
+
+def _downloads(mocker):
+    return [request.url for request in mocker.request_history if request.method == "GET"]
+
+def test_sync_downloads_only_missing_and_changed_files(tmp_path, origin):
+    mocker, serve = origin
+    serve("Calm Morning.mp3", b"calm" * 10, '"v1"')
+    serve("Upbeat.mp3", b"upbeat", '"v1"')
+    serve("Epic.mp3", b"epic!", '"v1"')
+    first = sync_library(BASE_URL, str(tmp_path), ["Calm Morning.mp3", "Upbeat.mp3", "Epic.mp3"])
+
+    assert sorted(first["downloaded"]) == ["Calm Morning.mp3", "Epic.mp3", "Upbeat.mp3"]
+    assert (tmp_path / "Calm Morning.mp3").read_bytes() == b"calm" * 10
+    assert read_manifest(str(tmp_path))["Upbeat.mp3"] == {"size": 6, "etag": '"v1"'}
+
+    mocker.reset_mock()
+    serve("Upbeat.mp3", b"upbeat, remastered", '"v2"')
+    os.remove(tmp_path / "Epic.mp3")
+    ready = []
+    second = sync_library(BASE_URL, str(tmp_path), ["Calm Morning.mp3", "Upbeat.mp3", "Epic.mp3"], on_file_ready=ready.append)
+
+    assert sorted(second["downloaded"]) == ["Epic.mp3", "Upbeat.mp3"]
+    assert second["unchanged"] == ["Calm Morning.mp3"]
+    assert sorted(_downloads(mocker)) == [BASE_URL + "Epic.mp3", BASE_URL + "Upbeat.mp3"]
+    assert (tmp_path / "Upbeat.mp3").read_bytes() == b"upbeat, remastered"
+    assert len(ready) == 3
+
+def test_sync_adopts_files_downloaded_before_the_manifest(tmp_path, origin):
+    mocker, serve = origin
+    serve("Upbeat.mp3", b"upbeat", '"v1"')
+    (tmp_path / "Upbeat.mp3").write_bytes(b"upbeat")
+
+    summary = sync_library(BASE_URL, str(tmp_path), ["Upbeat.mp3"])
+
+    assert summary["unchanged"] == ["Upbeat.mp3"]
+    assert _downloads(mocker) == []
+
+def test_sync_reports_unavailable_files_as_failed(tmp_path, origin):
+    mocker, serve = origin
+    mocker.head(BASE_URL + "Gone.mp3", status_code=404)
+
+    summary = sync_library(BASE_URL, str(tmp_path), ["Gone.mp3"])
+
+    assert summary["failed"] == ["Gone.mp3"]
+    assert not (tmp_path / "Gone.mp3").exists()
+
+def test_interrupted_download_resumes_with_a_range_request(tmp_path, origin):
+    mocker, serve = origin
+    serve("Epic.mp3", b"0123456789", '"v1"')
+    (tmp_path / "Epic.mp3.part").write_bytes(b"0123")
+    mocker.get(BASE_URL + "Epic.mp3", content=b"456789", status_code=206, headers={"ETag": '"v1"'})
+
+    summary = sync_library(BASE_URL, str(tmp_path), ["Epic.mp3"])
+
+    assert summary["downloaded"] == ["Epic.mp3"]
+    request = mocker.request_history[-1]
+    assert request.headers["Range"] == "bytes=4-"
+    assert request.headers["If-Range"] == '"v1"'
+    assert (tmp_path / "Epic.mp3").read_bytes() == b"0123456789"
+    assert not (tmp_path / "Epic.mp3.part").exists()
+
+def test_resume_restarts_when_the_origin_sends_the_whole_file(tmp_path, origin):
+    mocker, serve = origin
+    serve("Epic.mp3", b"0123456789", '"v2"')
+    (tmp_path / "Epic.mp3.part").write_bytes(b"stale")
+
+    sync_library(BASE_URL, str(tmp_path), ["Epic.mp3"])
+
+    assert (tmp_path / "Epic.mp3").read_bytes() == b"0123456789"
+
+def test_ensure_library_file_fetches_only_the_requested_track(tmp_path, origin):
+    mocker, serve = origin
+    serve("Calm Morning.mp3", b"calm", '"v1"')
+    serve("Upbeat.mp3", b"upbeat", '"v1"')
+    file_path = str(tmp_path / "background_music" / "Calm Morning.mp3")
+
+    assert ensure_library_file(BASE_URL, file_path) == file_path
+    assert ensure_library_file(BASE_URL, file_path) == file_path
+
+    assert _downloads(mocker) == [BASE_URL + "Calm%20Morning.mp3"]
+    with open(os.path.join(os.path.dirname(file_path), music_library.MANIFEST_FILENAME)) as manifest_file:
+        assert list(json.load(manifest_file)) == ["Calm Morning.mp3"]
+
+def test_requests_may_only_name_files_of_the_library(tmp_path, origin):
+    mocker, serve = origin
+    serve("Calm Morning.mp3", b"calm", '"v1"')
+    serve("Upbeat.mp3", b"upbeat", '"v1"')
+    sync_library(BASE_URL, str(tmp_path), ["Calm Morning.mp3"])
+    (tmp_path / "Calm Morning.mp3").unlink()  # Listed, downloaded again on request
+
+    assert requested_library_file(BASE_URL, str(tmp_path), "Calm Morning.mp3") == str(tmp_path / "Calm Morning.mp3")
+    for filename in ("Upbeat.mp3", "../Calm Morning.mp3", "sub/Calm Morning.mp3", ".manifest.json", "", None):
+        with pytest.raises(UnknownLibraryFile):
+            requested_library_file(BASE_URL, str(tmp_path), filename)
+    assert _downloads(mocker) == [BASE_URL + "Calm%20Morning.mp3"] * 2
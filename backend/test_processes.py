@@ -0,0 +1,12 @@
+import os
+import subprocess
+from processes import process_is_alive
+
+
+def test_only_running_processes_are_alive():
+    process = subprocess.Popen(["true"])
+    process.wait()
+
+    assert process_is_alive(os.getpid())
+    assert process_is_alive(1)
+    assert not process_is_alive(process.pid)
@@ -0,0 +1,40 @@
+from data_classes import ScriptShard
+from script_shards import split_script
+
+SCRIPT = ('Meet the new Pyro. It is fast! It is loud.\n\n'
+          'Visit us today <break time="0.8s" /> at your dealer.')
+
+
+def test_a_script_that_fits_stays_whole():
+    assert split_script(SCRIPT, 1000, 300, 700) == [ScriptShard(text=SCRIPT, pause_after_ms=0)]
+
+def test_shards_end_at_the_pauses_of_the_script():
+    shards = split_script(SCRIPT, 1, 300, 700)
+
+    assert shards == [
+        ScriptShard(text="Meet the new Pyro.", pause_after_ms=300),
+        ScriptShard(text="It is fast!", pause_after_ms=300),
+        ScriptShard(text="It is loud.", pause_after_ms=700),
+        ScriptShard(text="Visit us today", pause_after_ms=800),
+        ScriptShard(text="at your dealer.", pause_after_ms=0),
+    ]
+
+def test_sentences_are_packed_and_keep_their_breaks_within_a_shard():
+    shards = split_script(SCRIPT, 55, 300, 700)
+
+    assert [shard.text for shard in shards] == [
+        "Meet the new Pyro. It is fast! It is loud.",
+        'Visit us today <break time="0.8s" /> at your dealer.',
+    ]
+    assert shards[0].pause_after_ms == 700
+
+def test_a_sentence_longer_than_a_shard_is_not_cut():
+    sentence = "This sentence goes on and on without ever stopping for breath."
+
+    assert split_script(f"{sentence} Short.", 10) == [ScriptShard(text=sentence, pause_after_ms=0),
+                                                     ScriptShard(text="Short.", pause_after_ms=0)]
+
+def test_consecutive_pauses_add_up():
+    shards = split_script('First. <break time="500ms" /> <break time="0.3s" /> Second.', 1, 300, 700)
+
+    assert shards == [ScriptShard(text="First.", pause_after_ms=800), ScriptShard(text="Second.", pause_after_ms=0)]
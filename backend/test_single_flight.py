@@ -0,0 +1,172 @@
+import time
+import asyncio
+import multiprocessing
+import threading
+import pytest
+from unittest.mock import patch
+import audio_cache
+import single_flight
+from single_flight import single_flight as run_single_flight, single_flight_async, single_flight_key
+
+
+@pytest.fixture(autouse=True)
+def isolated_dirs(tmp_path):
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path / "cache")), \
+            patch.object(single_flight.config, "SINGLE_FLIGHT_LOCK_DIR", str(tmp_path / "locks")), \
+            patch.object(single_flight.config, "SINGLE_FLIGHT_BACKEND", "file"):
+        yield tmp_path
+
+def _run_in_threads(count, function):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        try:
+            results[index] = function()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+def test_key_ignores_the_order_of_payload_keys():
+    assert single_flight_key("produce_spot", {"a": 1, "b": [1, 2]}) == single_flight_key("produce_spot", {"b": [1, 2], "a": 1})
+    assert single_flight_key("produce_spot", {"a": 1}) != single_flight_key("stitch_sections", {"a": 1})
+    assert single_flight_key("produce_spot", {"a": 1}) != single_flight_key("produce_spot", {"a": 2})
+
+def test_concurrent_identical_calls_run_once():
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return "pyro_1"
+
+    results, errors = _run_in_threads(8, lambda: run_single_flight("produce_spot", {"user_id": "u"}, work))
+
+    assert results == ["pyro_1"] * 8
+    assert errors == [None] * 8
+    assert len(calls) == 1
+
+def test_followers_share_the_leaders_error():
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("Failed to upload the audio")
+
+    results, errors = _run_in_threads(4, lambda: run_single_flight("produce_spot", {"user_id": "u"}, work))
+
+    assert len(calls) == 1
+    assert all(str(error) == "Failed to upload the audio" for error in errors)
+
+def test_calls_after_the_work_finished_run_it_again():
+    calls = []
+
+    def work():
+        calls.append(1)
+        return f"pyro_{len(calls)}"
+
+    assert run_single_flight("stitch_sections", {"user_id": "u"}, work) == "pyro_1"
+    assert run_single_flight("stitch_sections", {"user_id": "u"}, work) == "pyro_2"
+    assert run_single_flight("stitch_sections", {"user_id": "other"}, work) == "pyro_3"
+
+def _count_and_sleep(counter_path):
+    with open(counter_path, "a") as counter:
+        counter.write("x")
+    time.sleep(0.5)
+    return "pyro_shared"
+
+def _call_in_process(counter_path, cache_dir, lock_dir, results):
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", cache_dir), \
+            patch.object(single_flight.config, "SINGLE_FLIGHT_LOCK_DIR", lock_dir):
+        results.put(run_single_flight("produce_spot", {"user_id": "u"}, lambda: _count_and_sleep(counter_path)))
+
+def test_identical_calls_in_other_processes_wait_for_the_leaders_result(isolated_dirs):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    counter_path = str(isolated_dirs / "counter")
+    processes = [context.Process(target=_call_in_process, args=(counter_path, str(isolated_dirs / "cache"),
+                                                               str(isolated_dirs / "locks"), results))
+                 for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=10)
+
+    assert sorted(results.get(timeout=1) for _ in processes) == ["pyro_shared"] * 3
+    with open(counter_path) as counter:
+        assert counter.read() == "x"
+
+def test_async_identical_calls_run_once():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return "pyro_async"
+
+    async def call_many():
+        return await asyncio.gather(*[single_flight_async("produce_spot", {"user_id": "u"}, work) for _ in range(10)])
+
+    assert asyncio.run(call_many()) == ["pyro_async"] * 10
+    assert len(calls) == 1
+
+def test_a_follower_runs_the_work_itself_when_the_leader_hangs(isolated_dirs):
+    key = single_flight_key("produce_spot", {"user_id": "u"})
+    hung_leader = single_flight._try_file_lock(key)  # Held as by a leader in another process that hung
+
+    try:
+        with patch.object(single_flight.config, "SINGLE_FLIGHT_LOCK_TIMEOUT", 0.3):
+            start = time.time()
+            result = run_single_flight("produce_spot", {"user_id": "u"}, lambda: "pyro_follower")
+            waited = time.time() - start
+    finally:
+        single_flight._release_file_lock(hung_leader)
+
+    assert result == "pyro_follower"
+    assert 0.3 <= waited < 2
+
+def test_async_followers_stop_waiting_for_a_hung_leader():
+    release_leader = asyncio.Event()
+
+    async def hung_work():
+        await release_leader.wait()
+        return "pyro_leader"
+
+    async def follower_work():
+        return "pyro_follower"
+
+    async def call_both():
+        leader = asyncio.ensure_future(single_flight_async("produce_spot", {"user_id": "u"}, hung_work))
+        await asyncio.sleep(0)
+        follower = await single_flight_async("produce_spot", {"user_id": "u"}, follower_work)
+        release_leader.set()
+        return await leader, follower
+
+    with patch.object(single_flight.config, "SINGLE_FLIGHT_LOCK_TIMEOUT", 0.3):
+        assert asyncio.run(call_both()) == ("pyro_leader", "pyro_follower")
+
+def test_a_slow_leader_without_followers_runs_the_work_once():
+    calls = []
+
+    async def slow_work():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return "pyro_slow"
+
+    with patch.object(single_flight.config, "SINGLE_FLIGHT_LOCK_TIMEOUT", 0.1):
+        assert asyncio.run(single_flight_async("produce_spot", {"user_id": "u"}, slow_work)) == "pyro_slow"
+    assert len(calls) == 1
+
+def test_shared_results_are_capped(isolated_dirs):
+    with patch.object(single_flight.config, "SINGLE_FLIGHT_RESULT_MAX_ENTRIES", 3):
+        for index in range(10):
+            assert run_single_flight("stitch_sections", {"user_id": index}, lambda: "pyro_1") == "pyro_1"
+
+    assert len(list((isolated_dirs / "cache" / single_flight.RESULT_NAMESPACE).glob("*.json"))) <= 3
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import fcntl
+import subprocess
+import pytest
+from unittest.mock import patch
+import startup
+from startup import start_scheduler, stop_scheduler, is_scheduler_leader, warm_up, start_warm_up
+
+
+@pytest.fixture
+def scheduler_lock(tmp_path):
+    lock_path = str(tmp_path / "locks" / "scheduler.lock")
+    with patch.object(startup.config, "SCHEDULER_LOCK_PATH", lock_path), \
+            patch.object(startup.config, "SCHEDULER_LEADER_RETRY", 0.1):
+        yield lock_path
+        stop_scheduler()
+
+@pytest.fixture
+def cold_process():
+    with patch.object(startup, "_ready", False), patch.object(startup, "_warm_up_thread", None):
+        yield
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+def test_only_the_lock_holder_runs_the_scheduled_jobs(scheduler_lock):
+    os.makedirs(os.path.dirname(scheduler_lock))
+    other_worker = open(scheduler_lock, "a")
+    fcntl.flock(other_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    start_scheduler()
+    assert not is_scheduler_leader()
+
+    other_worker.close()  # The leader exits
+    assert _wait_for(is_scheduler_leader)
+    assert [job.func.__name__ for job in startup._scheduler.get_jobs()] == ["collect_scratch_garbage", "fold_dead_snapshots"]
+
+    stop_scheduler()
+    with open(scheduler_lock, "a") as next_worker:
+        fcntl.flock(next_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)  # Handed over
+
+def test_warm_up_marks_the_process_ready_even_when_a_step_fails(cold_process):
+    steps = []
+    failing_steps = (("imports", lambda: steps.append("imports")),
+                     ("codecs", lambda: 1 / 0),
+                     ("music_library", lambda: steps.append("music_library")))
+    with patch.object(startup, "WARM_UP_STEPS", failing_steps), patch.object(startup.config, "WARM_UP_ENABLED", True):
+        warm_up()
+
+    assert steps == ["imports", "music_library"]
+    assert startup.is_ready()
+
+def test_ready_endpoint_answers_503_until_warmed_up(cold_process):
+    from flask_api import app
+    release = startup.threading.Event()
+    with patch.object(startup, "WARM_UP_STEPS", (("slow", lambda: release.wait(5)),)), \
+            patch.object(startup.config, "WARM_UP_ENABLED", True), \
+            app.test_client() as client:
+        assert client.get("/ready").status_code == 503
+        start_warm_up()  # Already running, not started twice
+        release.set()
+        assert _wait_for(startup.is_ready)
+        assert client.get("/ready").status_code == 200
+
+def test_importing_the_app_leaves_the_sdks_and_threads_for_later():
+    script = ("import sys, threading, flask_api; "
+              "print(sorted(m for m in ('elevenlabs', 'firebase_admin', 'boto3', 'apscheduler', 'celery') if m in sys.modules)); "
+              "print(threading.active_count())")
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split("\n")
+
+    assert output[0] == "[]"
+    assert output[1] == "1"
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from time_stretch import wsola_time_stretch, STRETCH_QUALITY_SETTINGS
+
+
+def _sine(frequency, seconds=2, sample_rate=44100, channels=2):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (8000 * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+@pytest.mark.parametrize("quality", list(STRETCH_QUALITY_SETTINGS))
+def test_wsola_time_stretch_at_unit_speed_reproduces_the_input(quality):
+    samples = _sine(220)
+
+    stretched = wsola_time_stretch(samples, 44100, 1.0, quality=quality)
+
+    assert stretched.shape == samples.shape
+    assert np.abs(stretched - samples).max() < 1
+
+@pytest.mark.parametrize("speed", [1.25, 1.5, 1.75, 2.0, 0.8])
+def test_wsola_time_stretch_changes_duration_but_not_pitch(speed):
+    samples = _sine(220)
+
+    stretched = wsola_time_stretch(samples, 44100, speed)
+
+    assert len(stretched) == round(len(samples) / speed)
+    spectrum = np.abs(np.fft.rfft(stretched[:, 0]))
+    assert np.argmax(spectrum) * 44100 / len(stretched) == pytest.approx(220, abs=1)
+    assert np.abs(stretched[4410:-4410]).max() == pytest.approx(8000, rel=0.02)
+
+def test_wsola_time_stretch_rejects_unknown_quality():
+    with pytest.raises(ValueError):
+        wsola_time_stretch(_sine(220), 44100, 1.5, quality="ultra")
@@ -1,35 +1,435 @@
+import io
 import os
+import time
+import shutil
+import numpy as np
 import pytest
 from unittest.mock import Mock, patch
-from utils import cleanup_workdir
+from pydub import AudioSegment
+from pydub.silence import detect_silence, split_on_silence
+from data_classes import PCMAudio
+from utils import audio_segment_to_pcm, pcm_to_audio_segment, stitch_audio_segments, append_pause, slice_audio_at_cutoff
+from utils import detect_silent_ranges, process_audio_to_remove_pauses, process_sections, process_and_stitch_sections, config
+from utils import generate_voiceover_from_history_item_id
+from utils import ensure_music_sidecar, load_music_pcm, music_sidecar_path, adjust_music_length_to_voiceover, export_pcm
+from utils import fit_music_to_duration, ensure_music_loudness_index, quantize_preview_volume
+from utils import mix_voice_with_music, stream_voice_music_mix
+from utils import get_s3_client, get_s3_transfer_config
+from utils import adjust_speech_rate, generate_voiceover_from_voice_id, decode_audio_stream_to_pcm
+from utils import generate_sharded_voiceover, plan_voiceover_shards, stitch_voiceover_shards, moodify_script, silent_pcm
+import utils
+import audio_cache
+
+def _tone(duration_ms, sample_rate=44100, frequency=440, amplitude=8000, channels=1):
+    frames = int(sample_rate * duration_ms / 1000)
+    wave = amplitude * np.sin(2 * np.pi * frequency * np.arange(frames) / sample_rate)
+    samples = np.repeat(wave.astype(np.int16)[:, None], channels, axis=1)
+    return PCMAudio(samples=samples, sample_rate=sample_rate)
+
+def test_pcm_audio_segment_round_trip_preserves_samples():
+    pcm_audio = _tone(250, channels=2)
+    audio_segment = pcm_to_audio_segment(pcm_audio)
+
+    assert audio_segment.channels == 2
+    assert len(audio_segment) == pcm_audio.duration_ms
+    assert np.array_equal(audio_segment_to_pcm(audio_segment).samples, pcm_audio.samples)
+
+def test_stitch_audio_segments_concatenates_in_order():
+    first, second = _tone(100), _tone(200, frequency=880)
+
+    stitched = stitch_audio_segments([first, second])
+
+    assert stitched.frame_count == first.frame_count + second.frame_count
+    assert np.array_equal(stitched.samples[:first.frame_count], first.samples)
+    assert np.array_equal(stitched.samples[first.frame_count:], second.samples)
+
+def test_stitch_audio_segments_matches_mixed_formats_like_pydub():
+    mono_low_rate, stereo = _tone(100, sample_rate=22050), _tone(100, channels=2)
+
+    stitched = stitch_audio_segments([mono_low_rate, stereo])
+    expected = pcm_to_audio_segment(mono_low_rate) + pcm_to_audio_segment(stereo)
+
+    assert (stitched.sample_rate, stitched.channels) == (44100, 2)
+    assert np.array_equal(stitched.samples, audio_segment_to_pcm(expected).samples)
+
+def test_append_pause_adds_trailing_silence():
+    voiceover = _tone(300)
+
+    with_pause = append_pause(voiceover, duration=500)
+
+    assert with_pause.duration_ms == 800
+    assert not with_pause.samples[voiceover.frame_count:].any()
+
+def test_slice_audio_at_cutoff_returns_a_view():
+    voiceover = _tone(3000)
+
+    sliced = slice_audio_at_cutoff(voiceover, 2000)
+
+    assert sliced.duration_ms == 1000
+    assert np.shares_memory(sliced.samples, voiceover.samples)
+    assert np.array_equal(sliced.samples, audio_segment_to_pcm(pcm_to_audio_segment(voiceover)[2000:]).samples)
+
+def _speech_like(seed, sample_rate=44100, channels=1, bursts=8):
+    """Alternate noise bursts with near-silent gaps of random lengths, like a voiceover with pauses."""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    for _ in range(bursts):
+        burst_frames = int(sample_rate * rng.uniform(0.05, 0.6))
+        gap_frames = int(sample_rate * rng.uniform(0.0, 0.4))
+        pieces.append(rng.normal(0, rng.uniform(500, 6000), (burst_frames, channels)))
+        pieces.append(rng.normal(0, rng.uniform(0, 200), (gap_frames, channels)))
+    samples = np.clip(np.concatenate(pieces), -32768, 32767).astype(np.int16)
+    return PCMAudio(samples=samples, sample_rate=sample_rate)
+
+@pytest.mark.parametrize("seed, sample_rate, channels", [
+    (0, 44100, 1), (1, 44100, 2), (2, 22050, 1), (3, 48000, 1), (4, 16000, 2), (5, 11025, 1),
+])
+@pytest.mark.parametrize("threshold_db, min_silence_duration", [(-40, 100), (-30, 50), (-50, 250)])
+def test_process_audio_to_remove_pauses_matches_split_on_silence(seed, sample_rate, channels, threshold_db, min_silence_duration):
+    voiceover = _speech_like(seed, sample_rate, channels)
+    audio_segment = pcm_to_audio_segment(voiceover)
+
+    expected_chunks = split_on_silence(audio_segment, min_silence_len=min_silence_duration, silence_thresh=threshold_db)
+    expected = sum(expected_chunks, AudioSegment.empty())
+    result = process_audio_to_remove_pauses(voiceover, threshold_db, min_silence_duration)
+
+    assert detect_silent_ranges(voiceover, min_silence_duration, threshold_db) == \
+        detect_silence(audio_segment, min_silence_duration, threshold_db)
+    assert np.array_equal(result.samples, audio_segment_to_pcm(expected).samples)
+
+@pytest.mark.parametrize("voiceover", [
+    PCMAudio(samples=np.zeros((44100, 1), dtype=np.int16), sample_rate=44100),
+    PCMAudio(samples=np.zeros((2205, 1), dtype=np.int16), sample_rate=44100),
+    _tone(1000),
+])
+def test_process_audio_to_remove_pauses_edge_cases_match_split_on_silence(voiceover):
+    expected = sum(split_on_silence(pcm_to_audio_segment(voiceover), min_silence_len=100, silence_thresh=-40), AudioSegment.empty())
+
+    result = process_audio_to_remove_pauses(voiceover)
+
+    assert result.frame_count == int(expected.frame_count())
+    assert np.array_equal(result.samples.ravel(), np.frombuffer(expected.raw_data, dtype=np.int16))
+
+def _fake_section_fetch(history_item_id):
+    # Later sections come back first so ordering bugs would show up
+    import time
+    index = int(history_item_id.split("_")[1])
+    time.sleep(0.05 * (4 - index))
+    return _tone(200 + 100 * index)
+
+@pytest.fixture
+def section_cache(tmp_path):
+    """An empty cache for the processed sections, switched by calling it with a new name."""
+    def use_cache(name):
+        audio_cache.clear_memory_cache()
+        patcher = patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path / name))
+        patcher.start()
+        patchers.append(patcher)
+    patchers = []
+    use_cache("cache")
+    yield use_cache
+    for patcher in reversed(patchers):
+        patcher.stop()
+    audio_cache.clear_memory_cache()
+
+@pytest.mark.parametrize("process_workers", [0, 2])
+def test_process_sections_keeps_original_order(process_workers, section_cache):
+    history_item_id_list = [f"section_{index}" for index in range(4)]
+    with patch("utils.generate_voiceover_from_history_item_id", side_effect=_fake_section_fetch), \
+            patch.object(config, "SECTION_PROCESS_WORKERS", process_workers):
+        concurrent_sections = process_sections(history_item_id_list, [100] * 4, max_concurrency=4)
+        section_cache("serial")
+        serial_sections = process_sections(history_item_id_list, [100] * 4, serial=True)
+
+    assert [section.duration_ms for section in concurrent_sections] == [300, 400, 500, 600]
+    for concurrent_section, serial_section in zip(concurrent_sections, serial_sections):
+        assert np.array_equal(concurrent_section.samples, serial_section.samples)
+
+def test_process_and_stitch_sections_only_processes_what_changed(section_cache):
+    import metrics
+    fetched = []
+
+    def fetch(history_item_id):
+        fetched.append(history_item_id)
+        return _tone(100 * int(history_item_id.split("_")[1]))
+
+    def render(history_item_id_list):
+        return process_and_stitch_sections(history_item_id_list, [100] * len(history_item_id_list))
+
+    with patch("utils.generate_voiceover_from_history_item_id", side_effect=fetch), \
+            patch.object(config, "SECTION_PROCESS_WORKERS", 0), \
+            patch.dict(metrics._counter_stats, clear=True):
+        first = render(["section_1", "section_2", "section_3"])
+        assert render(["section_1", "section_2", "section_3"]) is first  # The whole chain is cached
+        edited = render(["section_1", "section_5", "section_3"])
+        appended = render(["section_1", "section_5", "section_3", "section_4"])
+        counters = {counter["labels"]["result"]: counter["value"] for counter in metrics._counter_stats.values()}
+
+    assert fetched == ["section_1", "section_2", "section_3", "section_5", "section_4"]
+    assert [first.duration_ms, edited.duration_ms, appended.duration_ms] == [900, 1200, 1700]
+    expected = stitch_audio_segments([append_pause(process_audio_to_remove_pauses(_tone(100 * index)), 100)
+                                      for index in (1, 5, 3, 4)])
+    assert np.array_equal(appended.samples, expected.samples)
+    # Sections from the stitched prefixes, the memoized sections and the processed sections
+    assert counters == {"prefix": 3 + 3, "hit": 2, "miss": 3 + 1 + 1}
+
+def test_process_sections_raises_when_a_section_cannot_be_fetched():
+    with patch("utils.generate_voiceover_from_history_item_id", return_value=None):
+        with pytest.raises(ValueError):
+            process_sections(["missing_0", "missing_1"], [0, 0], max_concurrency=2)
+
+def test_generate_voiceover_from_history_item_id_downloads_each_item_once(tmp_path):
+    audio_cache.clear_memory_cache()
+    with patch.object(audio_cache.config, "AUDIO_CACHE_DIR", str(tmp_path)), \
+            patch("utils._fetch_voiceover_from_history_item_id", return_value=_tone(500)) as fetch:
+        first = generate_voiceover_from_history_item_id("pyro_1234567")
+        audio_cache.clear_memory_cache()
+        second = generate_voiceover_from_history_item_id("pyro_1234567")
+
+    fetch.assert_called_once_with("pyro_1234567")
+    assert np.array_equal(first.samples, second.samples)
+    audio_cache.clear_memory_cache()
+
+def test_ensure_music_sidecar_writes_a_normalized_memory_mappable_track(tmp_path):
+    music_file_path = str(tmp_path / "Good Vibe.wav")
+    export_pcm(_tone(1000, sample_rate=22050), music_file_path, format="wav")
+
+    ensure_music_sidecar(music_file_path)
+    music = load_music_pcm(music_file_path)
+
+    assert os.path.exists(music_sidecar_path(music_file_path))
+    assert isinstance(music.samples, np.memmap)
+    assert (music.sample_rate, music.channels, music.sample_width) == (44100, 2, 2)
+    assert music.duration_ms == 1000
+
+def test_load_music_pcm_decodes_when_there_is_no_sidecar(tmp_path):
+    music_file_path = str(tmp_path / "Happy Day.wav")
+    export_pcm(_tone(500), music_file_path, format="wav")
+
+    music = load_music_pcm(music_file_path)
+
+    assert not isinstance(music.samples, np.memmap)
+    assert music.duration_ms == 500
+
+def test_adjust_music_length_to_voiceover_loops_and_trims_music(tmp_path):
+    music_file_path, voiceover_path, output_path = (str(tmp_path / name) for name in ("music.wav", "voice.wav", "out.wav"))
+    export_pcm(_tone(400, frequency=220), music_file_path, format="wav")
+    export_pcm(_tone(1000), voiceover_path, format="wav")
+    ensure_music_sidecar(music_file_path)
+
+    adjust_music_length_to_voiceover(music_file_path, voiceover_path, output_path)
+    adjusted_music = audio_segment_to_pcm(AudioSegment.from_file(output_path, format="wav"))
+
+    music = load_music_pcm(music_file_path)
+    assert adjusted_music.duration_ms == 1000
+    assert np.array_equal(adjusted_music.samples[music.frame_count:2 * music.frame_count], music.samples)
+
+def test_fit_music_to_duration_trims_to_a_view_of_the_sidecar(tmp_path):
+    music_file_path = str(tmp_path / "music.wav")
+    export_pcm(_tone(1000, frequency=220), music_file_path, format="wav")
+    ensure_music_sidecar(music_file_path)
+    music = load_music_pcm(music_file_path)
+
+    trimmed = fit_music_to_duration(music, 250)
+    looped = fit_music_to_duration(music, 2500)
+
+    assert trimmed.duration_ms == 250 and np.shares_memory(trimmed.samples, music.samples)
+    assert looped.duration_ms == 2500
+    assert np.array_equal(looped.samples[music.frame_count:2 * music.frame_count], music.samples)
+
+def test_loudness_index_measures_the_sidecar_once(tmp_path):
+    music_file_path = str(tmp_path / "preview.wav")
+    samples = np.zeros((44100, 2), dtype=np.int16)
+    samples[4410:8820] = 16384
+    samples[4410:8820:2] = -16384
+    export_pcm(PCMAudio(samples=samples, sample_rate=44100), music_file_path, format="wav")
+
+    index = ensure_music_loudness_index(music_file_path)
+
+    assert index["peak_dbfs"] == pytest.approx(-6.02, abs=0.01)
+    assert index["rms_dbfs"] == pytest.approx(-6.02 - 10, abs=0.01)  # Loud for a tenth of the track
+    assert index["envelope"][:3] == [0, 16384, 0] and len(index["envelope"]) == 10
+    with patch("utils.read_pcm_file") as read:
+        assert ensure_music_loudness_index(music_file_path) == index
+    read.assert_not_called()
+
+def test_quantize_preview_volume_snaps_to_the_cached_steps():
+    assert quantize_preview_volume(0.51) == 0.5
+    assert quantize_preview_volume(0.026) == 0.05
+    assert quantize_preview_volume(1) == 1.0
+    with pytest.raises(ValueError):
+        quantize_preview_volume(1.2)
+
+def _pydub_voice_music_mix(voice_audio, music_audio, ad_length, music_vol):
+    """The PyDub mixing steps of the original voice_music_mixer, without the MP3 export."""
+    voice_audio, music_audio = pcm_to_audio_segment(voice_audio), pcm_to_audio_segment(music_audio)
+    target_length_ms = int(ad_length * 1000)
+    voice_audio = voice_audio + AudioSegment.silent(duration=target_length_ms - len(voice_audio))
+    music_audio = music_audio[:target_length_ms]
+    music_audio = music_audio + (music_vol * 30 - 30)
+    music_audio = music_audio.fade_in(5000).fade_out(5000)
+    return audio_segment_to_pcm(voice_audio.overlay(music_audio))
+
+@pytest.mark.parametrize("music_vol", [0.1, 0.5, 1.0])
+def test_mix_voice_with_music_matches_the_pydub_mixer(music_vol):
+    voiceover = _speech_like(11, bursts=20)
+    music = _speech_like(12, channels=2, bursts=40)
+    ad_length = 12
+
+    expected = _pydub_voice_music_mix(voiceover, music, ad_length, music_vol)
+    mixed = mix_voice_with_music(voiceover, music, ad_length, music_vol)
+
+    assert (mixed.sample_rate, mixed.channels) == (44100, 2)
+    assert mixed.duration_ms == ad_length * 1000
+    frames = min(mixed.frame_count, expected.frame_count)
+    assert abs(mixed.frame_count - expected.frame_count) <= 4
+    assert np.array_equal(mixed.samples[:frames], expected.samples[:frames])
+
+def test_stream_voice_music_mix_loops_music_in_fixed_size_blocks():
+    voiceover = _tone(12000, amplitude=0)
+    music = _tone(700, frequency=220, channels=2)
+
+    blocks = list(stream_voice_music_mix(voiceover, music, 12, 1.0, loop_music=True, block_frames=10000))
+    mixed = np.concatenate(blocks)
+
+    assert [len(block) for block in blocks[:-1]] == [10000] * (len(blocks) - 1)
+    assert len(mixed) == 12 * 44100
+    # Between the fades the looped music comes through untouched
+    loop_start = 8 * music.frame_count
+    assert np.array_equal(mixed[loop_start:loop_start + music.frame_count], music.samples)
+
+def test_mix_voice_with_music_pads_short_music_with_silence():
+    mixed = mix_voice_with_music(_tone(1000, amplitude=0), _tone(500, channels=2), 2, 1.0)
+
+    assert mixed.duration_ms == 2000
+    assert not mixed.samples[_tone(500).frame_count:].any()
+
+
+def test_get_s3_client_is_built_once_per_process_for_the_configured_endpoint():
+    with patch.object(utils, "_s3_client", None), \
+            patch.object(config, "S3_ENDPOINT_URL", "http://localhost:9000"), \
+            patch.object(config, "S3_MAX_POOL_CONNECTIONS", 7):
+        s3_client = get_s3_client()
+
+        assert get_s3_client() is s3_client
+        assert s3_client.meta.endpoint_url == "http://localhost:9000"
+        assert s3_client.meta.config.max_pool_connections == 7
+
+        with patch.object(utils, "_s3_client_pid", -1):
+            assert get_s3_client() is not s3_client
+
+def test_download_audio_from_s3_uses_ranged_transfers():
+    s3_client = Mock()
+    s3_client.download_fileobj.side_effect = lambda bucket, key, buffer, Config: buffer.write(b"mp3 bytes")
+    with patch("utils.get_s3_client", return_value=s3_client), \
+            patch("utils.decode_audio_to_pcm", return_value=_tone(100)) as decode:
+        audio = utils._download_audio_from_s3("bucket", "key")
+
+    assert audio.duration_ms == 100
+    assert s3_client.download_fileobj.call_args.kwargs["Config"] is get_s3_transfer_config()
+    decode.assert_called_once_with(b"mp3 bytes", format="mp3")
+
+def test_upload_audio_segment_to_s3_scales_wider_samples_to_16_bits():
+    wide = _tone(100, amplitude=8000)
+    wide = PCMAudio(samples=wide.samples.astype(np.int32) << 16, sample_rate=wide.sample_rate)
+    with patch("utils.upload_pcm_blocks_to_s3", return_value=True) as upload:
+        assert utils.upload_audio_segment_to_s3(wide, "bucket", "key")
+
+    uploaded = np.concatenate(list(upload.call_args.args[0]))
+    assert uploaded.dtype == np.int16
+    assert np.array_equal(uploaded, _tone(100, amplitude=8000).samples)
+
+
+def test_adjust_speech_rate_stretches_in_process_by_default():
+    audio = _tone(2000)
+
+    with patch("utils.subprocess.run") as run:
+        faster = adjust_speech_rate(audio, 25)
+
+    run.assert_not_called()
+    assert faster.samples.dtype == audio.samples.dtype
+    assert faster.sample_rate == audio.sample_rate
+    assert faster.duration_ms == 1600
+
+def test_adjust_speech_rate_can_fall_back_to_soundstretch():
+    with patch("utils._adjust_speech_rate_with_soundstretch", return_value=_tone(1600)) as soundstretch:
+        adjust_speech_rate(_tone(2000), 25, engine="soundstretch")
+
+    soundstretch.assert_called_once()
+
+
+@pytest.mark.skipif(shutil.which(AudioSegment.converter) is None, reason="ffmpeg is not installed")
+def test_generate_voiceover_from_voice_id_decodes_the_streamed_chunks():
+    buffer = io.BytesIO()
+    export_pcm(_tone(1500), buffer, format="mp3")
+    encoded = buffer.getvalue()
+    chunks = [encoded[start:start + 512] for start in range(0, len(encoded), 512)]
+
+    with patch("utils.get_elevenlabs_client", return_value=Mock(generate=Mock(return_value=iter(chunks)))):
+        voiceover = generate_voiceover_from_voice_id("Hello", "voice-1", "eleven_multilingual_v2")
+
+    assert voiceover.duration_ms == pytest.approx(1500, abs=60)
+    assert np.array_equal(voiceover.samples, decode_audio_stream_to_pcm([encoded]).samples)
+
+
+def _fake_tts(latency, failures=None):
+    """Stands in for utils.synthesize_voiceover: `latency` seconds per take, 50 ms of speech per character
+    between 200 ms of silence. Texts in `failures` fail that many times first."""
+    failures = dict(failures or {})
+    def synthesize(text_input, *args):
+        time.sleep(latency)
+        if failures.get(text_input):
+            failures[text_input] -= 1
+            raise RuntimeError("upstream error")
+        return stitch_audio_segments([silent_pcm(200), _tone(50 * len(text_input)), silent_pcm(200)])
+    return synthesize
 
 @pytest.fixture
-def workdir():
-    # Setup: create directory and file
-    os.makedirs('data/workdir', exist_ok=True)
-    test_file = 'data/workdir/test_file.txt'
-    with open(test_file, 'w') as f:
-        f.write('Test content')
-    
-    # Provide the test file path to the test function.
-    yield test_file
-
-    # Cleanup: remove file and directory
-    if os.path.exists(test_file):
-        os.remove(test_file)
-    if os.path.exists('data/workdir'):
-        os.rmdir('data/workdir')
-
-# Define the test function
-def test_if_cleanup_workdir_empty_the_working_directory(workdir):
-    test_file = workdir
-    # Assert that the file exists
-    assert os.path.exists(test_file)
-
-    # Execute cleanup
-    cleanup_workdir()
-
-    # Assert the file is deleted
-    assert not os.path.exists(test_file)
+def sharding():
+    with patch.object(utils.config, "SYNTHESIS_SHARD_MAX_CHARS", 20), \
+            patch.object(utils.config, "SYNTHESIS_SHARD_CONCURRENCY", 4), \
+            patch.object(utils.config, "SYNTHESIS_SHARD_RETRY_DELAY", 0), \
+            patch.object(utils.config, "SYNTHESIS_SENTENCE_PAUSE", 300), \
+            patch.object(utils.config, "SYNTHESIS_PARAGRAPH_PAUSE", 700):
+        yield
+
+def test_sharded_synthesis_takes_about_as_long_as_the_slowest_shard(sharding):
+    script = "First sentence here. Second one is here.\n\nThird comes now. And the fourth."
+
+    with patch("utils.synthesize_voiceover", side_effect=_fake_tts(0.3)) as synthesize:
+        start = time.monotonic()
+        voiceover = generate_sharded_voiceover(script, "voice-1", "eleven_multilingual_v2")
+        elapsed = time.monotonic() - start
+
+    shard_texts = [call.args[0] for call in synthesize.call_args_list]
+    assert sorted(shard_texts) == sorted(["First sentence here.", "Second one is here.", "Third comes now.", "And the fourth."])
+    assert elapsed < 0.6  # 1.2 s one shard after another
+    # Outer silences kept, inner ones replaced by the sentence, paragraph and sentence pauses
+    speech_ms = 50 * sum(len(text) for text in shard_texts)
+    assert voiceover.duration_ms == pytest.approx(200 + speech_ms + 300 + 700 + 300 + 200, abs=40)
+
+def test_a_failed_shard_is_retried_on_its_own(sharding):
+    script = "First sentence here. Second one is here."
+
+    with patch("utils.synthesize_voiceover", side_effect=_fake_tts(0, {"Second one is here.": 2})) as synthesize:
+        voiceover = generate_sharded_voiceover(script, "voice-1", "eleven_multilingual_v2")
+    assert [call.args[0] for call in synthesize.call_args_list].count("First sentence here.") == 1
+    assert [call.args[0] for call in synthesize.call_args_list].count("Second one is here.") == 3
+    assert voiceover is not None
+
+    with patch("utils.synthesize_voiceover", side_effect=_fake_tts(0, {"Second one is here.": 3})):
+        assert generate_sharded_voiceover(script, "voice-1", "eleven_multilingual_v2") is None
+
+def test_every_shard_of_a_moodified_script_is_spoken_after_the_mood_phrase(sharding):
+    shards, mood_phrase_in_every_shard = plan_voiceover_shards(moodify_script("First sentence here. Second one is here.",
+                                                                              "female", "calmly"))
+
+    assert mood_phrase_in_every_shard
+    assert [shard.text for shard in shards] == ['She said calmly <break time="0.8s" /> "First sentence here."',
+                                                'She said calmly <break time="0.8s" /> "Second one is here."']
 
+    # Only the first shard keeps its mood phrase, which render_preprocessed_voiceover cuts off the take
+    with patch.object(utils.config, "MOOD_INTERVAL", 2000):
+        voiceover = stitch_voiceover_shards([_tone(3000), _tone(2500)], shards, mood_phrase_in_every_shard)
+    assert voiceover.duration_ms == 3000 + 300 + 500
 
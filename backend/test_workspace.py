@@ -0,0 +1,79 @@
+import os
+import time
+import subprocess
+import pytest
+from unittest.mock import patch
+import workspace
+from workspace import scratch_workspace, workspace_path, check_workspace_quota, collect_scratch_garbage
+
+
+@pytest.fixture(autouse=True)
+def scratch_dir(tmp_path):
+    root = str(tmp_path / "scratch")
+    with patch.object(workspace.config, "SCRATCH_DIR", root), \
+            patch.object(workspace.config, "SCRATCH_WORKSPACE_MAX_BYTES", 1000), \
+            patch.object(workspace.config, "SCRATCH_MAX_BYTES", 1500), \
+            patch.object(workspace.config, "SCRATCH_MAX_AGE", 3600):
+        yield root
+
+def _write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+
+def _dead_pid():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+def test_each_workspace_gets_its_own_directory_removed_on_exit(scratch_dir):
+    with scratch_workspace("speech_rate") as first, scratch_workspace("speech_rate") as second:
+        assert first.directory != second.directory
+        _write(workspace_path(first, "original.wav"), 10)
+        assert os.path.dirname(first.directory) == scratch_dir
+
+    with pytest.raises(ValueError):
+        with scratch_workspace("speech_rate") as failing:
+            raise ValueError("soundstretch failed")
+
+    for directory in (first.directory, second.directory, failing.directory):
+        assert not os.path.exists(directory)
+
+def test_a_workspace_over_its_quota_is_refused():
+    with pytest.raises(RuntimeError):
+        with scratch_workspace("speech_rate", expected_bytes=1001):
+            pass
+
+    with scratch_workspace("speech_rate") as workspace_:
+        _write(workspace_path(workspace_, "stretched.wav"), 1001)
+        with pytest.raises(RuntimeError):
+            check_workspace_quota(workspace_)
+
+def test_reservations_count_against_the_host_quota():
+    with scratch_workspace("speech_rate", expected_bytes=1000):
+        with pytest.raises(RuntimeError):
+            with scratch_workspace("speech_rate", expected_bytes=600):
+                pass
+        with scratch_workspace("speech_rate", expected_bytes=400):
+            pass
+    with scratch_workspace("speech_rate", expected_bytes=1000):
+        pass  # Released on exit
+
+def test_janitor_removes_what_dead_or_stale_requests_left(scratch_dir):
+    os.makedirs(scratch_dir)
+    live = os.path.join(scratch_dir, f"speech_rate-{os.getpid()}-live")
+    dead = os.path.join(scratch_dir, f"speech_rate-{_dead_pid()}-dead")
+    stale = os.path.join(scratch_dir, f"speech_rate-{os.getpid()}-stale")
+    legacy_file = os.path.join(scratch_dir, "voiceover.wav")
+    for directory in (live, dead, stale):
+        os.makedirs(directory)
+        _write(os.path.join(directory, "original.wav"), 100)
+    _write(legacy_file, 100)
+    an_hour_ago = time.time() - 3601
+    os.utime(stale, (an_hour_ago, an_hour_ago))
+
+    assert collect_scratch_garbage() == 200
+    assert sorted(os.listdir(scratch_dir)) == sorted([".lock", os.path.basename(live), "voiceover.wav"])
+
+    with patch.object(workspace.config, "SCRATCH_MAX_BYTES", 150):
+        collect_scratch_garbage()  # Over quota: the oldest file goes, the live workspace stays
+    assert sorted(os.listdir(scratch_dir)) == sorted([".lock", os.path.basename(live)])
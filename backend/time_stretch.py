@@ -0,0 +1,87 @@
+# Relative path: time_stretch.py
+"""
+In-process time stretching (tempo change without pitch change) of in-memory PCM with WSOLA
+(waveform similarity overlap-add).
+
+Output frames are Hann windowed slices of the input, overlap-added at a fixed synthesis hop. Each
+slice is taken near its nominal position (output position * speed), shifted within a search
+tolerance to the offset that best continues the previously copied slice, which keeps pitch and
+avoids phasing. The offset is chosen on a mono mix and applied to every channel.
+"""
+import numpy as np
+
+# window (ms), search tolerance (ms), decimation of the signal used for the similarity search
+STRETCH_QUALITY_SETTINGS = {
+    "fast": (30, 8, 4),
+    "balanced": (40, 12, 2),
+    "high": (50, 15, 1),
+}
+
+
+def _best_offset(template, region):
+    """
+    Index of the slice of `region` (len(template) long) most similar to `template`,
+    by cross-correlation normalized by the slice energy.
+    """
+    candidates = len(region) - len(template) + 1
+    fft_size = 1 << (len(region) + len(template) - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(region, fft_size) * np.conj(np.fft.rfft(template, fft_size)),
+                               fft_size)[:candidates]
+    energy = np.concatenate(([0.0], np.cumsum(region.astype(np.float64) ** 2)))
+    slice_energy = energy[len(template):len(template) + candidates] - energy[:candidates]
+    return int(np.argmax(correlation / np.sqrt(slice_energy + 1e-9)))
+
+
+def wsola_time_stretch(samples, sample_rate, speed, quality="balanced"):
+    """
+    Change the tempo of audio by `speed` while keeping its pitch.
+
+    Parameters:
+    samples (np.ndarray): Samples shaped (frames, channels), any numeric dtype.
+    sample_rate (int): Frames per second.
+    speed (float): Tempo factor, 1.25 plays 25% faster and returns round(frames / 1.25) frames.
+    quality (str): One of STRETCH_QUALITY_SETTINGS, trading search precision for speed.
+
+    Returns:
+    np.ndarray: float32 samples shaped (round(frames / speed), channels).
+    """
+    if speed <= 0:
+        raise ValueError(f"speed must be positive, got {speed}")
+    if quality not in STRETCH_QUALITY_SETTINGS:
+        raise ValueError(f"Unknown quality {quality!r}, expected one of {list(STRETCH_QUALITY_SETTINGS)}")
+    window_ms, tolerance_ms, decimation = STRETCH_QUALITY_SETTINGS[quality]
+
+    frames, channels = samples.shape
+    output_frames = int(round(frames / speed))
+    synthesis_hop = max(decimation, int(sample_rate * window_ms / 2000) // decimation * decimation)
+    window_frames = 2 * synthesis_hop
+    analysis_hop = synthesis_hop * speed
+    tolerance = int(sample_rate * tolerance_ms / 1000) // decimation * decimation
+    # A periodic Hann window overlap-added at half its length sums to exactly one
+    window = np.hanning(window_frames + 1)[:-1].astype(np.float32)[:, None]
+
+    # Frame k is centred on output frame k * synthesis_hop. The leading padding lets the first
+    # window start before the audio so the first output frames get full gain.
+    synthesis_frames = output_frames // synthesis_hop + 2
+    front_padding = tolerance + synthesis_hop
+    padded_length = tolerance + int(np.ceil(synthesis_frames * analysis_hop)) + window_frames + 2 * tolerance + synthesis_hop
+    padded = np.zeros((max(padded_length, front_padding + frames), channels), dtype=np.float32)
+    padded[front_padding:front_padding + frames] = samples
+    analysis_signal = padded.mean(axis=1)[::decimation]
+
+    output = np.zeros((synthesis_frames * synthesis_hop + window_frames, channels), dtype=np.float32)
+    offset = 0
+    for k in range(synthesis_frames):
+        position = tolerance + int(round(k * analysis_hop)) + offset
+        output[k * synthesis_hop:k * synthesis_hop + window_frames] += padded[position:position + window_frames] * window
+
+        # Search the next slice around its nominal position for the best match with the
+        # natural continuation of this one
+        continuation = (position + synthesis_hop) // decimation
+        next_nominal = tolerance + int(round((k + 1) * analysis_hop))
+        search_start = (next_nominal - tolerance) // decimation
+        template = analysis_signal[continuation:continuation + window_frames // decimation]
+        region = analysis_signal[search_start:search_start + (window_frames + 2 * tolerance) // decimation]
+        offset = (search_start + _best_offset(template, region)) * decimation - next_nominal
+
+    return output[synthesis_hop:synthesis_hop + output_frames]
@@ -1,40 +1,60 @@
 import os
+import re
+import time
 import base64
 import json
-import firebase_admin
 from datetime import datetime
 import hashlib
 import subprocess
 import tempfile
 import math
+import multiprocessing
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from dotenv import load_dotenv
-from firebase_admin import credentials
 from flask import request, jsonify
 from functools import wraps
-from firebase_admin import firestore
-from tqdm import tqdm
-import requests
-from elevenlabs.client import ElevenLabs
-from elevenlabs.types import VoiceSettings
 
 
 from pydub import AudioSegment
-from pydub.silence import split_on_silence
 import io
-import boto3
+import numpy as np
 
 from config import Config
+from data_classes import PCMAudio, ScriptShard
+from audio_cache import get_cached_audio, put_cached_audio, write_pcm_file, read_pcm_file
+from time_stretch import wsola_time_stretch
+from music_library import sync_library
+from workspace import scratch_workspace, workspace_path, check_workspace_quota
+from script_shards import split_script
+from metrics import stage, timed_iteration, increment_counter
+from audio_stream import pcm_blocks, stream_encode_pcm, stream_decode_audio, upload_stream_to_s3, S3_MIN_PART_BYTES
 
 config = Config()
 
 load_dotenv()
 
-client = ElevenLabs(
-  api_key=config.ELEVENLABS_API_KEY,
-)
+# The ElevenLabs, Firebase and boto3 SDKs take most of the import time of the app, they are
+# imported on first use (or by startup.warm_up) so that workers boot fast
+_elevenlabs_client = None
+_elevenlabs_client_pid = None
+_elevenlabs_client_lock = threading.Lock()
+
+def get_elevenlabs_client():
+    """Return the ElevenLabs client of this process, creating it on first use and again after a fork."""
+    global _elevenlabs_client, _elevenlabs_client_pid
+    with _elevenlabs_client_lock:
+        if _elevenlabs_client is None or _elevenlabs_client_pid != os.getpid():
+            from elevenlabs.client import ElevenLabs
+            _elevenlabs_client = ElevenLabs(api_key=config.ELEVENLABS_API_KEY)
+            _elevenlabs_client_pid = os.getpid()
+        return _elevenlabs_client
 
 def initialize_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
     if not config.FIREBASE_SERVICE_KEY:
         raise ValueError("Firebase service key not found in environment variables")
     if not firebase_admin._apps:
@@ -46,31 +66,182 @@ def initialize_firebase():
         cred = credentials.Certificate(service_account_info)
         firebase_admin.initialize_app(cred)
 
-def adjust_music_length_to_voiceover(music_path, voiceover_path, output_music_path):
-    music = AudioSegment.from_file(music_path)
-    voiceover = AudioSegment.from_file(voiceover_path)
+MUSIC_SIDECAR_SAMPLE_RATE = 44100
+MUSIC_SIDECAR_CHANNELS = 2
 
-    voiceover_duration = len(voiceover)
-    music_duration = len(music)
+def music_sidecar_path(music_file_path):
+    return f"{music_file_path}.pcm"
+
+def ensure_music_sidecar(music_file_path):
+    """
+    Decode a library track once into a raw PCM sidecar (44.1 kHz, stereo, 16 bit) next to it.
+    Sidecars are memory-mapped by the mixers, so every worker shares them through the page cache.
+    Does nothing when an up to date sidecar already exists.
+    """
+    sidecar_path = music_sidecar_path(music_file_path)
+    if os.path.exists(sidecar_path) and os.path.getmtime(sidecar_path) >= os.path.getmtime(music_file_path):
+        return sidecar_path
+
+    with stage("music_sidecar") as measured:
+        music = AudioSegment.from_file(music_file_path)
+        music = music.set_frame_rate(MUSIC_SIDECAR_SAMPLE_RATE).set_channels(MUSIC_SIDECAR_CHANNELS).set_sample_width(2)
+        write_pcm_file(sidecar_path, audio_segment_to_pcm(music))
+        measured["bytes"] = len(music.raw_data)
+    print(f"Wrote PCM sidecar {sidecar_path}")
+    return sidecar_path
+
+def load_music_pcm(music_file_path):
+    """
+    Load a music file as PCMAudio, memory-mapping its PCM sidecar when there is an up to date one
+    so that only the samples actually used are read. Falls back to decoding the file.
+    """
+    sidecar_path = music_sidecar_path(music_file_path)
+    if os.path.exists(sidecar_path) and os.path.getmtime(sidecar_path) >= os.path.getmtime(music_file_path):
+        try:
+            return read_pcm_file(sidecar_path)
+        except ValueError as e:
+            print(f"Ignoring broken sidecar {sidecar_path}. Error: {e}")
+    return audio_segment_to_pcm(AudioSegment.from_file(music_file_path))
+
+def fit_music_to_duration(music_audio, duration_ms):
+    """
+    Loop or trim music to `duration_ms` milliseconds without touching the disk.
+    Trimming returns a view, so only the frames used are read from a memory-mapped sidecar.
+    """
+    target_frames = _ms_to_frames(music_audio, duration_ms)
 
-    if music_duration < voiceover_duration:
+    if music_audio.frame_count < target_frames:
         # Loop the music to match the voiceover duration
-        repeat_times = math.ceil(voiceover_duration / music_duration)
-        adjusted_music = music * repeat_times # This might not be the best but this event is highly unlikely to happen.
+        repeat_times = math.ceil(target_frames / music_audio.frame_count)
+        adjusted_samples = np.tile(music_audio.samples, (repeat_times, 1)) # This might not be the best but this event is highly unlikely to happen.
     else:
-        adjusted_music = music
+        adjusted_samples = music_audio.samples
 
-    # Trim the music to match the voiceover duration
-    adjusted_music = adjusted_music[:voiceover_duration]
+    return PCMAudio(samples=adjusted_samples[:target_frames], sample_rate=music_audio.sample_rate)
+
+def adjust_music_length_to_voiceover(music_path, voiceover_path, output_music_path):
+    """File based wrapper around fit_music_to_duration, writing the adjusted music as WAV."""
+    voiceover = AudioSegment.from_file(voiceover_path)
+    adjusted_music = fit_music_to_duration(load_music_pcm(music_path), len(voiceover))
 
     # Export the adjusted music
-    adjusted_music.export(output_music_path, format="wav")
+    export_pcm(adjusted_music, output_music_path, format="wav")
+
+
+MIX_BLOCK_FRAMES = 44100  # Frames produced per block by stream_voice_music_mix
+FADE_SILENCE_GAIN = 10 ** (-120 / 20)  # -120 dB, where PyDub fades start and end
 
+def _fade_gains(frame_indices, boundaries, fade_start_ms, fade_duration_ms, from_gain, to_gain):
+    """
+    Gain of each frame inside a fade. Like PyDub fades longer than 100 ms, the gain is stepped
+    once per millisecond and moves linearly in amplitude.
+    """
+    milliseconds = np.searchsorted(boundaries, frame_indices, side="right") - 1
+    scale_step = (to_gain - from_gain) / fade_duration_ms
+    return from_gain + scale_step * (milliseconds - fade_start_ms)
+
+def _apply_gain(samples, gains):
+    # audioop.mul semantics: scale, clip to the sample range, then floor
+    return np.floor(np.clip(samples * gains, -32768, 32767))
+
+def _music_block(music_samples, start_frame, end_frame, loop_music):
+    if loop_music and len(music_samples):
+        return music_samples[np.arange(start_frame, end_frame) % len(music_samples)]
+    block = np.zeros((end_frame - start_frame, music_samples.shape[1]), dtype=music_samples.dtype)
+    available = music_samples[start_frame:min(end_frame, len(music_samples))]
+    block[:len(available)] = available
+    return block
+
+def stream_voice_music_mix(voice_audio, music_audio, ad_length, music_vol, loop_music=False,
+                           fade_in_duration=5000, fade_out_duration=5000, block_frames=MIX_BLOCK_FRAMES):
+    """
+    Mix a voiceover with background music in a single pass, yielding the result in fixed-size blocks.
+
+    Music is looped (or padded with silence), trimmed to the ad length, turned down by
+    `music_vol * 30 - 30` dB, faded in and out and overlaid on the voiceover block by block, so only
+    one block of each input is being worked on at a time. A memory-mapped music sidecar is
+    therefore only read as far as the ad goes. Matches the PyDub gain, fade and overlay arithmetic
+    of the old voice_music_mixer.
+
+    Parameters:
+    voice_audio (PCMAudio): The voiceover.
+    music_audio (PCMAudio): The background music, usually from load_music_pcm.
+    ad_length (float): The length of the output in seconds. The voiceover is trimmed or padded to it.
+    music_vol (float): The volume level to set for the music. A value between 0 and 1.
+    loop_music (bool): Loop music shorter than the ad instead of padding it with silence.
+    fade_in_duration (int): Music fade in, in milliseconds.
+    fade_out_duration (int): Music fade out, in milliseconds.
+    block_frames (int): Frames per yielded block.
+
+    Returns:
+    generator: int16 blocks shaped (frames, channels) at music_audio.sample_rate. Arguments are
+    validated before the first block is requested.
+    """
+    if not 0 <= music_vol <= 1:
+        raise ValueError("music_vol must be between 0 and 1")
+
+    sample_rate = music_audio.sample_rate
+    if voice_audio.sample_rate != sample_rate or voice_audio.samples.dtype != np.int16:
+        voice_audio = _match_pcm_format(voice_audio, sample_rate, voice_audio.channels, np.int16)
+    if music_audio.samples.dtype != np.int16:
+        music_audio = _match_pcm_format(music_audio, sample_rate, music_audio.channels, np.int16)
+    channels = max(voice_audio.channels, music_audio.channels)
+
+    target_length_ms = int(round(ad_length * 1000))
+    boundaries = _millisecond_to_frame_boundaries(music_audio, target_length_ms)
+    music_gain = 10 ** ((music_vol * 30 - 30) / 20)  # Adjust music volume in dB scale
+
+    fade_in_duration = min(fade_in_duration, target_length_ms)
+    fade_in_end_frame = boundaries[fade_in_duration]
+    fade_out_duration = min(fade_out_duration, target_length_ms)
+    fade_out_start_ms = target_length_ms - fade_out_duration
+    fade_out_start_frame = boundaries[fade_out_start_ms]
+
+    return _voice_music_mix_blocks(voice_audio, music_audio, loop_music, channels, boundaries, music_gain,
+                                   fade_in_duration, fade_in_end_frame, fade_out_duration, fade_out_start_ms,
+                                   fade_out_start_frame, block_frames)
+
+def _voice_music_mix_blocks(voice_audio, music_audio, loop_music, channels, boundaries, music_gain,
+                            fade_in_duration, fade_in_end_frame, fade_out_duration, fade_out_start_ms,
+                            fade_out_start_frame, block_frames):
+    total_frames = boundaries[-1]
+    for start_frame in range(0, total_frames, block_frames):
+        end_frame = min(start_frame + block_frames, total_frames)
+
+        music_block = _music_block(music_audio.samples, start_frame, end_frame, loop_music).astype(np.float64)
+        music_block = _apply_gain(music_block, music_gain)
+
+        if start_frame < fade_in_end_frame and fade_in_duration:
+            fade_frames = np.arange(start_frame, min(end_frame, fade_in_end_frame))
+            gains = _fade_gains(fade_frames, boundaries, 0, fade_in_duration, FADE_SILENCE_GAIN, 1.0)
+            music_block[:len(fade_frames)] = _apply_gain(music_block[:len(fade_frames)], gains[:, None])
+
+        if end_frame > fade_out_start_frame and fade_out_duration:
+            fade_frames = np.arange(max(start_frame, fade_out_start_frame), end_frame)
+            gains = _fade_gains(fade_frames, boundaries, fade_out_start_ms, fade_out_duration, 1.0, FADE_SILENCE_GAIN)
+            offset = fade_frames[0] - start_frame
+            music_block[offset:] = _apply_gain(music_block[offset:], gains[:, None])
+
+        voice_block = np.zeros((end_frame - start_frame, voice_audio.channels), dtype=np.float64)
+        voice_frames = voice_audio.samples[start_frame:min(end_frame, voice_audio.frame_count)]
+        voice_block[:len(voice_frames)] = voice_frames
+
+        # Overlay, saturating like audioop.add. Mono inputs broadcast across the other's channels.
+        combined_block = np.clip(voice_block + music_block, -32768, 32767).astype(np.int16)
+        yield np.broadcast_to(combined_block, (len(combined_block), channels))
+
+def mix_voice_with_music(voice_audio, music_audio, ad_length, music_vol, loop_music=False):
+    """Run stream_voice_music_mix and collect the blocks into one PCMAudio."""
+    blocks = list(stream_voice_music_mix(voice_audio, music_audio, ad_length, music_vol, loop_music=loop_music))
+    if not blocks:
+        return silent_pcm(0, music_audio.sample_rate, max(voice_audio.channels, music_audio.channels))
+    return PCMAudio(samples=np.concatenate(blocks), sample_rate=music_audio.sample_rate)
 
 def voice_music_mixer(voice_file_path, music_file_path, ad_length, music_vol, output_file_path="combined_output.mp3"):
     """
     Mixes voice and music audio files, adjusting the volume of the music and ensuring both files
     are of the same length by adding silence if necessary. Applies fade in/out effects to the music.
+    File based wrapper around stream_voice_music_mix.
 
     Parameters:
     voice_file_path (str): The path to the voice audio file.
@@ -83,50 +254,13 @@ def voice_music_mixer(voice_file_path, music_file_path, ad_length, music_vol, ou
         raise ValueError("music_vol must be between 0 and 1")
 
     try:
-        # Load voice file
-        voice_audio = AudioSegment.from_file(voice_file_path)
-
-        # Load music file and convert it to WAV with 192 kbps
-        music_audio = AudioSegment.from_file(music_file_path)
-        music_io = io.BytesIO()
-        music_audio.export(music_io, format="wav", bitrate="192k")
-        music_io.seek(0)
-        music_audio = AudioSegment.from_file(music_io, format="wav")
-
-        # Resample audio to the same sample rate if needed
-        if voice_audio.frame_rate != music_audio.frame_rate:
-            voice_audio = voice_audio.set_frame_rate(music_audio.frame_rate)
-
-        # Set target length in milliseconds
-        target_length_ms = int(ad_length * 1000)
-
-        # Adjust the length of the voice audio
-        if len(voice_audio) > target_length_ms:
-            voice_audio = voice_audio[:target_length_ms]
-        else:
-            silence = AudioSegment.silent(duration=target_length_ms - len(voice_audio))
-            voice_audio = voice_audio + silence
+        voice_audio = audio_segment_to_pcm(AudioSegment.from_file(voice_file_path))
+        music_audio = load_music_pcm(music_file_path)
 
-        # Adjust the length of the music audio
-        if len(music_audio) > target_length_ms:
-            music_audio = music_audio[:target_length_ms]
-        else:
-            silence = AudioSegment.silent(duration=target_length_ms - len(music_audio))
-            music_audio = music_audio + silence
-
-        # Apply music volume adjustments
-        music_audio = music_audio + (music_vol * 30 - 30)  # Adjust music volume in dB scale
-
-        # Apply fade in and fade out effects
-        fade_in_duration = 5000  # Fade duration in milliseconds
-        fade_out_duration = 5000  # Fade duration in milliseconds
-        music_audio = music_audio.fade_in(fade_in_duration).fade_out(fade_out_duration)
-
-        # Combine voice and music audio
-        combined_audio = voice_audio.overlay(music_audio)
+        combined_audio = mix_voice_with_music(voice_audio, music_audio, ad_length, music_vol)
 
         # Export combined audio to the output file path
-        combined_audio.export(output_file_path, format="mp3", bitrate="192k")
+        export_pcm(combined_audio, output_file_path, format="mp3", bitrate="192k")
         
         print(f"Combined audio file saved as {output_file_path}")
 
@@ -134,55 +268,339 @@ def voice_music_mixer(voice_file_path, music_file_path, ad_length, music_vol, ou
         print(f"An error occurred: {str(e)}")
 
 def generate_voiceover_from_history_item_id(history_item_id):
+    """
+    Return the decoded voiceover of an ElevenLabs history item or a pyro_ S3 object, served from the
+    local audio cache when possible. The returned PCMAudio may be shared and must not be modified.
+    """
+    cached_voiceover = get_cached_audio("voiceovers", history_item_id)
+    if cached_voiceover is not None:
+        return cached_voiceover
+
+    voiceover = _fetch_voiceover_from_history_item_id(history_item_id)
+    if voiceover is not None:
+        # pyro_ objects are immutable, ElevenLabs history items can be deleted by the user
+        ttl = None if history_item_id.startswith("pyro_") else config.ELEVENLABS_HISTORY_CACHE_TTL
+        put_cached_audio("voiceovers", history_item_id, voiceover, ttl=ttl)
+    return voiceover
+
+def _fetch_voiceover_from_history_item_id(history_item_id):
     try:
         if history_item_id.split('_')[0] == 'pyro':
             bucket_name ='workingdir--storage'
             object_name =f"primary--distribution/{history_item_id}"
             return _download_audio_from_s3(bucket_name, object_name)
         else:
-            mp3_data_generator = client.history.get_audio(
+            mp3_data_generator = get_elevenlabs_client().history.get_audio(
             history_item_id=history_item_id,
         )
-            mp3_data = b"".join(mp3_data_generator)
-            return convert_mp3_data_to_audio_segment(mp3_data)
+            return decode_audio_stream_to_pcm(timed_iteration("fetch", mp3_data_generator), format="mp3")
     except Exception as e:
         print(f"Failed to fetch the voiceover. Error: {e}")
 
+# threshold_db, min_silence_duration and keep_silence of the pause removal of every section
+SECTION_SILENCE_PARAMETERS = (-40, 100, 100)
+# Bump when the section processing changes so earlier processed sections are not reused
+SECTION_CACHE_VERSION = 1
+
+def section_cache_key(history_item_id, end_of_section_pause_duration):
+    """Key of a processed section: its voiceover, its end of section pause and the pause removal parameters."""
+    return json.dumps([SECTION_CACHE_VERSION, history_item_id, float(end_of_section_pause_duration),
+                       SECTION_SILENCE_PARAMETERS])
+
+def _section_cache_ttl(history_item_id_list):
+    # Processed sections live as long as the voiceovers they were made from
+    if all(history_item_id.startswith("pyro_") for history_item_id in history_item_id_list):
+        return None
+    return config.ELEVENLABS_HISTORY_CACHE_TTL
+
+def _count_sections(result, amount=1):
+    increment_counter("pyro_section_cache_total", "Sections of stitched requests by where they came from.",
+                      {"result": result}, amount)
+
+def cached_section(history_item_id, end_of_section_pause_duration):
+    """The memoized processed section, or None."""
+    return get_cached_audio("sections", section_cache_key(history_item_id, end_of_section_pause_duration))
+
+def cache_section(history_item_id, end_of_section_pause_duration, section):
+    put_cached_audio("sections", section_cache_key(history_item_id, end_of_section_pause_duration), section,
+                     ttl=_section_cache_ttl([history_item_id]))
+
+def process_section(history_item_id, end_of_section_pause_duration, finish=None):
+    """
+    Fetch one voiceover section, remove its pauses and append the end of section pause (in milliseconds).
+    `finish` runs the CPU-bound half, finish_section on the calling thread by default.
+    """
+    section = cached_section(history_item_id, end_of_section_pause_duration)
+    if section is not None:
+        return section
+    return finish_fetched_section(history_item_id, end_of_section_pause_duration,
+                                  generate_voiceover_from_history_item_id(history_item_id), finish)
+
+def finish_fetched_section(history_item_id, end_of_section_pause_duration, section_voiceover_segment, finish=None):
+    """Finish a section fetched by process_section or its async counterpart, and cache it."""
+    if section_voiceover_segment is None:
+        raise ValueError(f"Failed to fetch the voiceover for section {history_item_id}")
+    section = (finish or finish_section)(section_voiceover_segment, end_of_section_pause_duration)
+    cache_section(history_item_id, end_of_section_pause_duration, section)
+    return section
+
+def finish_section(section_voiceover_segment, end_of_section_pause_duration):
+    """CPU-bound half of process_section. Kept at module level so the process pool can pickle it."""
+    section_voiceover_segment = process_audio_to_remove_pauses(section_voiceover_segment, *SECTION_SILENCE_PARAMETERS)
+    return append_pause(section_voiceover_segment, duration=end_of_section_pause_duration)
+
+_section_process_pool = None
+_section_process_pool_pid = None
+_section_process_pool_lock = threading.Lock()
+
+def _get_section_process_pool():
+    """Lazily start the DSP process pool shared by all requests in this worker."""
+    global _section_process_pool, _section_process_pool_pid
+    with _section_process_pool_lock:
+        # A pool started before a fork (gunicorn --preload) belongs to the parent
+        if _section_process_pool is None or _section_process_pool_pid != os.getpid():
+            # forkserver children never inherit the threads (scheduler, HTTP pools) of the gunicorn worker
+            _section_process_pool = ProcessPoolExecutor(
+                max_workers=config.SECTION_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            _section_process_pool_pid = os.getpid()
+        return _section_process_pool
+
+def finish_section_in_pool(section_voiceover_segment, end_of_section_pause_duration):
+    """finish_section on the shared process pool, on the calling thread when SECTION_PROCESS_WORKERS is 0."""
+    if config.SECTION_PROCESS_WORKERS > 0:
+        future = _get_section_process_pool().submit(finish_section, section_voiceover_segment, end_of_section_pause_duration)
+        return future.result()
+    return finish_section(section_voiceover_segment, end_of_section_pause_duration)
+
+def process_sections(history_item_id_list, end_of_section_pause_duration_list, max_concurrency=None, serial=None):
+    """
+    Fetch and process voiceover sections concurrently.
+
+    Each section is downloaded on a thread (network bound) and its pause removal runs on the shared
+    process pool (CPU bound), so section N+1 downloads while section N is being processed.
+
+    Parameters:
+    history_item_id_list (list): ElevenLabs or pyro history item IDs, in spot order.
+    end_of_section_pause_duration_list (list): Pause to append after each section, in milliseconds.
+    max_concurrency (int, optional): Sections in flight at once. Defaults to config.SECTION_CONCURRENCY.
+    serial (bool, optional): Process one section after another. Defaults to config.SERIAL_SECTION_PROCESSING.
+
+    Returns:
+    list: Processed PCMAudio sections in the same order as history_item_id_list.
+    """
+    sections = list(zip(history_item_id_list, end_of_section_pause_duration_list))
+    serial = config.SERIAL_SECTION_PROCESSING if serial is None else serial
+    max_concurrency = max_concurrency or config.SECTION_CONCURRENCY
+
+    if serial or max_concurrency <= 1 or len(sections) <= 1:
+        return [process_section(history_item_id, pause) for history_item_id, pause in sections]
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(sections))) as fetch_pool:
+        # Each section thread reports its stages to the trace of the request
+        futures = [fetch_pool.submit(contextvars.copy_context().run, process_section, history_item_id, pause,
+                                     finish_section_in_pool)
+                   for history_item_id, pause in sections]
+        return [future.result() for future in futures]
+
+def section_prefix_keys(history_item_id_list, end_of_section_pause_duration_list):
+    """Chained keys of the stitched prefixes: key i covers sections 0 to i, so it changes with any of them."""
+    prefix_keys = []
+    prefix_key = ""
+    for history_item_id, pause in zip(history_item_id_list, end_of_section_pause_duration_list):
+        prefix_key = hashlib.sha256((prefix_key + section_cache_key(history_item_id, pause)).encode()).hexdigest()
+        prefix_keys.append(prefix_key)
+    return prefix_keys
+
+def cached_section_prefix(prefix_keys):
+    """The longest stitched prefix in the cache. Returns (number of sections it covers, PCMAudio or None)."""
+    for section_count in range(len(prefix_keys), 1, -1):
+        prefix = get_cached_audio("stitched_sections", prefix_keys[section_count - 1])
+        if prefix is not None:
+            return section_count, prefix
+    return 0, None
+
+def reusable_sections(history_item_id_list, end_of_section_pause_duration_list):
+    """
+    What an earlier render of the same sections left in the cache, counted in pyro_section_cache_total.
+
+    Returns:
+    tuple: (prefix keys, longest stitched prefix or None, [(history_item_id, pause, memoized PCMAudio or None)]
+           of the sections after the prefix).
+    """
+    prefix_keys = section_prefix_keys(history_item_id_list, end_of_section_pause_duration_list)
+    prefix_section_count, prefix = cached_section_prefix(prefix_keys)
+    remaining = [(history_item_id, pause, cached_section(history_item_id, pause)) for history_item_id, pause
+                 in list(zip(history_item_id_list, end_of_section_pause_duration_list))[prefix_section_count:]]
+    hits = sum(section is not None for _, _, section in remaining)
+    _count_sections("prefix", prefix_section_count)
+    _count_sections("hit", hits)
+    _count_sections("miss", len(remaining) - hits)
+    return prefix_keys, prefix, remaining
+
+def stitch_after_prefix(prefix_keys, history_item_id_list, prefix, sections):
+    """Stitch the sections after the cached prefix and cache the result as the last link of the chain."""
+    stitched_voiceover = stitch_audio_segments(([prefix] if prefix is not None else []) + sections)
+    put_cached_audio("stitched_sections", prefix_keys[-1], stitched_voiceover,
+                     ttl=_section_cache_ttl(history_item_id_list))
+    return stitched_voiceover
+
+def process_and_stitch_sections(history_item_id_list, end_of_section_pause_duration_list):
+    """
+    process_sections followed by stitch_audio_segments, reusing earlier work of the same sections.
+
+    Processed sections are memoized on section_cache_key, and the stitched result is cached as the
+    last link of a prefix chain. A spot rendered again with one section edited only fetches and
+    processes that section, one with sections appended starts from the stitched earlier sections.
+    Where each section came from is counted in pyro_section_cache_total.
+
+    Parameters:
+    history_item_id_list (list): ElevenLabs or pyro history item IDs, in spot order.
+    end_of_section_pause_duration_list (list): Pause to append after each section, in milliseconds.
+
+    Returns:
+    PCMAudio: The stitched voiceover.
+    """
+    if not history_item_id_list:
+        return stitch_audio_segments([])
+    prefix_keys, prefix, remaining = reusable_sections(history_item_id_list, end_of_section_pause_duration_list)
+    if not remaining:
+        return prefix
+
+    sections = [section for _, _, section in remaining]
+    missing = [index for index, section in enumerate(sections) if section is None]
+    processed_sections = process_sections([remaining[index][0] for index in missing],
+                                          [remaining[index][1] for index in missing])
+    for index, section in zip(missing, processed_sections):
+        sections[index] = section
+    return stitch_after_prefix(prefix_keys, history_item_id_list, prefix, sections)
+
+def synthesize_voiceover(text_input, voice_id, model_id, output_format="mp3_44100_192", intonation_consistency=0.5):
+    """One ElevenLabs generation, decoded to PCMAudio. Raises when it fails."""
+    from elevenlabs.types import VoiceSettings
+    audio_generator = get_elevenlabs_client().generate(
+        text=text_input,
+        voice=voice_id,
+        model=model_id,
+        output_format=output_format,
+        voice_settings=VoiceSettings(
+        stability=intonation_consistency, 
+        similarity_boost=0.75, 
+    ),
+    )
+    # Decode while ElevenLabs is still synthesizing instead of waiting for the whole file
+    return decode_audio_stream_to_pcm(timed_iteration("synthesize", audio_generator), format="mp3")
+
 def generate_voiceover_from_voice_id(text_input, voice_id, model_id, output_format="mp3_44100_192", intonation_consistency=0.5):
     try:
-        audio_generator = client.generate(
-            text=text_input,
-            voice=voice_id,
-            model=model_id,
-            output_format=output_format,
-            voice_settings=VoiceSettings(
-            stability=intonation_consistency, 
-            similarity_boost=0.75, 
-    ),
-        )
-        audio = b"".join(audio_generator)
-        return convert_mp3_data_to_audio_segment(audio)
+        return synthesize_voiceover(text_input, voice_id, model_id, output_format, intonation_consistency)
     except Exception as e:
         print(f"Failed to generate the voiceover. Error: {e}")
         return None
 
-def generate_timestamped_filename(base_name, user_id, extension=".mp3"):
+def plan_voiceover_shards(script, max_chars=None):
     """
-    Generate a timestamped filename in the format: base_name_user_id_timestamp.extension
+    Split a script for sharded synthesis. Every shard of a moodified script is spoken after the mood
+    phrase, so each one gets the delivery of an unsharded take.
+
+    Parameters:
+    script (str): The script to synthesize, after moodify_script.
+    max_chars (int, optional): Longest shard. Defaults to config.SYNTHESIS_SHARD_MAX_CHARS.
+
+    Returns:
+    tuple: (list of ScriptShard, whether the shards start with the mood phrase)
     """
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    return f"{base_name}_{user_id}_{timestamp}{extension}"
+    mood_phrase, initial_script = split_mood_phrase(script)
+    shards = split_script(initial_script, max_chars or config.SYNTHESIS_SHARD_MAX_CHARS,
+                          config.SYNTHESIS_SENTENCE_PAUSE, config.SYNTHESIS_PARAGRAPH_PAUSE)
+    if mood_phrase is None:
+        return shards, False
+    return [ScriptShard(text=moodify_with_phrase(mood_phrase, shard.text), pause_after_ms=shard.pause_after_ms)
+            for shard in shards], True
+
+def shard_retry_delay(attempt):
+    """Seconds to wait before retrying a shard after its attempt number `attempt` failed."""
+    return config.SYNTHESIS_SHARD_RETRY_DELAY * 2 ** attempt / 1000
+
+def _synthesize_shard(shard_index, text_input, voice_id, model_id, output_format, intonation_consistency):
+    for attempt in range(config.SYNTHESIS_SHARD_RETRIES + 1):
+        try:
+            return synthesize_voiceover(text_input, voice_id, model_id, output_format, intonation_consistency)
+        except Exception as e:
+            if attempt == config.SYNTHESIS_SHARD_RETRIES:
+                raise RuntimeError(f"Shard {shard_index} failed after {attempt + 1} attempts: {e}") from e
+            print(f"Failed to synthesize shard {shard_index}, retrying. Error: {e}")
+            increment_counter("pyro_synthesis_shard_retries_total", "Shards synthesized again after a failed attempt.")
+            time.sleep(shard_retry_delay(attempt))
+
+def generate_sharded_voiceover(text_input, voice_id, model_id, output_format="mp3_44100_192", intonation_consistency=0.5,
+                               max_concurrency=None):
+    """
+    Sharded counterpart of generate_voiceover_from_voice_id for long scripts.
+
+    The script is split at its pauses (see plan_voiceover_shards), the shards are synthesized
+    concurrently and stitched with the pause of each boundary, so a take takes about as long as its
+    slowest shard. A failed shard is retried on its own, up to config.SYNTHESIS_SHARD_RETRIES times.
+
+    Parameters:
+    max_concurrency (int, optional): Shards in flight at once. Defaults to config.SYNTHESIS_SHARD_CONCURRENCY.
 
-def cleanup_workdir():
-    data_folder = 'data/workdir'
+    Returns:
+    PCMAudio: The voiceover, or None when a shard failed on every attempt.
+    """
+    shards, mood_phrase_in_every_shard = plan_voiceover_shards(text_input)
+    if len(shards) <= 1:
+        return generate_voiceover_from_voice_id(text_input, voice_id, model_id, output_format, intonation_consistency)
+
+    max_concurrency = max_concurrency or config.SYNTHESIS_SHARD_CONCURRENCY
+    synthesis_pool = ThreadPoolExecutor(max_workers=min(max_concurrency, len(shards)))
     try:
-        for filename in os.listdir(data_folder):
-            file_path = os.path.join(data_folder, filename)
-            os.remove(file_path)
-            print(f"{file_path} deleted")
+        # Each shard thread reports its stages to the trace of the request
+        futures = [synthesis_pool.submit(contextvars.copy_context().run, _synthesize_shard, shard_index, shard.text,
+                                         voice_id, model_id, output_format, intonation_consistency)
+                   for shard_index, shard in enumerate(shards)]
+        voiceovers = [future.result() for future in futures]
     except Exception as e:
-        print(f"Failed to delete some files: {str(e)}")
-    print("Data folder content after removal :", os.listdir('data'))
+        print(f"Failed to generate the voiceover. Error: {e}")
+        return None
+    finally:
+        # The take is lost once a shard is, the shards still queued are not synthesized
+        synthesis_pool.shutdown(wait=False, cancel_futures=True)
+    return stitch_voiceover_shards(voiceovers, shards, mood_phrase_in_every_shard)
+
+def stitch_voiceover_shards(voiceovers, shards, mood_phrase_in_every_shard=False):
+    """
+    Join separately synthesized shards. The silence ElevenLabs leaves at the inner edges of the
+    shards is trimmed and the pause of each boundary put in its place. The mood phrase is cut from
+    every shard but the first, so the result has the shape of an unsharded take.
+
+    Parameters:
+    voiceovers (list): PCMAudio of every shard, in order.
+    shards (list): The ScriptShard they were synthesized from.
+    mood_phrase_in_every_shard (bool): Whether every shard starts with the mood phrase.
+
+    Returns:
+    PCMAudio: The whole voiceover.
+    """
+    last_index = len(voiceovers) - 1
+    pieces = []
+    for shard_index, (voiceover, shard) in enumerate(zip(voiceovers, shards)):
+        if mood_phrase_in_every_shard and shard_index > 0:
+            voiceover = slice_audio_at_cutoff(voiceover, config.MOOD_INTERVAL)
+        voiceover = trim_silent_edges(voiceover, leading=shard_index > 0, trailing=shard_index < last_index)
+        pieces.append(voiceover)
+        if shard_index < last_index:
+            pieces.append(silent_pcm(shard.pause_after_ms, voiceover.sample_rate, voiceover.channels, voiceover.samples.dtype))
+    return stitch_audio_segments(pieces)
+
+def generate_timestamped_filename(base_name, user_id, extension=".mp3"):
+    """
+    Generate a timestamped filename in the format: base_name_user_id_timestamp.extension
+    The timestamp has microseconds, concurrent requests of a user within a second get different names.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    return f"{base_name}_{user_id}_{timestamp}{extension}"
 
 def require_api_key(API_KEY):
     def decorator(view_function):
@@ -198,27 +616,20 @@ def require_api_key(API_KEY):
 
 def download_music_files_helper():
     collection_name = "background_music"
-    music_directory = "/code/data/background_music"
-    preview_directory = "/code/data/background_music_previews"
-
-    # Create the directories if they don't exist
-    for directory in [music_directory, preview_directory]:
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-            print(f"Created directory: {directory}")
+    music_directory = config.MUSIC_LIBRARY_DIR
+    preview_directory = config.MUSIC_PREVIEW_DIR
 
     # Initialize Firebase
     initialize_firebase()
 
     # Access Firestore
+    from firebase_admin import firestore
     db = firestore.client()
 
     # Fetch documents from Firestore
     collection_ref = db.collection(collection_name)
     docs = collection_ref.stream()
 
-    base_url = config.BACKGROUND_MUSIC_URL
-
     # Process documents
     music_filenames = []
     preview_filenames = []
@@ -229,33 +640,29 @@ def download_music_files_helper():
             preview_filenames.append(doc.get('preview_filename'))
 
 
-    print('\n---Checking and downloading background music files---\n')
-    for filename in tqdm(music_filenames, desc="Processing music files", unit="file"):
-        # Download music files
-        _download_file(filename, music_directory, base_url)
+    # Download only new or changed files, in parallel, and refresh their PCM sidecars
+    print('\n---Syncing background music files---\n')
+    sync_library(config.BACKGROUND_MUSIC_URL, music_directory, music_filenames, on_file_ready=_write_sidecar)
 
-    print('\n---Checking and downloading preview files---\n')
-    base_url = config.MUSIC_PREVIEW_URL
-    for filename in tqdm(preview_filenames, desc="Processing preview files", unit="file"):
-        # Download preview files
-        _download_file(filename, preview_directory, base_url)
+    print('\n---Syncing preview files---\n')
+    sync_library(config.MUSIC_PREVIEW_URL, preview_directory, preview_filenames, on_file_ready=_prepare_preview)
 
     print("Music and preview library update complete.")
 
-def _download_file(filename, directory, base_url):
-    file_path = os.path.join(directory, filename)
-
-    if not os.path.exists(file_path):
-        file_url = base_url + filename.replace(' ', '%20')
-        response = requests.get(file_url)
-
-        if response.status_code == 200:
-            with open(file_path, 'wb') as file:
-                file.write(response.content)
-            print(f"Downloaded {filename}")
-    else:
-        print(f"File {filename} already exists, skipping download.")
+def _write_sidecar(file_path):
+    try:
+        ensure_music_sidecar(file_path)
+    except Exception as e:
+        print(f"Failed to write the PCM sidecar for {file_path}, it will be decoded on every use. Error: {str(e)}")
 
+def _prepare_preview(file_path):
+    _write_sidecar(file_path)
+    try:
+        ensure_music_loudness_index(file_path)
+        if config.PREVIEW_PRERENDER:
+            prerender_preview_volumes(file_path)
+    except Exception as e:
+        print(f"Failed to prepare the preview {file_path}, it will be rendered on first use. Error: {str(e)}")
 
 def change_audio_volume(input_file_path, output_file_path, volume):
     """
@@ -272,99 +679,396 @@ def change_audio_volume(input_file_path, output_file_path, volume):
 
     try:
         # Load the audio file
-        audio = AudioSegment.from_file(input_file_path)
+        audio = load_music_pcm(input_file_path)
 
         # Adjust volume
-        adjusted_audio = audio + (volume * 30 - 30)  # Adjust music volume in dB scale
+        adjusted_samples = np.concatenate(list(stream_volume_change(audio, volume)))
 
         # Export the adjusted audio
-        adjusted_audio.export(output_file_path, format="wav")
+        export_pcm(PCMAudio(samples=adjusted_samples, sample_rate=audio.sample_rate), output_file_path, format="wav")
         print(f"Volume adjusted audio saved as {output_file_path}")
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
-def convert_mp3_data_to_audio_segment(mp3_data):
-    """Convert MP3 data to a PyDub AudioSegment object, set the bitrate to 192k wav."""
-    audio_segment = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
+def stream_volume_change(pcm_audio, volume, block_frames=MIX_BLOCK_FRAMES):
+    """
+    Turn 16-bit PCMAudio down by `volume * 30 - 30` dB, one block at a time.
 
-    output = io.BytesIO()
-    audio_segment.export(output, format="wav", bitrate="192k")
-    output.seek(0)
-    audio_segment = AudioSegment.from_file(output, format="wav")
+    Returns:
+    generator: int16 blocks shaped (frames, channels).
+    """
+    if not 0 <= volume <= 1:
+        raise ValueError("volume must be between 0 and 1")
+    gain = 10 ** ((volume * 30 - 30) / 20)  # Adjust music volume in dB scale
+    return (
+        _apply_gain(block.astype(np.float64), gain).astype(np.int16)
+        for block in pcm_blocks(pcm_audio, block_frames)
+    )
+
+LOUDNESS_WINDOW_MS = 100  # Resolution of the envelope in a loudness index
+RENDER_CHUNK_BYTES = 64 * 1024
+
+def quantize_preview_volume(volume):
+    """Snap a slider volume to the nearest of the PREVIEW_VOLUME_STEPS steps between 0 and 1, whose renders are cached."""
+    if not 0 <= volume <= 1:
+        raise ValueError("volume must be between 0 and 1")
+    return round(round(volume * config.PREVIEW_VOLUME_STEPS) / config.PREVIEW_VOLUME_STEPS, 4)
+
+def music_loudness_index_path(music_file_path):
+    return f"{music_file_path}.loudness.json"
+
+def ensure_music_loudness_index(music_file_path):
+    """
+    Measure a library track once from its PCM sidecar: peak and RMS level in dBFS, plus the peak of
+    every LOUDNESS_WINDOW_MS window. Levels at any volume follow by adding the gain, without decoding.
+
+    Returns:
+    dict: {"peak_dbfs", "rms_dbfs", "window_ms", "envelope"}, the envelope in 16-bit sample values.
+    """
+    index_path = music_loudness_index_path(music_file_path)
+    sidecar_path = ensure_music_sidecar(music_file_path)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(sidecar_path):
+        with open(index_path) as index_file:
+            return json.load(index_file)
+
+    music = read_pcm_file(sidecar_path)
+    magnitudes = np.abs(music.samples.astype(np.int32)).max(axis=1) if music.frame_count else np.zeros(1, np.int32)
+    window_frames = _ms_to_frames(music, LOUDNESS_WINDOW_MS)
+    padded = np.pad(magnitudes, (0, -len(magnitudes) % window_frames))
+    rms = np.sqrt(np.mean(np.square(music.samples, dtype=np.float64))) if music.frame_count else 0
+    index = {
+        "peak_dbfs": round(_to_dbfs(magnitudes.max()), 2),
+        "rms_dbfs": round(_to_dbfs(rms), 2),
+        "window_ms": LOUDNESS_WINDOW_MS,
+        "envelope": padded.reshape(-1, window_frames).max(axis=1).tolist(),
+    }
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or ".", suffix=".tmp")
+    with os.fdopen(file_descriptor, "w") as temp_file:
+        json.dump(index, temp_file)
+    os.replace(temp_path, index_path)
+    return index
+
+def _to_dbfs(level):
+    return 20 * math.log10(level / 32768) if level > 0 else -math.inf
+
+def preview_render_path(music_file_path, volume):
+    """Where the MP3 render of a preview at a quantized volume is cached, next to its sidecar."""
+    return f"{music_file_path}.vol{round(volume * 1000):04d}.mp3"
+
+def cached_preview_render(music_file_path, volume):
+    """Chunks of the cached render of a preview at `volume`, or None when there is no up to date one."""
+    render_path = preview_render_path(music_file_path, volume)
+    try:
+        render_file = open(render_path, "rb")
+    except FileNotFoundError:
+        return None
+    if os.fstat(render_file.fileno()).st_mtime < os.path.getmtime(music_file_path):
+        render_file.close()
+        return None
+    return _read_chunks(render_file)
+
+def _read_chunks(render_file):
+    with render_file:
+        while chunk := render_file.read(RENDER_CHUNK_BYTES):
+            yield chunk
+
+def cache_preview_render(encoded_chunks, music_file_path, volume):
+    """
+    Pass encoded chunks through while writing them to the render cache. The render only becomes
+    visible once it is complete, a render abandoned half way (client gone) is dropped.
+    """
+    render_path = preview_render_path(music_file_path, volume)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(render_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            for chunk in encoded_chunks:
+                temp_file.write(chunk)
+                yield chunk
+        os.replace(temp_path, render_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def prerender_preview_volumes(music_file_path):
+    """Cache the renders of a preview at every volume step, so that no slider position waits for an encode."""
+    preview_audio = load_music_pcm(music_file_path)
+    for step in range(config.PREVIEW_VOLUME_STEPS + 1):
+        volume = quantize_preview_volume(step / config.PREVIEW_VOLUME_STEPS)
+        if cached_preview_render(music_file_path, volume) is not None:
+            continue
+        encoded_chunks = stream_encode_pcm(stream_volume_change(preview_audio, volume),
+                                           preview_audio.sample_rate, preview_audio.channels)
+        for _ in cache_preview_render(encoded_chunks, music_file_path, volume):
+            pass
+
+SAMPLE_WIDTH_TO_DTYPE = {1: np.int8, 2: np.int16, 4: np.int32}
+DEFAULT_SAMPLE_RATE = 44100  # Matches the mp3_44100_192 output format we request from ElevenLabs
+
+def audio_segment_to_pcm(audio_segment):
+    """Wrap the raw data of a PyDub AudioSegment as PCMAudio without copying it."""
+    if audio_segment.sample_width not in SAMPLE_WIDTH_TO_DTYPE:
+        audio_segment = audio_segment.set_sample_width(4)
+    dtype = SAMPLE_WIDTH_TO_DTYPE[audio_segment.sample_width]
+    samples = np.frombuffer(audio_segment.raw_data, dtype=dtype).reshape(-1, audio_segment.channels)
+    return PCMAudio(samples=samples, sample_rate=audio_segment.frame_rate)
+
+def pcm_to_audio_segment(pcm_audio):
+    """Build a PyDub AudioSegment from PCMAudio, for encoders and effects that still need PyDub."""
+    return AudioSegment(
+        data=np.ascontiguousarray(pcm_audio.samples).tobytes(),
+        sample_width=pcm_audio.sample_width,
+        frame_rate=pcm_audio.sample_rate,
+        channels=pcm_audio.channels,
+    )
+
+def decode_audio_to_pcm(audio_data, format="mp3"):
+    """Decode encoded audio bytes into PCMAudio with a single ffmpeg pass."""
+    with stage("decode") as measured:
+        pcm_audio = audio_segment_to_pcm(AudioSegment.from_file(io.BytesIO(audio_data), format=format))
+        measured["bytes"] = pcm_audio.samples.nbytes
+    return pcm_audio
+
+def decode_audio_stream_to_pcm(byte_chunks, format="mp3"):
+    """
+    Decode encoded audio into PCMAudio as its chunks arrive (see audio_stream.stream_decode_audio),
+    so decoding overlaps with the download or synthesis producing them. The decode stage therefore
+    includes the time spent waiting for the chunks.
+    """
+    blocks = list(timed_iteration("decode", stream_decode_audio(byte_chunks, format=format)))
+    if not blocks:
+        raise ValueError("The audio stream did not contain any audio")
+    return PCMAudio(samples=np.concatenate([block.samples for block in blocks]), sample_rate=blocks[0].sample_rate)
 
-    return audio_segment
+def export_pcm(pcm_audio, out_f, format="mp3", bitrate="192k"):
+    """
+    Encode PCMAudio at the output boundary of the pipeline.
+
+    Parameters:
+    pcm_audio (PCMAudio): The audio to encode.
+    out_f (str or file-like): Destination path or buffer.
+    format (str): Output container/codec understood by ffmpeg.
+    bitrate (str): Encoder bitrate. Ignored for WAV.
+    """
+    return pcm_to_audio_segment(pcm_audio).export(out_f, format=format, bitrate=bitrate)
+
+def silent_pcm(duration, sample_rate=DEFAULT_SAMPLE_RATE, channels=1, dtype=np.int16):
+    """Generate `duration` milliseconds of digital silence."""
+    frames = int(sample_rate * (duration / 1000.0))
+    return PCMAudio(samples=np.zeros((frames, channels), dtype=dtype), sample_rate=sample_rate)
+
+def _ms_to_frames(pcm_audio, ms):
+    return int(ms * (pcm_audio.sample_rate / 1000.0))
+
+def _match_pcm_format(pcm_audio, sample_rate, channels, dtype):
+    """Convert PCMAudio to the given layout. Audio that already matches is returned untouched."""
+    if (pcm_audio.sample_rate == sample_rate and pcm_audio.channels == channels
+            and pcm_audio.samples.dtype == dtype):
+        return pcm_audio
+    audio_segment = pcm_to_audio_segment(pcm_audio)
+    audio_segment = audio_segment.set_channels(channels).set_frame_rate(sample_rate)
+    audio_segment = audio_segment.set_sample_width(np.dtype(dtype).itemsize)
+    return audio_segment_to_pcm(audio_segment)
+
+def convert_mp3_data_to_pcm(mp3_data):
+    """Decode MP3 data into PCMAudio."""
+    return decode_audio_to_pcm(mp3_data, format="mp3")
 
 def slice_audio_at_cutoff(audio_segment, cutoff_ms):
     """
     Slices the audio segment so that the new audio starts at the cutoff millisecond timestamp.
     
     Parameters:
-    audio_segment (AudioSegment): The original audio segment.
+    audio_segment (PCMAudio): The original audio.
     cutoff_ms (int): The cutoff timestamp in milliseconds.
     
     Returns:
-    AudioSegment: The sliced audio segment starting from the cutoff timestamp.
+    PCMAudio: A view of the audio starting from the cutoff timestamp.
     """
-    # Slice the audio segment from the cutoff timestamp
-    sliced_audio = audio_segment[cutoff_ms:]
-    
+    start_frame = min(_ms_to_frames(audio_segment, cutoff_ms), audio_segment.frame_count)
+    return PCMAudio(samples=audio_segment.samples[start_frame:], sample_rate=audio_segment.sample_rate)
 
-    # Export the sliced audio to memory with a bitrate of 192 kbps
-    output = io.BytesIO()
-    sliced_audio.export(output, format="wav", bitrate="192k")
-    output.seek(0)
-    
-    # Load the audio back from memory
-    final_audio = AudioSegment.from_file(output, format="wav")
-    
-    return final_audio
+def _millisecond_to_frame_boundaries(pcm_audio, duration_ms):
+    # Same float arithmetic and truncation PyDub uses to turn a millisecond position into a frame index
+    return (np.arange(duration_ms + 1) * (pcm_audio.sample_rate / 1000.0)).astype(np.int64)
 
-def process_audio_to_remove_pauses(audio_segment, threshold_db=-40, min_silence_duration=100):
-    """Process the audio data to remove all silences."""
-    chunks = split_on_silence(audio_segment, 
-                              min_silence_len=min_silence_duration,
-                              silence_thresh=threshold_db)
-    non_silent_audio = sum(chunks, AudioSegment.empty())
+def _samples_padded_to_duration(pcm_audio):
+    """
+    PyDub rounds the length to whole milliseconds and pads slices that run past the last frame
+    with silence. Pad the same way so millisecond positions map onto identical samples.
+    """
+    required_frames = int(pcm_audio.duration_ms * (pcm_audio.sample_rate / 1000.0))
+    missing_frames = required_frames - pcm_audio.frame_count
+    if missing_frames <= 0:
+        return pcm_audio.samples
+    return np.concatenate([pcm_audio.samples, np.zeros((missing_frames, pcm_audio.channels), dtype=pcm_audio.samples.dtype)])
 
-    output = io.BytesIO()
-    non_silent_audio.export(output, format="wav", bitrate="192k")
-    output.seek(0)
-    non_silent_audio = AudioSegment.from_file(output, format="wav")
+def detect_silent_ranges(audio_segment, min_silence_len=1000, silence_thresh=-16):
+    """
+    Vectorized equivalent of pydub.silence.detect_silence with seek_step=1.
 
-    return non_silent_audio
+    The RMS of every min_silence_len window is computed at once from a cumulative sum of squared
+    samples, and consecutive silent windows are merged with run-length encoding.
 
-def stitch_audio_segments(audio_segments):
-    """Combine multiple audio segments and return as a single audio segment."""
-    combined_audio = sum(audio_segments, AudioSegment.empty())
+    Parameters:
+    audio_segment (PCMAudio): The audio to scan.
+    min_silence_len (int): Minimum length of a silent section in milliseconds.
+    silence_thresh (float): Upper bound in dBFS for how quiet is considered silent.
 
-    output = io.BytesIO()
-    combined_audio.export(output, format="wav", bitrate="192k")
-    output.seek(0)
-    combined_audio = AudioSegment.from_file(output, format="wav")
+    Returns:
+    list: [start, end] millisecond pairs of silent sections.
+    """
+    seg_len = audio_segment.duration_ms
+    if seg_len < min_silence_len:
+        return []
+
+    max_possible_amplitude = (2 ** (audio_segment.sample_width * 8)) / 2
+    threshold = (10 ** (silence_thresh / 20)) * max_possible_amplitude
+
+    samples = _samples_padded_to_duration(audio_segment)
+    accumulator_dtype = np.int64 if audio_segment.sample_width <= 2 else np.float64
+    frame_energy = np.square(samples, dtype=accumulator_dtype).sum(axis=1)
+    cumulative_energy = np.concatenate([np.zeros(1, dtype=accumulator_dtype), np.cumsum(frame_energy)])
+
+    boundaries = _millisecond_to_frame_boundaries(audio_segment, seg_len)
+    window_starts = boundaries[:seg_len - min_silence_len + 1]
+    window_ends = boundaries[min_silence_len:]
+    window_sample_counts = (window_ends - window_starts) * audio_segment.channels
+    window_energy = cumulative_energy[window_ends] - cumulative_energy[window_starts]
+
+    # audioop.rms truncates to an integer, so floor before comparing against the threshold
+    window_rms = np.zeros(len(window_starts))
+    has_samples = window_sample_counts > 0
+    window_rms[has_samples] = np.floor(np.sqrt(window_energy[has_samples] / window_sample_counts[has_samples]))
+
+    silence_starts = np.flatnonzero(window_rms <= threshold)
+    if not len(silence_starts):
+        return []
+
+    # A new range begins wherever two silent windows are neither adjacent nor overlapping
+    gaps = np.diff(silence_starts)
+    breaks = np.flatnonzero((gaps != 1) & (gaps > min_silence_len))
+    range_starts = silence_starts[np.concatenate([[0], breaks + 1])]
+    range_ends = silence_starts[np.concatenate([breaks, [len(silence_starts) - 1]])] + min_silence_len
+
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+def detect_nonsilent_ranges(audio_segment, min_silence_len=1000, silence_thresh=-16):
+    """Inverse of detect_silent_ranges, matching pydub.silence.detect_nonsilent."""
+    silent_ranges = detect_silent_ranges(audio_segment, min_silence_len, silence_thresh)
+    len_seg = audio_segment.duration_ms
+
+    if not silent_ranges:
+        return [[0, len_seg]]
+
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == len_seg:
+        return []
+
+    prev_end_i = 0
+    nonsilent_ranges = []
+    for start_i, end_i in silent_ranges:
+        nonsilent_ranges.append([prev_end_i, start_i])
+        prev_end_i = end_i
+
+    if end_i != len_seg:
+        nonsilent_ranges.append([prev_end_i, len_seg])
+
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
 
-    return combined_audio
+    return nonsilent_ranges
+
+def trim_silent_edges(audio_segment, leading=True, trailing=True, threshold_db=-40):
+    """
+    Cut the silence at the start and/or the end of the audio.
+
+    Parameters:
+    audio_segment (PCMAudio): The audio to trim.
+    leading (bool): Cut the silence before the first sound.
+    trailing (bool): Cut the silence after the last sound.
+    threshold_db (float): Anything quieter than this many dBFS is considered silence.
+
+    Returns:
+    PCMAudio: A view of the audio, unchanged when it is silent throughout.
+    """
+    nonsilent_ranges = detect_nonsilent_ranges(audio_segment, 10, threshold_db)
+    if not nonsilent_ranges:
+        return audio_segment
+    start_frame = _ms_to_frames(audio_segment, nonsilent_ranges[0][0]) if leading else 0
+    end_frame = _ms_to_frames(audio_segment, nonsilent_ranges[-1][1]) if trailing else audio_segment.frame_count
+    return PCMAudio(samples=audio_segment.samples[start_frame:end_frame], sample_rate=audio_segment.sample_rate)
+
+def process_audio_to_remove_pauses(audio_segment, threshold_db=-40, min_silence_duration=100, keep_silence=100):
+    """
+    Process the audio data to remove all silences.
+
+    Produces the same audio as joining the chunks of pydub.silence.split_on_silence, but detects
+    silence with detect_nonsilent_ranges and builds the output with a single concatenation.
+
+    Parameters:
+    audio_segment (PCMAudio): The audio to process.
+    threshold_db (float): Anything quieter than this many dBFS is considered silence.
+    min_silence_duration (int): Minimum length in milliseconds of a silence to remove.
+    keep_silence (int): Milliseconds of silence kept around each non-silent chunk.
+
+    Returns:
+    PCMAudio: The audio with the silences removed.
+    """
+    with stage("pause_removal") as measured:
+        pause_free_audio = _remove_pauses(audio_segment, threshold_db, min_silence_duration, keep_silence)
+        measured["bytes"] = pause_free_audio.samples.nbytes
+    return pause_free_audio
+
+def _remove_pauses(audio_segment, threshold_db, min_silence_duration, keep_silence):
+    nonsilent_ranges = detect_nonsilent_ranges(audio_segment, min_silence_duration, threshold_db)
+    output_ranges = [[start - keep_silence, end + keep_silence] for start, end in nonsilent_ranges]
+
+    # Split the kept silence evenly where the padded chunks would overlap
+    for current_range, next_range in zip(output_ranges, output_ranges[1:]):
+        if next_range[0] < current_range[1]:
+            current_range[1] = (current_range[1] + next_range[0]) // 2
+            next_range[0] = current_range[1]
+
+    samples = _samples_padded_to_duration(audio_segment)
+    boundaries = _millisecond_to_frame_boundaries(audio_segment, audio_segment.duration_ms)
+    chunks = [
+        samples[boundaries[max(start, 0)]:boundaries[min(end, audio_segment.duration_ms)]]
+        for start, end in output_ranges
+    ]
+    if not chunks:
+        return PCMAudio(samples=samples[:0], sample_rate=audio_segment.sample_rate)
+    return PCMAudio(samples=np.concatenate(chunks), sample_rate=audio_segment.sample_rate)
+
+def stitch_audio_segments(audio_segments):
+    """
+    Combine multiple PCMAudio sections into one with a single concatenation.
+    Sections are brought to the highest sample rate, channel count and sample width among them first.
+    """
+    if not audio_segments:
+        return silent_pcm(0)
+
+    sample_rate = max(segment.sample_rate for segment in audio_segments)
+    channels = max(segment.channels for segment in audio_segments)
+    dtype = max((segment.samples.dtype for segment in audio_segments), key=lambda dtype: dtype.itemsize)
+    with stage("stitch") as measured:
+        matched_segments = [_match_pcm_format(segment, sample_rate, channels, dtype) for segment in audio_segments]
+        samples = np.concatenate([segment.samples for segment in matched_segments])
+        measured["bytes"] = samples.nbytes
+    return PCMAudio(samples=samples, sample_rate=sample_rate)
 
 def append_pause(audio_segment, duration=200):
     """
     Adds an artificial pause to the end of the given audio segment.
 
     Args:
-    audio_segment (AudioSegment): The audio segment to which the pause will be added.
+    audio_segment (PCMAudio): The audio to which the pause will be added.
     duration (int, optional): The duration of the pause in milliseconds. Default is 200 milliseconds.
 
     Returns:
-    AudioSegment: The modified audio segment with the pause added.
+    PCMAudio: The modified audio with the pause added.
     """
-    pause = AudioSegment.silent(duration=duration)  # duration in milliseconds
-    audio_segment_with_pause = audio_segment + pause
-
-    output = io.BytesIO()
-    audio_segment_with_pause.export(output, format="wav", bitrate="192k")
-    output.seek(0)
-    audio_segment_with_pause = AudioSegment.from_file(output, format="wav")
-
-    return audio_segment_with_pause
+    pause = silent_pcm(duration, audio_segment.sample_rate, audio_segment.channels, audio_segment.samples.dtype)
+    return stitch_audio_segments([audio_segment, pause])
 
 def immediate_file_cleanup(file_paths):
     for file_path in file_paths:
@@ -377,25 +1081,76 @@ def immediate_file_cleanup(file_paths):
     print("Data folder content after removal :", os.listdir('data'))
 
 
+_s3_transfer_config = None
+
+def get_s3_transfer_config():
+    """Multipart settings of the S3 downloads, built on first use like the client."""
+    global _s3_transfer_config
+    if _s3_transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+        _s3_transfer_config = TransferConfig(
+            multipart_threshold=config.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=config.S3_TRANSFER_CONCURRENCY,
+            use_threads=True,
+        )
+    return _s3_transfer_config
+
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """
+    Return the S3 client of this process, creating it on first use.
+
+    Credentials, endpoint and the keep-alive connection pool are set up once and shared by every
+    thread (boto3 clients are thread safe). Forked workers build their own client, since
+    connections must not be shared across processes.
+    """
+    global _s3_client, _s3_client_pid
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != os.getpid():
+            import boto3
+            from botocore.config import Config as BotoConfig
+            session = boto3.session.Session(aws_access_key_id=config.MIN_PYRO_USER_AWS_ACCESS_KEY,
+                                            aws_secret_access_key=config.MIN_PYRO_USER_AWS_SECRET_KEY,
+                                            region_name=config.S3_REGION)
+            _s3_client = session.client('s3', endpoint_url=config.S3_ENDPOINT_URL, config=BotoConfig(
+                max_pool_connections=config.S3_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                retries={'max_attempts': 5, 'mode': 'standard'},
+            ))
+            _s3_client_pid = os.getpid()
+        return _s3_client
+
 def upload_audio_segment_to_s3(audio_segment, bucket_name, object_name):
     """
-    Upload an AudioSegment to an S3 bucket directly from memory.
+    Encode PCMAudio to MP3 and stream it into an S3 bucket. Audio of another sample width is
+    converted to 16-bit first.
 
-    :param audio_segment: AudioSegment object to upload.
+    :param audio_segment: PCMAudio to upload.
     :param bucket_name: Name of the S3 bucket to upload to.
     :param object_name: Object name in S3. This is the file name that will appear in the bucket.
     :return: True if the audio segment was uploaded successfully, else False.
     """
-    s3_client = boto3.client('s3', aws_access_key_id=config.MIN_PYRO_USER_AWS_ACCESS_KEY,
-                             aws_secret_access_key=config.MIN_PYRO_USER_AWS_SECRET_KEY, region_name='us-east-2')
+    audio_segment = _match_pcm_format(audio_segment, audio_segment.sample_rate, audio_segment.channels, np.int16)
+    return upload_pcm_blocks_to_s3(pcm_blocks(audio_segment), audio_segment.sample_rate, audio_segment.channels,
+                                   bucket_name, object_name)
 
-    buffer = io.BytesIO()
-    # Adjust format and parameters as needed
-    audio_segment.export(buffer, format="mp3", bitrate="192k")
-    buffer.seek(0)  # Reset buffer's position to the beginning
+def upload_pcm_blocks_to_s3(blocks, sample_rate, channels, bucket_name, object_name):
+    """
+    Encode 16-bit PCM blocks to 192k MP3 and upload the encoder output to S3 as it is produced, in
+    one request, or a multipart upload once it outgrows a part. Neither the PCM nor the MP3 has to
+    be held in memory in full.
 
+    :return: True if the audio was uploaded successfully, else False.
+    """
     try:
-        s3_client.put_object(Body=buffer, Bucket=bucket_name, Key=object_name, ContentType='audio/mpeg')
+        encoded_chunks = timed_iteration("encode", stream_encode_pcm(blocks, sample_rate, channels, format="mp3", bitrate="192k"))
+        with stage("upload"):
+            upload_stream_to_s3(get_s3_client(), encoded_chunks, bucket_name, object_name, content_type='audio/mpeg',
+                                part_bytes=max(S3_MIN_PART_BYTES, config.S3_MULTIPART_CHUNKSIZE))
         print(f"Audio uploaded to {bucket_name}/{object_name}")
         return True
     except Exception as e:
@@ -405,39 +1160,30 @@ def upload_audio_segment_to_s3(audio_segment, bucket_name, object_name):
 
 def _download_audio_from_s3(bucket_name, object_name):
     """
-    Download an audio file from an S3 bucket directly into memory and return it as an AudioSegment object with a bit rate of 192 kbps.
+    Download an audio file from an S3 bucket directly into memory and decode it to PCMAudio.
+    Objects above S3_MULTIPART_THRESHOLD are fetched as parallel ranged GETs.
 
     :param bucket_name: Name of the S3 bucket to download from.
     :param object_name: Object name in S3. This is the file name that will appear in the bucket.
-    :return: AudioSegment object if the audio was downloaded successfully, else None.
+    :return: PCMAudio if the audio was downloaded successfully, else None.
     """
-    s3_client = boto3.client('s3', aws_access_key_id=config.MIN_PYRO_USER_AWS_ACCESS_KEY,
-                             aws_secret_access_key=config.MIN_PYRO_USER_AWS_SECRET_KEY)
-    
     try:
-        obj = s3_client.get_object(Bucket=bucket_name, Key=object_name)
-        audio_data = obj['Body'].read()
-
-        # Create an AudioSegment from the downloaded audio data
-        audio_segment = AudioSegment.from_file(io.BytesIO(audio_data), format="mp3")
+        audio_buffer = io.BytesIO()
+        with stage("fetch") as measured:
+            get_s3_client().download_fileobj(bucket_name, object_name, audio_buffer, Config=get_s3_transfer_config())
+            measured["bytes"] = audio_buffer.tell()
 
-        # Export to in-memory file-like object with the specified bit rate
-        output_io = io.BytesIO()
-        audio_segment.export(output_io, format="wav", bitrate="192k")
-        
-        # Move the buffer cursor to the beginning
-        output_io.seek(0)
+        pcm_audio = decode_audio_to_pcm(audio_buffer.getvalue(), format="mp3")
 
-        # Reload the audio segment to ensure the bit rate is set correctly
-        audio_segment = AudioSegment.from_file(output_io, format="wav")
-        
-        print(f"Audio downloaded from {bucket_name}/{object_name} and ready for processing with 192 kbps bit rate")
-        return audio_segment
+        print(f"Audio downloaded from {bucket_name}/{object_name} and ready for processing")
+        return pcm_audio
     except Exception as e:
         print(f"Error downloading audio: {e}")
         return None
 
 
+MOOD_PHRASE_PATTERN = re.compile(r'^(?P<mood_phrase>(?:He|She) said [^<"]*<break time="[^"]*" />) "(?P<script>.*)"$', re.DOTALL)
+
 def moodify_script(initial_script, voice_gender='male', emotion="enthusiastically"):
     if voice_gender == 'male':
         pronoun = 'He'
@@ -445,8 +1191,44 @@ def moodify_script(initial_script, voice_gender='male', emotion="enthusiasticall
         pronoun = 'She'
     mood_phrase = f'{pronoun} said {emotion} <break time="0.8s" />'
 
+    return moodify_with_phrase(mood_phrase, initial_script)
+
+def moodify_with_phrase(mood_phrase, initial_script):
     return f'{mood_phrase} "{initial_script}"'
 
+def split_mood_phrase(script):
+    """Inverse of moodify_script. Returns (mood phrase, initial script), the mood phrase is None for other scripts."""
+    match = MOOD_PHRASE_PATTERN.match(script)
+    if match is None:
+        return None, script
+    return match.group("mood_phrase"), match.group("script")
+
+
+# Bump when the preprocess-voiceover processing changes so earlier renders are not reused
+TTS_RESULT_CACHE_VERSION = 1
+
+def tts_result_cache_key(script, voice, model_id, output_format, stability, emotion, speech_rate, sharded=False):
+    """
+    Canonical hash of every input that shapes a preprocessed voiceover. `script` must be the text
+    actually synthesized, i.e. after moodify_script.
+    """
+    inputs = {
+        "version": TTS_RESULT_CACHE_VERSION,
+        "script": script,
+        "voice": voice,
+        "model_id": model_id,
+        "output_format": output_format,
+        "stability": float(stability),
+        "emotion": emotion or None,
+        "mood_interval": config.MOOD_INTERVAL if emotion else None,
+        "speech_rate": float(speech_rate),
+        "speech_rate_engine": [config.SPEECH_RATE_ENGINE, config.SPEECH_RATE_QUALITY] if speech_rate else None,
+    }
+    if sharded:
+        # Unsharded takes keep the keys they were cached under
+        inputs["sharding"] = [config.SYNTHESIS_SHARD_MAX_CHARS, config.SYNTHESIS_SENTENCE_PAUSE, config.SYNTHESIS_PARAGRAPH_PAUSE]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
 
 def generate_pyro_history_item_id(input_string):
     """
@@ -463,48 +1245,73 @@ def generate_pyro_history_item_id(input_string):
     return hex_dig[:7]
 
 
-def adjust_speech_rate(audio_segment, tempo_change):
+def adjust_speech_rate(audio_segment, tempo_change, engine=None, quality=None):
     """
     Adjust the tempo of an audio segment.
 
     Parameters:
-    - audio_segment: A PyDub AudioSegment instance.
+    - audio_segment: A PCMAudio instance.
     - tempo_change: The percentage to change the tempo by. Positive values increase the tempo,
       while negative values decrease it.
+    - engine: "wsola" stretches in process, "soundstretch" runs SoundTouch. Defaults to config.SPEECH_RATE_ENGINE.
+    - quality: WSOLA quality setting, see time_stretch.STRETCH_QUALITY_SETTINGS. Defaults to config.SPEECH_RATE_QUALITY.
 
     Returns:
-    - A new AudioSegment instance with the adjusted tempo and 192k bitrate.
+    - A new PCMAudio instance with the adjusted tempo.
     """
-    # Create a temporary WAV file for the original audio
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_wav_file:
-        original_wav_path = temp_wav_file.name
-        audio_segment.export(temp_wav_file.name, format="wav")
-    
-    # Prepare the output WAV file path
-    output_wav_path = tempfile.mktemp(suffix='.wav')
-
-    # Apply Tempo Change with SoundTouch
-    subprocess.run(["soundstretch", original_wav_path, output_wav_path, f"-tempo={tempo_change}"], check=True)
-
-    # Load the processed WAV file into an AudioSegment
-    final_audio_segment = AudioSegment.from_file(output_wav_path, format="wav")
+    engine = engine or config.SPEECH_RATE_ENGINE
+    if engine == "soundstretch":
+        return _adjust_speech_rate_with_soundstretch(audio_segment, tempo_change)
+    if engine != "wsola":
+        raise ValueError(f"Unknown speech rate engine {engine!r}")
+
+    with stage("speech_rate") as measured:
+        stretched = wsola_time_stretch(audio_segment.samples, audio_segment.sample_rate, 1 + tempo_change / 100,
+                                       quality=quality or config.SPEECH_RATE_QUALITY)
+        dtype = audio_segment.samples.dtype
+        limits = np.iinfo(dtype)
+        samples = np.clip(np.rint(stretched), limits.min, limits.max).astype(dtype)
+        measured["bytes"] = samples.nbytes
+    return PCMAudio(samples=samples, sample_rate=audio_segment.sample_rate)
+
+def _adjust_speech_rate_with_soundstretch(audio_segment, tempo_change):
+    # The input, and the output which is longer when slowed down
+    expected_bytes = audio_segment.samples.nbytes * (1 + 100 / max(100 + tempo_change, 1)) + 1024
+    with scratch_workspace("speech_rate", expected_bytes=int(expected_bytes)) as workspace:
+        original_wav_path = workspace_path(workspace, "original.wav")
+        output_wav_path = workspace_path(workspace, "stretched.wav")
+        export_pcm(audio_segment, original_wav_path, format="wav")
+
+        # Apply Tempo Change with SoundTouch
+        subprocess.run(["soundstretch", original_wav_path, output_wav_path, f"-tempo={tempo_change}"], check=True)
+        check_workspace_quota(workspace)
+
+        # Load the processed WAV file into an AudioSegment
+        final_audio_segment = AudioSegment.from_file(output_wav_path, format="wav")
 
     # Set the sample rate to match the original audio segment
-    final_audio_segment = final_audio_segment.set_frame_rate(audio_segment.frame_rate)
-
-    # Cleanup: Remove Temporary Files
-    subprocess.run(["rm", original_wav_path], check=True)
-    subprocess.run(["rm", output_wav_path], check=True)
+    final_audio_segment = final_audio_segment.set_frame_rate(audio_segment.sample_rate)
 
-    # Export the final audio segment to a byte buffer with the desired bitrate
-    buffer = io.BytesIO()
-    final_audio_segment.export(buffer, format="wav", bitrate="192k")
-    buffer.seek(0)
+    return audio_segment_to_pcm(final_audio_segment)
 
-    # Load the audio segment from the byte buffer
-    final_audio_segment_with_bitrate = AudioSegment.from_file(buffer, format="wav")
-
-    return final_audio_segment_with_bitrate
+def render_preprocessed_voiceover(voiceover, emotion=None, speech_rate=0):
+    """
+    CPU-bound half of /preprocess-voiceover. With an emotion (Dragon's Breath mode) the spoken
+    mood phrase is cut off and the pauses removed, then the speech rate is applied.
+    """
+    if emotion:
+        voiceover = slice_audio_at_cutoff(voiceover, config.MOOD_INTERVAL)
+        voiceover = process_audio_to_remove_pauses(voiceover)
+        print("Processed voiceover with Dragon's Breath mode")
+    if speech_rate != 0:
+        voiceover = adjust_speech_rate(voiceover, speech_rate)
+        print(f"Adjusted speech rate by {speech_rate}%")
+    return voiceover
+
+def render_preprocessed_voiceover_shards(voiceovers, shards, mood_phrase_in_every_shard, emotion=None, speech_rate=0):
+    """Stitch the decoded shards of a take and render it, in one call so it can run on a worker process."""
+    voiceover = stitch_voiceover_shards(voiceovers, shards, mood_phrase_in_every_shard)
+    return render_preprocessed_voiceover(voiceover, emotion, speech_rate)
 
 def convert_wav_to_mp3_audio_segment(wav_audio_segment):
     """
@@ -0,0 +1,180 @@
+# Relative path: workspace.py
+"""
+Scoped scratch directories for the files a request has to put on disk (e.g. the input and output
+of SoundTouch), in place of the shared data/workdir.
+
+    with scratch_workspace("speech_rate", expected_bytes=2 * audio.samples.nbytes) as workspace:
+        input_path = workspace_path(workspace, "input.wav")
+
+Every workspace is a private directory (mkdtemp) under the scratch root: SCRATCH_DIR when set,
+else the RAM backed /dev/shm with SCRATCH_IN_MEMORY, else data/workdir. Its name carries the pid
+of its owner, and it is removed when the block exits, however it exits. Quotas:
+  - one workspace holds at most SCRATCH_WORKSPACE_MAX_BYTES, checked on entry against the bytes
+    the caller expects to write, and by check_workspace_quota() once they are written,
+  - all workspaces of the host hold at most SCRATCH_MAX_BYTES, and no more than the free space of
+    the root. Entry reserves the expected bytes under a file lock, so concurrent requests cannot
+    both count on the same free space.
+The janitor (collect_scratch_garbage, run by the scheduler every SCRATCH_JANITOR_INTERVAL seconds)
+removes the workspaces of processes that died, and those older than SCRATCH_MAX_AGE. Files
+outside of workspaces are removed once older than SCRATCH_MAX_AGE, or oldest first while the
+root is over its quota.
+"""
+import os
+import time
+import fcntl
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+
+from config import Config
+from data_classes import ScratchWorkspace
+from processes import process_is_alive
+
+config = Config()
+logger = logging.getLogger(__name__)
+
+IN_MEMORY_ROOT = "/dev/shm/pyro_scratch"
+DISK_ROOT = "data/workdir"
+LOCK_FILENAME = ".lock"
+RESERVATION_FILENAME = ".reserved"
+
+
+def scratch_root():
+    if config.SCRATCH_DIR:
+        return config.SCRATCH_DIR
+    if config.SCRATCH_IN_MEMORY and os.access(os.path.dirname(IN_MEMORY_ROOT), os.W_OK):
+        return IN_MEMORY_ROOT
+    return DISK_ROOT
+
+@contextmanager
+def _scratch_lock(root):
+    """Exclusive lock on the scratch root, shared by every process on the host."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILENAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _directory_bytes(directory):
+    total = 0
+    for parent, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(parent, filename))
+            except FileNotFoundError:
+                pass
+    return total
+
+def _entry_bytes(path):
+    """Bytes used by an entry of the root: what a workspace holds, or reserved if it holds less yet."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    try:
+        with open(os.path.join(path, RESERVATION_FILENAME)) as reservation_file:
+            reserved = int(reservation_file.read() or 0)
+    except (FileNotFoundError, ValueError):
+        reserved = 0
+    return max(reserved, _directory_bytes(path))
+
+def _owner_pid(path):
+    """The pid in the name of a workspace (<purpose>-<pid>-<random>), None for anything else."""
+    if not os.path.isdir(path):
+        return None
+    parts = os.path.basename(path).rsplit("-", 2)
+    return int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else None
+
+def _scan_root(root):
+    """(mtime, path, bytes) of the entries of the root, oldest first."""
+    entries = []
+    for name in os.listdir(root):
+        if name == LOCK_FILENAME:
+            continue
+        path = os.path.join(root, name)
+        try:
+            entries.append((os.path.getmtime(path), path, _entry_bytes(path)))
+        except FileNotFoundError:
+            continue  # Left by its owner meanwhile
+    return sorted(entries)
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def scratch_workspace(purpose, expected_bytes=0):
+    """
+    A private scratch directory for one request, removed on exit.
+
+    Parameters:
+    purpose (str): Short name of what the files are for, part of the directory name.
+    expected_bytes (int): Bytes the caller is about to write, reserved against the host quota.
+
+    Raises:
+    RuntimeError: When expected_bytes exceeds the quota of a workspace, or does not fit the host quota.
+    """
+    if expected_bytes > config.SCRATCH_WORKSPACE_MAX_BYTES:
+        raise RuntimeError(f"A {purpose} workspace of {expected_bytes} bytes exceeds SCRATCH_WORKSPACE_MAX_BYTES")
+    root = scratch_root()
+    with _scratch_lock(root):
+        used_bytes = sum(size for _, _, size in _scan_root(root))
+        available_bytes = min(config.SCRATCH_MAX_BYTES - used_bytes, shutil.disk_usage(root).free)
+        if expected_bytes > available_bytes:
+            raise RuntimeError(f"Not enough scratch space for {expected_bytes} bytes, {max(available_bytes, 0)} left")
+        directory = tempfile.mkdtemp(prefix=f"{purpose}-{os.getpid()}-", dir=root)
+        with open(os.path.join(directory, RESERVATION_FILENAME), "w") as reservation_file:
+            reservation_file.write(str(expected_bytes))
+
+    try:
+        yield ScratchWorkspace(directory=directory, max_bytes=config.SCRATCH_WORKSPACE_MAX_BYTES)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def workspace_path(workspace, filename):
+    return os.path.join(workspace.directory, filename)
+
+def check_workspace_quota(workspace):
+    """Raise a RuntimeError when the files written to the workspace exceed its quota."""
+    used_bytes = _directory_bytes(workspace.directory)
+    if used_bytes > workspace.max_bytes:
+        raise RuntimeError(f"Scratch workspace {workspace.directory} holds {used_bytes} bytes, "
+                           f"more than its quota of {workspace.max_bytes}")
+
+
+def collect_scratch_garbage(root=None):
+    """
+    Remove what requests left behind in the scratch root. Workspaces of live processes are kept
+    until they are older than SCRATCH_MAX_AGE.
+
+    Returns:
+    int: Bytes freed.
+    """
+    root = root or scratch_root()
+    if not os.path.isdir(root):
+        return 0
+    stale_before = time.time() - config.SCRATCH_MAX_AGE
+    freed_bytes = 0
+    with _scratch_lock(root):
+        entries = _scan_root(root)
+        used_bytes = sum(size for _, _, size in entries)
+        for mtime, path, size in entries:
+            pid = _owner_pid(path)
+            if pid is not None:
+                collect = mtime < stale_before or not process_is_alive(pid)
+            else:
+                # Files outside of workspaces, e.g. left in data/workdir by earlier versions
+                collect = mtime < stale_before or used_bytes - freed_bytes > config.SCRATCH_MAX_BYTES
+            if collect:
+                _remove(path)
+                freed_bytes += size
+    if freed_bytes:
+        logger.info("Scratch janitor freed %s bytes in %s", freed_bytes, root)
+    return freed_bytes